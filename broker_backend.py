@@ -0,0 +1,101 @@
+"""
+Broker Backend Interface
+PipSecureEA talks to its terminal only through a BrokerBackend, so the same EA code can
+run against the real MetaTrader5 terminal or the in-process simulated terminal
+(see simulated_mt5.py) used for benchmarks on machines without MT5.
+"""
+
+from abc import ABC, abstractmethod
+
+
+class BrokerBackend(ABC):
+    """
+    The subset of the MetaTrader5 API that PipSecureEA uses.
+    Method names and return shapes mirror the MetaTrader5 module so a backend
+    can be swapped in without touching the EA logic. A backend that misses one
+    of the methods fails when it is instantiated, not on its first order.
+    """
+
+    # True for backends that do not talk to a real broker
+    SIMULATED = False
+
+    @abstractmethod
+    def initialize(self, **kwargs):
+        raise NotImplementedError
+
+    @abstractmethod
+    def shutdown(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def last_error(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def account_info(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def terminal_info(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def positions_get(self, **filters):
+        raise NotImplementedError
+
+    @abstractmethod
+    def orders_get(self, **filters):
+        raise NotImplementedError
+
+    @abstractmethod
+    def order_send(self, request):
+        raise NotImplementedError
+
+    @abstractmethod
+    def symbol_info(self, symbol):
+        raise NotImplementedError
+
+    @abstractmethod
+    def symbol_info_tick(self, symbol):
+        raise NotImplementedError
+
+
+class MT5Backend(BrokerBackend):
+    """
+    Backend that forwards every call to a MetaTrader5 module.
+    Attributes are looked up on the module at call time, so patches applied to the
+    module (e.g. in confirm_ea_logic.py) are honoured.
+    """
+
+    def __init__(self, mt5_module):
+        self.mt5 = mt5_module
+
+    def initialize(self, **kwargs):
+        return self.mt5.initialize(**kwargs)
+
+    def shutdown(self):
+        return self.mt5.shutdown()
+
+    def last_error(self):
+        return self.mt5.last_error()
+
+    def account_info(self):
+        return self.mt5.account_info()
+
+    def terminal_info(self):
+        return self.mt5.terminal_info()
+
+    def positions_get(self, **filters):
+        return self.mt5.positions_get(**filters)
+
+    def orders_get(self, **filters):
+        return self.mt5.orders_get(**filters)
+
+    def order_send(self, request):
+        return self.mt5.order_send(request)
+
+    def symbol_info(self, symbol):
+        return self.mt5.symbol_info(symbol)
+
+    def symbol_info_tick(self, symbol):
+        return self.mt5.symbol_info_tick(symbol)
@@ -0,0 +1,208 @@
+"""
+Position Grouping Benchmark
+Compares the original nested-scan grouping with PositionGroupingEngine (sweep-line)
+on synthetic accounts of increasing size and checks both produce identical groups.
+
+Usage: python grouping_benchmark.py [max_positions] [legacy_limit]
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import tempfile
+from contextlib import contextmanager
+
+# The benchmark never talks to a terminal: load the EA against the simulated one
+os.environ.setdefault('PIP_SECURE_BACKEND', 'simulated')
+
+from multi_account_ea import PipSecureEA, mt5
+from simulated_mt5 import SimulatedMT5Backend, TradePosition
+
+SYMBOLS = {
+    'EURUSD': 1.08500, 'GBPUSD': 1.27000, 'USDJPY': 151.200, 'AUDUSD': 0.66000,
+    'USDCHF': 0.90500, 'EURCAD': 1.47000, 'XAUUSD': 2350.00, 'US30Cash': 39000.0,
+    'OILCash': 78.500, 'GER40Cash': 18200.0,
+}
+
+
+def legacy_group_positions(ea, positions):
+    """The original O(n^2) identify_position_groups loop, kept as the reference result"""
+    sorted_positions = sorted(positions, key=lambda p: (p.time, p.symbol, p.type))
+    position_groups = {}
+    group_counter = 0
+    processed_tickets = set()
+
+    for i, position in enumerate(sorted_positions):
+        if position.ticket in processed_tickets:
+            continue
+        current_group = [position]
+        processed_tickets.add(position.ticket)
+        group_id = f"{position.symbol}_{position.type}_{group_counter}"
+
+        for j in range(i + 1, len(sorted_positions)):
+            other_position = sorted_positions[j]
+            if other_position.ticket in processed_tickets:
+                continue
+            time_diff = abs(other_position.time - position.time)
+            if time_diff > ea.time_proximity_threshold:
+                continue
+            if (other_position.symbol == position.symbol and
+                other_position.type == position.type):
+                price_threshold = ea.get_price_proximity_threshold(position.symbol)
+                pip_multiplier = ea.get_pip_multiplier(position.symbol)
+                if pip_multiplier > 0:
+                    price_diff_in_pips = abs(other_position.price_open - position.price_open) / pip_multiplier
+                    if price_diff_in_pips <= price_threshold:
+                        current_group.append(other_position)
+                        processed_tickets.add(other_position.ticket)
+                else:
+                    current_group.append(other_position)
+                    processed_tickets.add(other_position.ticket)
+
+        if len(current_group) > 1:
+            position_groups[group_id] = current_group
+            group_counter += 1
+
+    return position_groups
+
+
+def generate_positions(count, seed=42):
+    """
+    Synthetic account: signals arrive every few seconds on random symbols, each signal
+    opening a basket of 2-4 positions within 3 seconds. Some signals stack a second
+    price level on the same symbol shortly after the first, and a few stray positions
+    are mixed in.
+    """
+    rng = random.Random(seed)
+    positions = []
+    ticket = 1000
+    now = int(time.time()) - 86400
+    symbols = list(SYMBOLS)
+
+    while len(positions) < count:
+        now += rng.randint(1, 8)
+        symbol = rng.choice(symbols)
+        side = rng.choice((mt5.ORDER_TYPE_BUY, mt5.ORDER_TYPE_SELL))
+        base = SYMBOLS[symbol] * (1 + rng.uniform(-0.01, 0.01))
+        levels = 2 if rng.random() < 0.2 else 1
+        for level in range(levels):
+            entry = base * (1 - 0.002 * level if side == mt5.ORDER_TYPE_BUY else 1 + 0.002 * level)
+            basket_size = 1 if rng.random() < 0.05 else rng.randint(2, 4)
+            for _ in range(basket_size):
+                ticket += 1
+                price = entry * (1 + rng.uniform(-0.00005, 0.00005))
+                positions.append(TradePosition(
+                    ticket=ticket, time=now + level * 2 + rng.randint(0, 3), time_msc=0, time_update=0,
+                    time_update_msc=0, type=side, magic=0, identifier=ticket, volume=0.01,
+                    price_open=price, sl=0.0, tp=0.0, price_current=price, swap=0.0, profit=0.0,
+                    symbol=symbol, comment=''
+                ))
+    rng.shuffle(positions)
+    return positions[:count]
+
+
+def time_call(func, *args, repeat=3):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def normalize(groups):
+    # The legacy loop numbers its groups; the engine derives IDs from the baskets
+    return sorted([p.ticket for p in group] for group in groups.values())
+
+
+@contextmanager
+def scratch_directory():
+    """
+    Run in a throwaway working directory. The EA writes its logs, key event journal and
+    heartbeat slot relative to the working directory, and none of that may end up in
+    the live tree (the monitor reads heartbeats/).
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='grouping_benchmark_') as scratch:
+        os.chdir(scratch)
+        try:
+            yield scratch
+        finally:
+            os.chdir(cwd)
+
+
+def run_benchmark(max_positions=10000, legacy_limit=10000):
+    with scratch_directory():
+        ea = PipSecureEA({'name': 'Benchmark', 'login': 0, 'state_store': False}, backend=SimulatedMT5Backend())
+        ea.logger.setLevel(logging.WARNING)
+        try:
+            return compare_grouping(ea, max_positions, legacy_limit)
+        finally:
+            ea.stop_logging()
+            if ea.key_events is not None:
+                ea.key_events.close()
+
+
+def compare_grouping(ea, max_positions, legacy_limit):
+    print(f"{'positions':>10} | {'groups':>7} | {'legacy (ms)':>12} | {'engine (ms)':>12} | {'speedup':>8} | match")
+    print("-" * 72)
+    sizes = [n for n in (100, 1000, 2500, 5000, 10000) if n < max_positions] + [max_positions]
+    for size in sizes:
+        positions = generate_positions(size)
+        engine_time, engine_groups = time_call(ea.grouping_engine.group, positions)
+
+        if size <= legacy_limit:
+            legacy_time, legacy_groups = time_call(legacy_group_positions, ea, positions, repeat=1)
+            match = "OK" if normalize(legacy_groups) == normalize(engine_groups) else "MISMATCH"
+            legacy_str = f"{legacy_time * 1000:12.1f}"
+            speedup = f"{legacy_time / engine_time:7.1f}x"
+        else:
+            legacy_str, speedup, match = f"{'skipped':>12}", f"{'-':>8}", "-"
+
+        print(f"{size:>10} | {len(engine_groups):>7} | {legacy_str} | {engine_time * 1000:12.1f} | {speedup} | {match}")
+        if match == "MISMATCH":
+            print("ERROR: engine groups differ from the legacy implementation")
+            return False
+
+    run_incremental_benchmark(ea, max_positions)
+    return True
+
+
+def run_incremental_benchmark(ea, size, churn=0.01):
+    """Steady-state cycle cost of PositionGroupRegistry: price-only updates and small churn"""
+    positions = generate_positions(size)
+    registry = ea.group_registry
+    registry.reset()
+
+    start = time.perf_counter()
+    registry.update(positions)
+    initial_time = time.perf_counter() - start
+
+    moved = [p._replace(price_current=p.price_current * 1.0001) for p in positions]
+    price_time, _ = time_call(registry.update, moved)
+
+    churned = sorted(moved, key=lambda p: p.time)
+    drop = int(size * churn)
+    replacements = [p._replace(ticket=p.ticket + 10 ** 8) for p in generate_positions(drop, seed=99)]
+    churned = churned[drop:] + replacements
+    start = time.perf_counter()
+    registry.update(churned)
+    churn_time = time.perf_counter() - start
+
+    scratch_time, _ = time_call(ea.grouping_engine.group, churned)
+    print()
+    print(f"Incremental registry at {size} positions:")
+    print(f"  initial build:          {initial_time * 1000:8.1f} ms")
+    print(f"  price-only cycle:       {price_time * 1000:8.1f} ms")
+    print(f"  {churn:.0%} churn cycle:        {churn_time * 1000:8.1f} ms")
+    print(f"  full regroup (engine):  {scratch_time * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    max_positions = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    legacy_limit = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    ok = run_benchmark(max_positions, legacy_limit)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,235 @@
+"""
+Log Archive
+Compresses finished log segments (rotated pip_secure.log.YYYY-MM-DD files and the
+old monitor logs) with zstd when the `zstandard` package is installed, gzip otherwise,
+and reads/searches plain and compressed segments as streams - archives are never
+inflated to disk.
+
+PipSecureEA installs LogArchiver.namer/rotator on its TimedRotatingFileHandler, so a
+segment is compressed by a background thread right after rotation. Segments that already
+exist (older runs, committed logs) are only compressed by the explicit compress command.
+
+Usage:
+  python log_archive.py [--logs logs] compress [--name pip_secure.log ...]
+  python log_archive.py [--logs logs] search PATTERN [--account A] [--regex] [--ignore-case]
+"""
+
+import io
+import os
+import re
+import sys
+import glob
+import gzip
+import queue
+import shutil
+import logging
+import argparse
+import threading
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    zstandard = None
+    ZSTD_AVAILABLE = False
+
+ARCHIVE_EXTENSIONS = ('.gz', '.zst')
+
+# Rotating logs whose finished segments the archiver may compress
+ROTATED_LOGS = ('pip_secure.log', 'all_accounts.log', 'multi_account_monitor.log')
+
+# Rotated segment suffix: <basename>.YYYY-MM-DD[_HH[-MM[-SS]]]
+SEGMENT_SUFFIX = r'\.\d{4}-\d{2}-\d{2}(_\d{2}(-\d{2}){0,2})?$'
+
+
+def finished_segment_pattern(basenames=ROTATED_LOGS):
+    """Regex matching the finished (rotated, uncompressed) segments of the given log basenames"""
+    return re.compile('^(' + '|'.join(re.escape(name) for name in basenames) + ')' + SEGMENT_SUFFIX)
+
+
+def open_log(path, binary=False):
+    """Open a plain, .gz or .zst log segment as a streaming text (or binary) file"""
+    if path.endswith('.gz'):
+        stream = gzip.open(path, 'rb')
+    elif path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError(f"Cannot read {path}: the zstandard package is not installed")
+        stream = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    else:
+        stream = open(path, 'rb')
+    if binary:
+        return stream
+    return io.TextIOWrapper(stream, encoding='utf-8', errors='replace')
+
+
+def segment_sort_key(path):
+    """Oldest first: dated segments by date, the live file (no date) last"""
+    name = os.path.basename(path)
+    for ext in ARCHIVE_EXTENSIONS:
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    match = re.search(r'\.(\d{4}-\d{2}-\d{2}[\d_-]*)$', name)
+    return (os.path.dirname(path), match.group(1) if match else '9999')
+
+
+def find_segments(log_dir='logs', account=None):
+    """Every plain or compressed segment of the account logs (one account, or all)"""
+    pattern = os.path.join(log_dir, account or '*', 'pip_secure.log*')
+    return sorted((p for p in glob.glob(pattern) if not p.endswith('.tmp')), key=segment_sort_key)
+
+
+def search(pattern, paths, regex=False, ignore_case=False):
+    """Yield (path, line_number, line) for matching lines, streaming through each segment"""
+    if regex:
+        matcher = re.compile(pattern, re.IGNORECASE if ignore_case else 0).search
+    elif ignore_case:
+        needle = pattern.lower()
+        matcher = lambda line: needle in line.lower()
+    else:
+        matcher = lambda line: pattern in line
+    for path in paths:
+        try:
+            with open_log(path) as f:
+                for number, line in enumerate(f, 1):
+                    if matcher(line):
+                        yield path, number, line.rstrip('\n')
+        except (OSError, EOFError, RuntimeError) as e:
+            print(f"Error reading {path}: {e}", file=sys.stderr)
+
+
+class LogArchiver:
+    """
+    Background worker that compresses finished log segments. Compression streams the
+    segment into .tmp-<segment>.gz/.zst, renames it into place and then removes the
+    plain segment, so a crash never leaves a half-written archive under the final name.
+    The temp name starts with '.tmp-' so the rotating handler never counts it as a backup.
+    """
+
+    def __init__(self, logger=None, use_zstd=ZSTD_AVAILABLE, level=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.use_zstd = use_zstd and zstandard is not None
+        self.extension = '.zst' if self.use_zstd else '.gz'
+        self.level = level
+        self.queue = queue.Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.stats = {'compressed': 0, 'bytes_in': 0, 'bytes_out': 0, 'errors': 0}
+        self.thread = threading.Thread(target=self._work, name='LogArchiver', daemon=True)
+        self.thread.start()
+
+    # --- TimedRotatingFileHandler hooks ---
+    def namer(self, default_name):
+        return default_name + self.extension
+
+    def rotator(self, source, dest):
+        """Rotate like the default handler (rename), then compress in the background"""
+        plain = dest[:-len(self.extension)] if dest.endswith(self.extension) else dest
+        if os.path.exists(source):
+            os.rename(source, plain)
+            self.submit(plain)
+
+    # --- Queueing ---
+    def submit(self, path):
+        with self.lock:
+            if path in self.pending:
+                return
+            self.pending.add(path)
+        self.queue.put(path)
+
+    def sweep(self, log_dir, basenames=ROTATED_LOGS):
+        """Queue every finished, uncompressed segment of the basenames logs under log_dir"""
+        finished = finished_segment_pattern(basenames)
+        queued = 0
+        for root, _, files in os.walk(log_dir):
+            for name in files:
+                if finished.match(name):
+                    self.submit(os.path.join(root, name))
+                    queued += 1
+        return queued
+
+    def _work(self):
+        while True:
+            path = self.queue.get()
+            if path is None:
+                self.queue.task_done()
+                return
+            try:
+                self.compress(path)
+            except Exception as e:
+                self.stats['errors'] += 1
+                self.logger.error(f"Error compressing log segment {path}: {e}")
+            finally:
+                with self.lock:
+                    self.pending.discard(path)
+                self.queue.task_done()
+
+    def compress(self, path):
+        if not os.path.exists(path):
+            return
+        dest = path + self.extension
+        tmp = os.path.join(os.path.dirname(dest), '.tmp-' + os.path.basename(dest))
+        with open(path, 'rb') as source:
+            if self.use_zstd:
+                compressor = zstandard.ZstdCompressor(level=self.level or 10)
+                with open(tmp, 'wb') as out:
+                    compressor.copy_stream(source, out)
+            else:
+                with gzip.open(tmp, 'wb', compresslevel=self.level or 6) as out:
+                    shutil.copyfileobj(source, out, 1024 * 1024)
+        os.replace(tmp, dest)
+        bytes_in, bytes_out = os.path.getsize(path), os.path.getsize(dest)
+        os.remove(path)
+        self.stats['compressed'] += 1
+        self.stats['bytes_in'] += bytes_in
+        self.stats['bytes_out'] += bytes_out
+        self.logger.debug(f"Compressed {path} ({bytes_in} -> {bytes_out} bytes)")
+
+    def wait(self):
+        """Block until every queued segment has been compressed"""
+        self.queue.join()
+
+    def stop(self, timeout=30):
+        """Finish the queued segments and stop the worker"""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compress and search PipSecureEA log archives")
+    parser.add_argument('--logs', default='logs', help="log directory (default: logs)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    c = commands.add_parser('compress', help="compress every finished log segment")
+    c.add_argument('--name', action='append', dest='names',
+                   help=f"log basename to compress, repeatable (default: {', '.join(ROTATED_LOGS)})")
+    s = commands.add_parser('search', help="search plain and compressed account logs")
+    s.add_argument('pattern')
+    s.add_argument('--account')
+    s.add_argument('--regex', action='store_true')
+    s.add_argument('--ignore-case', '-i', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.command == 'compress':
+        archiver = LogArchiver()
+        queued = archiver.sweep(args.logs, args.names or ROTATED_LOGS)
+        archiver.wait()
+        archiver.stop()
+        stats = archiver.stats
+        print(f"Compressed {stats['compressed']}/{queued} segment(s) with {archiver.extension}: "
+              f"{stats['bytes_in'] / 1e6:.1f} MB -> {stats['bytes_out'] / 1e6:.1f} MB")
+        return 1 if stats['errors'] else 0
+
+    matches = 0
+    try:
+        for path, number, line in search(args.pattern, find_segments(args.logs, args.account),
+                                         regex=args.regex, ignore_case=args.ignore_case):
+            print(f"{path}:{number}: {line}")
+            matches += 1
+    except BrokenPipeError:
+        return 0
+    print(f"-- {matches} match(es)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
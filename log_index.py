@@ -0,0 +1,332 @@
+"""
+Log Index
+Incrementally ingests the EA's text logs into a local SQLite database indexed by
+account, ticket, group_id, symbol, event type and time, so incident forensics
+("everything about ticket X") is an index lookup instead of a grep over every
+rotated file.
+
+Sources:
+  logs/<account>/pip_secure.log*       - account logs ("2025-05-20 10:00:00,123 - INFO - ...")
+  logs/key_events*.log*                - key event journals ("[2025-05-20 10:00:00] [account] [EVENT] ...")
+
+Each file is tracked by a hash of its first line with the (uncompressed) byte offset
+ingested so far, so re-running only reads new lines, and a segment renamed by log rotation
+or compressed by log_archive is not ingested twice. Compressed segments (.gz/.zst) are
+read as streams.
+
+Usage:
+  python log_index.py [--logs logs] [--db logs/log_index.sqlite] ingest
+  python log_index.py [--logs logs] [--db ...] query [--ticket T] [--group G] [--symbol S] [--account A]
+                            [--event E] [--level L] [--since "YYYY-MM-DD HH:MM"] [--until ...]
+                            [--text SUBSTRING] [--limit N] [--no-ingest]
+"""
+
+import os
+import re
+import sys
+import glob
+import time
+import hashlib
+import sqlite3
+import argparse
+from datetime import datetime
+
+from log_archive import open_log, ARCHIVE_EXTENSIONS
+
+DEFAULT_LOG_DIR = 'logs'
+DEFAULT_DB_PATH = os.path.join(DEFAULT_LOG_DIR, 'log_index.sqlite')
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file_key TEXT PRIMARY KEY,      -- "<kind>:<account>:<sha1 of first line>", stable across rotation and compression
+    path TEXT NOT NULL,
+    offset INTEGER NOT NULL,        -- uncompressed bytes ingested
+    last_record_id INTEGER,
+    done INTEGER NOT NULL DEFAULT 0 -- compressed segment fully ingested (archives never change)
+);
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    account TEXT,
+    level TEXT,
+    event_type TEXT,
+    symbol TEXT,
+    group_id TEXT,
+    message TEXT NOT NULL,
+    source TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS record_tickets (
+    ticket INTEGER NOT NULL,
+    record_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_records_account_ts ON records(account, ts);
+CREATE INDEX IF NOT EXISTS idx_records_event_ts ON records(event_type, ts);
+CREATE INDEX IF NOT EXISTS idx_records_symbol_ts ON records(symbol, ts);
+CREATE INDEX IF NOT EXISTS idx_records_group ON records(group_id);
+CREATE INDEX IF NOT EXISTS idx_records_ts ON records(ts);
+CREATE INDEX IF NOT EXISTS idx_record_tickets_ticket ON record_tickets(ticket);
+"""
+
+ACCOUNT_LINE = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),(\d{3}) - ([A-Z]+) - (.*)$')
+KEY_EVENT_LINE = re.compile(r'^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\] \[([^\]]*)\] \[([A-Z0-9_]+)\] (.*)$')
+
+TICKET_PATTERN = re.compile(r'\b(?:position|ticket|order)s?[ =:#]*(\d{3,})\b', re.IGNORECASE)
+GROUP_PATTERN = re.compile(r'\b([A-Za-z0-9.]+_[01]_G?\d+\b|G\d+(?=_TP\d))')
+CURRENCIES = ('USD|EUR|GBP|JPY|CHF|CAD|AUD|NZD|XAU|XAG|SGD|HKD|NOK|SEK|DKK|ZAR|MXN|TRY|PLN|CNH')
+SYMBOL_PATTERN = re.compile(r'\b((?:%s){2}[a-z.]*|[A-Z]{2,5}\d{0,3}Cash|GOLD[A-Za-z]*)\b' % CURRENCIES)
+
+# Coarse event types for account log lines (key events carry their own), first match wins
+ACCOUNT_EVENTS = (
+    ('TP1 trigger condition met', 'TP1_TRIGGER'),
+    ('Closed position', 'POSITION_CLOSED'),
+    ('Successfully secured position', 'POSITION_SECURED'),
+    ('Secured position', 'POSITION_SECURED'),
+    ('[SUCCESS RULE 2]', 'SECOND_PRICE_SECURED'),
+    ('Successfully deleted pending order', 'PENDING_DELETED'),
+    ('NOT fully secured', 'GROUP_SECURE_FAILED'),
+    ('fully secured', 'GROUP_SECURED'),
+    ('Retry ', 'RETRY_SCHEDULED'),
+    ('connection lost', 'CONNECTION_LOST'),
+    ('Connected to MT5 account', 'CONNECTED'),
+    ('Failed to', 'FAILURE'),
+)
+
+
+def open_index(db_path=DEFAULT_DB_PATH):
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+        # The index is derived data: rebuild it rather than migrate older file tracking
+        conn.executescript("DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS records; "
+                           "DROP TABLE IF EXISTS record_tickets;")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def discover_sources(log_dir=DEFAULT_LOG_DIR):
+    """[(path, account or None, kind)] for every log file the index understands"""
+    sources = []
+    for path in sorted(glob.glob(os.path.join(log_dir, '*', 'pip_secure.log*'))):
+        if path.endswith('.tmp'):
+            continue
+        account = os.path.basename(os.path.dirname(path))
+        sources.append((path, account, 'account'))
+    for path in sorted(glob.glob(os.path.join(log_dir, 'key_events*.log*'))):
+        if path.endswith('.tmp'):
+            continue
+        sources.append((path, None, 'key_events'))
+    return sources
+
+
+def extract_fields(message):
+    """(tickets, group_id, symbol) mentioned in a log message"""
+    tickets = {int(t) for t in TICKET_PATTERN.findall(message)}
+    group = GROUP_PATTERN.search(message)
+    symbol = SYMBOL_PATTERN.search(message)
+    return tickets, group.group(1) if group else None, symbol.group(1) if symbol else None
+
+
+def account_event_type(message):
+    for needle, event in ACCOUNT_EVENTS:
+        if needle in message:
+            return event
+    return None
+
+
+def parse_line(line, account, kind):
+    """Parsed record dict for a log line, or None for a continuation line (e.g. traceback)"""
+    if kind == 'key_events':
+        match = KEY_EVENT_LINE.match(line)
+        if not match:
+            return None
+        stamp, account, event_type, message = match.groups()
+        ts = datetime.strptime(stamp, '%Y-%m-%d %H:%M:%S').timestamp()
+        level = 'KEY'
+    else:
+        match = ACCOUNT_LINE.match(line)
+        if not match:
+            return None
+        stamp, millis, level, message = match.groups()
+        ts = datetime.strptime(stamp, '%Y-%m-%d %H:%M:%S').timestamp() + int(millis) / 1000
+        event_type = account_event_type(message)
+    tickets, group_id, symbol = extract_fields(message)
+    return {'ts': ts, 'account': account, 'level': level, 'event_type': event_type,
+            'symbol': symbol, 'group_id': group_id, 'message': message, 'tickets': tickets}
+
+
+def ingest_file(conn, path, account, kind):
+    """Ingest the new complete lines of one file. Returns the number of records added."""
+    archived = path.endswith(ARCHIVE_EXTENSIONS)
+    if archived and conn.execute("SELECT 1 FROM files WHERE path = ? AND done = 1", (path,)).fetchone():
+        return 0
+    try:
+        f = open_log(path, binary=True)
+    except (OSError, RuntimeError):
+        return 0
+    with f:
+        first_line = f.readline()
+        if not first_line.endswith(b'\n'):
+            return 0
+        file_key = f"{kind}:{account or ''}:{hashlib.sha1(first_line).hexdigest()}"
+        row = conn.execute("SELECT offset, last_record_id FROM files WHERE file_key = ?", (file_key,)).fetchone()
+        offset, last_record_id = row if row else (0, None)
+        if not archived:
+            size = os.fstat(f.fileno()).st_size
+            if size < offset:
+                # Truncated and rewritten with the same first line - start over
+                offset, last_record_id = 0, None
+            if size == offset:
+                if row:
+                    # Nothing new; keep the recorded path current (the file may have been rotated)
+                    conn.execute("UPDATE files SET path = ? WHERE file_key = ?", (path, file_key))
+                return 0
+        if offset == 0:
+            data = first_line + f.read()
+        else:
+            # Compressed streams only seek forward (by decompressing), which is all this needs
+            f.seek(offset)
+            data = f.read()
+    # Only complete lines; a partially written last line is picked up next time
+    end = data.rfind(b'\n') + 1
+    if end == 0:
+        if archived and row:
+            conn.execute("UPDATE files SET path = ?, done = 1 WHERE file_key = ?", (path, file_key))
+        return 0
+
+    added = 0
+    source = os.path.basename(path)
+    for raw in data[:end].decode('utf-8', errors='replace').splitlines():
+        line = raw.rstrip('\r')
+        if not line.strip():
+            continue
+        record = parse_line(line, account, kind)
+        if record is None:
+            # Continuation of the previous record (multi-line message / traceback)
+            if last_record_id is not None:
+                conn.execute("UPDATE records SET message = message || char(10) || ? WHERE id = ?", (line, last_record_id))
+            continue
+        cursor = conn.execute(
+            "INSERT INTO records (ts, account, level, event_type, symbol, group_id, message, source) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (record['ts'], record['account'], record['level'], record['event_type'],
+             record['symbol'], record['group_id'], record['message'], source)
+        )
+        last_record_id = cursor.lastrowid
+        if record['tickets']:
+            conn.executemany("INSERT INTO record_tickets (ticket, record_id) VALUES (?, ?)",
+                             [(ticket, last_record_id) for ticket in record['tickets']])
+        added += 1
+
+    conn.execute(
+        "INSERT INTO files (file_key, path, offset, last_record_id, done) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(file_key) DO UPDATE SET path = excluded.path, offset = excluded.offset, "
+        "last_record_id = excluded.last_record_id, done = excluded.done",
+        (file_key, path, offset + end, last_record_id, int(archived))
+    )
+    return added
+
+
+def ingest(conn, log_dir=DEFAULT_LOG_DIR):
+    """Ingest every known log file incrementally. Returns {path: records added}."""
+    added = {}
+    for path, account, kind in discover_sources(log_dir):
+        with conn:
+            count = ingest_file(conn, path, account, kind)
+        if count:
+            added[path] = count
+    return added
+
+
+def query(conn, ticket=None, group_id=None, symbol=None, account=None, event_type=None,
+          level=None, since=None, until=None, text=None, limit=200):
+    """Records matching every given filter, oldest first"""
+    sql = "SELECT r.ts, r.account, r.level, r.event_type, r.message FROM records r"
+    clauses, params = [], []
+    if ticket is not None:
+        sql += " JOIN record_tickets t ON t.record_id = r.id"
+        clauses.append("t.ticket = ?")
+        params.append(int(ticket))
+    for column, value in (('r.group_id', group_id), ('r.symbol', symbol), ('r.account', account),
+                          ('r.event_type', event_type), ('r.level', level)):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    if since is not None:
+        clauses.append("r.ts >= ?")
+        params.append(since)
+    if until is not None:
+        clauses.append("r.ts <= ?")
+        params.append(until)
+    if text:
+        clauses.append("r.message LIKE ?")
+        params.append(f"%{text}%")
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    # Newest `limit` matches, returned in time order
+    sql = f"SELECT * FROM ({sql} ORDER BY r.ts DESC, r.id DESC LIMIT ?) ORDER BY ts"
+    params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+
+def parse_time(value):
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"Invalid time '{value}' (expected YYYY-MM-DD [HH:MM[:SS]])")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index and query PipSecureEA logs")
+    parser.add_argument('--logs', default=DEFAULT_LOG_DIR, help="log directory (default: logs)")
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help="index database (default: logs/log_index.sqlite)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('ingest', help="ingest new log lines")
+
+    q = commands.add_parser('query', help="query the index (ingests new lines first)")
+    q.add_argument('--ticket', type=int)
+    q.add_argument('--group', dest='group_id')
+    q.add_argument('--symbol')
+    q.add_argument('--account')
+    q.add_argument('--event', dest='event_type')
+    q.add_argument('--level')
+    q.add_argument('--since', type=parse_time)
+    q.add_argument('--until', type=parse_time)
+    q.add_argument('--text')
+    q.add_argument('--limit', type=int, default=200)
+    q.add_argument('--no-ingest', action='store_true', help="query without ingesting new lines")
+
+    args = parser.parse_args(argv)
+    conn = open_index(args.db)
+
+    if args.command == 'ingest' or not args.no_ingest:
+        start = time.perf_counter()
+        added = ingest(conn, args.logs)
+        if args.command == 'ingest':
+            for path, count in added.items():
+                print(f"{path}: {count} records")
+            print(f"Ingested {sum(added.values())} records from {len(added)} file(s) in {time.perf_counter() - start:.2f}s")
+            return 0
+
+    start = time.perf_counter()
+    rows = query(conn, ticket=args.ticket, group_id=args.group_id, symbol=args.symbol,
+                 account=args.account, event_type=args.event_type, level=args.level,
+                 since=args.since, until=args.until, text=args.text, limit=args.limit)
+    elapsed = (time.perf_counter() - start) * 1000
+    for ts, account, level, event_type, message in rows:
+        stamp = datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+        event = f" [{event_type}]" if event_type else ""
+        print(f"{stamp} [{account}] {level}{event} {message}")
+    print(f"-- {len(rows)} record(s) in {elapsed:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,29 +1,209 @@
 # --- START OF FILE multi_account_ea.py ---
 
-import MetaTrader5 as mt5
+import os
+
+# The simulated terminal (same constants and API as MetaTrader5) is only ever loaded on
+# request, e.g. PIP_SECURE_BACKEND=simulated on Linux build boxes and for benchmarks.
+# Without it a missing MetaTrader5 package is an ImportError: a misconfigured machine
+# must not quietly run the EA against a fake terminal.
+if os.environ.get('PIP_SECURE_BACKEND', '').strip().lower() == 'simulated':
+    import simulated_mt5 as mt5
+    MT5_AVAILABLE = False
+else:
+    import MetaTrader5 as mt5
+    MT5_AVAILABLE = True
 import time
 from datetime import datetime, timedelta
+import math
+import random
 import logging
-from logging.handlers import TimedRotatingFileHandler
-import os
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
+import atexit
+import queue
+import threading
 import json
 import sys
+import mmap
+import struct
+import pickle
+from contextlib import contextmanager
+import multiprocessing
+import multiprocessing.connection
 from multiprocessing import Process
+from collections import namedtuple, deque, OrderedDict
 import types # types might not be needed anymore unless used dynamically elsewhere
+from broker_backend import MT5Backend
+from log_archive import LogArchiver
+from state_store import StateStore, SnapshotJournal, StateSnapshotFile
+import sqlite3
 
 # ------------------------------------------------------------------------
 # HEARTBEAT MONITORING SYSTEM (Placed earlier for clarity)
 # ------------------------------------------------------------------------
 
+# Status of one account as read from its heartbeat slot
+HeartbeatSlot = namedtuple('HeartbeatSlot', [
+    'account', 'pid', 'monotonic_ts', 'wall_ts', 'cycles', 'last_cycle_duration', 'errors', 'age_seconds'
+])
+
+
+class HeartbeatSlots:
+    """
+    Fixed-layout, memory-mapped heartbeat file (heartbeats/heartbeats.slots) with one
+    slot per account. A beat is a handful of stores into the mapping - no open/write/
+    close per beat. Each slot is guarded by a sequence counter (odd while a write is in
+    progress), so readers take a consistent snapshot of every account without locks.
+
+    Layout: 64-byte header (magic, version, slot count), then SLOT_SIZE bytes per slot:
+    seq u64 | account name 48s | pid i64 | monotonic ts f64 | wall ts f64 |
+    cycles u64 | last cycle duration f64 | errors u64
+    """
+
+    MAGIC = b'PSHB'
+    VERSION = 1
+    HEADER = struct.Struct('<4sII')
+    HEADER_SIZE = 64
+    SLOT_SIZE = 128
+    SEQ = struct.Struct('<Q')
+    NAME = struct.Struct('<48s')
+    FIELDS = struct.Struct('<qddQdQ')    # pid, monotonic ts, wall ts, cycles, duration, errors
+    FIELDS_OFFSET = SEQ.size + NAME.size
+    FILE_NAME = 'heartbeats.slots'
+
+    def __init__(self, heartbeat_dir='heartbeats', slot_count=64, readonly=False):
+        self.path = os.path.join(heartbeat_dir, self.FILE_NAME)
+        self.readonly = readonly
+        if not readonly:
+            self._create(slot_count)
+        self.file = open(self.path, 'rb' if readonly else 'r+b')
+        access = mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=access)
+        magic, version, self.slot_count = self.HEADER.unpack_from(self.mm, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(f"{self.path} is not a version {self.VERSION} heartbeat slot file")
+
+    def _create(self, slot_count):
+        if os.path.exists(self.path):
+            return
+        with self._claim_lock():
+            if os.path.exists(self.path):
+                return
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                header = self.HEADER.pack(self.MAGIC, self.VERSION, slot_count)
+                f.write(header.ljust(self.HEADER_SIZE, b'\0'))
+                f.write(b'\0' * (self.SLOT_SIZE * slot_count))
+            os.replace(tmp_path, self.path)
+
+    @contextmanager
+    def _claim_lock(self, timeout=5.0, stale_after=10.0):
+        """Exclusive lock file guarding slot-file creation and slot claims (rare operations)"""
+        lock_path = f"{self.path}.lock"
+        deadline = time.time() + timeout
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) > stale_after:
+                        os.remove(lock_path)  # left behind by a crashed process
+                        continue
+                except OSError:
+                    continue
+                if time.time() > deadline:
+                    raise TimeoutError(f"Could not acquire {lock_path}")
+                time.sleep(0.01)
+        try:
+            yield
+        finally:
+            os.close(fd)
+            try:
+                os.remove(lock_path)
+            except OSError:
+                pass
+
+    def _offset(self, index):
+        return self.HEADER_SIZE + index * self.SLOT_SIZE
+
+    def _name_at(self, index):
+        return self.NAME.unpack_from(self.mm, self._offset(index) + self.SEQ.size)[0].rstrip(b'\0')
+
+    def claim(self, account_name):
+        """Index of the slot owned by account_name (reused after a restart), claiming a free one if needed"""
+        encoded = account_name.encode('utf-8')[:self.NAME.size]
+        with self._claim_lock():
+            free = None
+            for index in range(self.slot_count):
+                name = self._name_at(index)
+                if name == encoded:
+                    return index
+                if not name and free is None:
+                    free = index
+            if free is None:
+                raise RuntimeError(f"No free heartbeat slot for {account_name} ({self.slot_count} slots in use)")
+            self.NAME.pack_into(self.mm, self._offset(free) + self.SEQ.size, encoded)
+            return free
+
+    def write(self, index, pid, cycles, last_cycle_duration, errors):
+        """Publish one beat into slot index (seqlock: odd sequence while writing)"""
+        offset = self._offset(index)
+        seq = self.SEQ.unpack_from(self.mm, offset)[0]
+        self.SEQ.pack_into(self.mm, offset, seq + 1)
+        self.FIELDS.pack_into(self.mm, offset + self.FIELDS_OFFSET, pid, time.monotonic(), time.time(),
+                              cycles, last_cycle_duration, errors)
+        self.SEQ.pack_into(self.mm, offset, seq + 2)
+
+    def read(self, index, retries=100):
+        """Consistent HeartbeatSlot for slot index, or None if it is unused/never written"""
+        offset = self._offset(index)
+        for _ in range(retries):
+            seq_before = self.SEQ.unpack_from(self.mm, offset)[0]
+            if seq_before % 2:
+                continue  # writer in progress
+            raw = self.mm[offset:offset + self.SLOT_SIZE]
+            if self.SEQ.unpack_from(self.mm, offset)[0] != seq_before:
+                continue
+            if seq_before == 0:
+                return None
+            name = self.NAME.unpack_from(raw, self.SEQ.size)[0].rstrip(b'\0').decode('utf-8', errors='replace')
+            pid, monotonic_ts, wall_ts, cycles, duration, errors = self.FIELDS.unpack_from(raw, self.FIELDS_OFFSET)
+            return HeartbeatSlot(name, pid, monotonic_ts, wall_ts, cycles, duration, errors,
+                                 time.monotonic() - monotonic_ts)
+        return None
+
+    def snapshot(self):
+        """{account: HeartbeatSlot} for every account that has beaten at least once"""
+        slots = {}
+        for index in range(self.slot_count):
+            if not self._name_at(index):
+                continue
+            slot = self.read(index)
+            if slot is not None:
+                slots[slot.account] = slot
+        return slots
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+
 class HeartbeatMonitor:
     """
     A simple heartbeat monitoring system to track EA activity
     and detect when the EA becomes unresponsive.
+    Beats go to this account's slot in the shared HeartbeatSlots file.
     """
-    def __init__(self, account_name, heartbeat_dir='heartbeats'):
+    def __init__(self, account_name, heartbeat_dir='heartbeats', readonly=False):
         self.account_name = account_name
         self.heartbeat_dir = heartbeat_dir
-        self.heartbeat_file = os.path.join(heartbeat_dir, f"{account_name}_heartbeat.txt")
+        self.pid = os.getpid()
+        self.cycles = 0
+        self.beats = 0
+        self.write_errors = 0  # failed beats; a run of them looks like a dead EA to the standby
+        self.last_write_error = None
+        self.slots = None
+        self.slot_index = None
 
         # Create heartbeat directory if it doesn't exist
         if not os.path.exists(heartbeat_dir):
@@ -34,44 +214,1501 @@ class HeartbeatMonitor:
                 if not os.path.isdir(heartbeat_dir):
                     print(f"Error creating heartbeat directory {heartbeat_dir}: {e}") # Use print as logger might not be set up yet
 
-
-    def update_heartbeat(self):
-        """Update the heartbeat file with current timestamp"""
         try:
-            current_time = datetime.now()
-            with open(self.heartbeat_file, 'w') as f:
-                f.write(f"Last active: {current_time.strftime('%Y-%m-%d %H:%M:%S')}")
+            self.slots = HeartbeatSlots(heartbeat_dir, readonly=readonly)
+            if not readonly:
+                self.slot_index = self.slots.claim(account_name)
         except Exception as e:
-            # Fail silently or log if logger is available
-            # print(f"Error updating heartbeat for {self.account_name}: {e}") # Optional: print error
-            pass
+            print(f"Error opening heartbeat slots for {account_name}: {e}") # Use print as logger might not be set up yet
+            self.slots = None
 
-    def get_last_heartbeat(self):
-        """Get the timestamp of the last heartbeat"""
+    def update_heartbeat(self, cycle_duration=None, error_count=0):
+        """
+        Publish a beat; cycle_duration (seconds) is given once per completed check cycle.
+        Returns False if the beat could not be written (counted in write_errors).
+        """
+        if self.slots is None or self.slot_index is None:
+            return True  # heartbeat disabled - already reported when the slots failed to open
         try:
-            if not os.path.exists(self.heartbeat_file):
-                return None
+            if cycle_duration is not None:
+                self.cycles += 1
+            self.slots.write(self.slot_index, self.pid, self.cycles, cycle_duration or 0.0, error_count)
+            self.beats += 1
+            return True
+        except Exception as e:
+            self.write_errors += 1
+            self.last_write_error = str(e)
+            return False
 
-            with open(self.heartbeat_file, 'r') as f:
-                content = f.read()
+    def get_slot(self):
+        """This account's HeartbeatSlot, or None"""
+        if self.slots is None:
+            return None
+        if self.slot_index is not None:
+            return self.slots.read(self.slot_index)
+        return self.slots.snapshot().get(self.account_name)
+
+    def holds_lease(self):
+        """
+        False once another process has beaten in this account's slot since our own last
+        beat - a warm standby that took over. The slot doubles as the account's lease.
+        """
+        if self.beats == 0:
+            return True
+        slot = self.get_slot()
+        return slot is None or slot.pid == self.pid
 
-            # Extract timestamp from "Last active: YYYY-MM-DD HH:MM:SS"
-            timestamp_str = content.replace("Last active: ", "").strip()
-            return datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-        except Exception:
+    def get_last_heartbeat(self):
+        """Get the timestamp of the last heartbeat"""
+        slot = self.get_slot()
+        if slot is None:
             return None
+        return datetime.fromtimestamp(slot.wall_ts)
 
     def is_stale(self, max_age_minutes=5):
         """Check if heartbeat is stale (older than max_age_minutes)"""
-        last_heartbeat = self.get_last_heartbeat()
-        if last_heartbeat is None:
-            # If no heartbeat file exists yet, consider it potentially stale
+        slot = self.get_slot()
+        if slot is None:
+            # If no heartbeat exists yet, consider it potentially stale
             # This might need adjustment based on expected startup time
             return True
+        return slot.age_seconds / 60 > max_age_minutes
+
+
+# ------------------------------------------------------------------------
+# PER-CYCLE BROKER SNAPSHOT
+# ------------------------------------------------------------------------
+
+PENDING_ORDER_TYPES_BY_SIDE = {
+    mt5.ORDER_TYPE_BUY: (mt5.ORDER_TYPE_BUY_LIMIT, mt5.ORDER_TYPE_BUY_STOP),
+    mt5.ORDER_TYPE_SELL: (mt5.ORDER_TYPE_SELL_LIMIT, mt5.ORDER_TYPE_SELL_STOP),
+}
+
+
+class BrokerSnapshot:
+    """
+    Read-only view of an account's open positions (and, on first use, its orders)
+    taken once per check_positions cycle. Every stage of the cycle reads from it, so
+    terminal round-trips per cycle stay constant regardless of position/group count.
+    Order paths record their successful requests in it (apply_sltp, remove,
+    remove_order), so later stages of the same cycle never act on closed tickets or
+    on stop levels that have already been moved.
+    """
+    def __init__(self, positions, orders_loader=None, taken_at=None):
+        self.taken_at = taken_at if taken_at is not None else time.time()
+        self.positions = tuple(positions)
+
+        self._by_ticket = {}
+        by_symbol = {}
+        by_side = {}
+        for pos in self.positions:
+            self._by_ticket[pos.ticket] = pos
+            by_symbol.setdefault(pos.symbol, []).append(pos)
+            by_side.setdefault((pos.symbol, pos.type), []).append(pos)
+        self._by_symbol = {k: tuple(v) for k, v in by_symbol.items()}
+        self._by_side = {k: tuple(v) for k, v in by_side.items()}
+        self.by_ticket = types.MappingProxyType(self._by_ticket)
+        self.by_symbol = types.MappingProxyType(self._by_symbol)
+        self.by_side = types.MappingProxyType(self._by_side)
+
+        # Orders are only needed when an action fires, so fetch them lazily (at most once)
+        self._orders_loader = orders_loader
+        self._orders = None
+        self._orders_by_symbol = None
+        self.orders_error = None
+
+    @classmethod
+    def take(cls, broker):
+        """Fetch positions from the broker. Returns None if the terminal call fails."""
+        positions = broker.positions_get()
+        if positions is None:
+            return None
+        return cls(positions, orders_loader=broker.orders_get)
+
+    def position(self, ticket):
+        return self.by_ticket.get(ticket)
+
+    def positions_for(self, symbol, position_type=None):
+        if position_type is None:
+            return self.by_symbol.get(symbol, ())
+        return self.by_side.get((symbol, position_type), ())
+
+    def apply_sltp(self, ticket, sl=None, tp=None):
+        """Record a successful SLTP modification of an open position"""
+        pos = self._by_ticket.get(ticket)
+        if pos is None:
+            return
+        changes = {name: value for name, value in (('sl', sl), ('tp', tp)) if value is not None}
+        if hasattr(pos, '_replace'):
+            updated = pos._replace(**changes)
+        else:
+            updated = types.SimpleNamespace(**dict(pos._asdict(), **changes))
+        self._swap(pos, updated)
+
+    def remove(self, ticket):
+        """Record that a position was closed"""
+        pos = self._by_ticket.get(ticket)
+        if pos is not None:
+            self._swap(pos, None)
+
+    def _swap(self, old, new):
+        """Replace (new) or drop (None) position old in every index"""
+        if new is None:
+            del self._by_ticket[old.ticket]
+        else:
+            self._by_ticket[old.ticket] = new
+        replace = lambda group: tuple(p for p in (new if p is old else p for p in group) if p is not None)
+        self.positions = replace(self.positions)
+        self._by_symbol[old.symbol] = replace(self._by_symbol[old.symbol])
+        self._by_side[(old.symbol, old.type)] = replace(self._by_side[(old.symbol, old.type)])
+
+    @property
+    def orders(self):
+        """All orders for the account, fetched from the broker on first access"""
+        if self._orders is None:
+            orders = self._orders_loader() if self._orders_loader else ()
+            if orders is None:
+                self.orders_error = "orders_get returned None"
+                orders = ()
+            self._orders = tuple(orders)
+            by_symbol = {}
+            for order in self._orders:
+                by_symbol.setdefault(order.symbol, []).append(order)
+            self._orders_by_symbol = types.MappingProxyType({k: tuple(v) for k, v in by_symbol.items()})
+        return self._orders
+
+    def orders_for(self, symbol, position_type=None):
+        """Orders for a symbol, optionally only the pending types matching a position direction"""
+        self.orders  # Ensure loaded
+        orders = self._orders_by_symbol.get(symbol, ())
+        if position_type is None:
+            return orders
+        wanted = PENDING_ORDER_TYPES_BY_SIDE.get(position_type, ())
+        return tuple(o for o in orders if o.type in wanted)
+
+    def remove_order(self, ticket):
+        """Record that a pending order was deleted (no-op if the orders were never fetched)"""
+        if self._orders is None:
+            return
+        self._orders = tuple(o for o in self._orders if o.ticket != ticket)
+        self._orders_by_symbol = types.MappingProxyType({
+            symbol: tuple(o for o in orders if o.ticket != ticket)
+            for symbol, orders in self._orders_by_symbol.items()
+        })
+
+
+# ------------------------------------------------------------------------
+# POSITION GROUPING ENGINE
+# ------------------------------------------------------------------------
+
+# Reverse-index entry: which group a ticket belongs to and its TP level in that group
+GroupMembership = namedtuple('GroupMembership', ['group_id', 'group', 'tp_index'])
+
+
+class GroupAggregate:
+    """Running entry-price statistics for one position group, updated as members change"""
+    __slots__ = ('count', 'entry_sum', 'entry_min', 'entry_max')
+
+    def __init__(self):
+        self.count = 0
+        self.entry_sum = 0.0
+        self.entry_min = None
+        self.entry_max = None
+
+    def add(self, position):
+        price = position.price_open
+        self.count += 1
+        self.entry_sum += price
+        self.entry_min = price if self.entry_min is None else min(self.entry_min, price)
+        self.entry_max = price if self.entry_max is None else max(self.entry_max, price)
+
+    def remove(self, position, remaining_group):
+        """Remove a member; min/max are rescanned only if the removed entry was an extreme"""
+        price = position.price_open
+        self.count -= 1
+        self.entry_sum -= price
+        if self.count <= 0:
+            self.count, self.entry_sum, self.entry_min, self.entry_max = 0, 0.0, None, None
+        elif price == self.entry_min or price == self.entry_max:
+            prices = [p.price_open for p in remaining_group]
+            self.entry_min, self.entry_max = min(prices), max(prices)
+
+    @property
+    def average_entry(self):
+        return self.entry_sum / self.count if self.count else 0.0
+
+
+class PositionGroupingEngine:
+    """
+    Groups positions that belong to the same signal (same symbol and direction,
+    opened within time_threshold seconds and within a price threshold of the
+    group's first position).
+
+    Positions are partitioned by (symbol, type) and each partition is swept in
+    time order with a sliding window; price buckets one threshold wide limit the
+    candidates checked against each anchor. This is near-linear in the number of
+    positions and produces exactly the groups of the original nested scan.
+
+    Group IDs are derived from the basket itself (see group_id_for), not from a
+    counter, so the same basket gets the same ID every cycle and after a restart.
+    """
+    def __init__(self, time_threshold, pip_multiplier_func, price_threshold_func, logger=None):
+        self.time_threshold = time_threshold
+        self.get_pip_multiplier = pip_multiplier_func
+        self.get_price_threshold = price_threshold_func
+        self.logger = logger or logging.getLogger(__name__)
+        # group_id -> GroupAggregate for the most recent group() call
+        self.aggregates = {}
+
+    def group(self, positions):
+        """Return {group_id: [positions]} for every group with more than one position"""
+        self.aggregates = {}
+        position_groups = {}
+        for group, aggregate in self.find_groups(positions):
+            group_id = self.group_id_for(group, position_groups)
+            position_groups[group_id] = group
+            self.aggregates[group_id] = aggregate
+            self.log_group(group_id, group)
+        return position_groups
+
+    def find_groups(self, positions):
+        """
+        Return [(group, aggregate)] for every group with more than one position, ordered
+        by where each group's anchor appears in the global time-sorted list
+        """
+        if not positions:
+            return []
+
+        # Global order is (time, symbol, type); Python's sort is stable so ties keep input order
+        try:
+            sorted_positions = sorted(positions, key=lambda p: (p.time, p.symbol, p.type))
+        except Exception as e:
+            self.logger.error(f"Error sorting positions: {e}", exc_info=True)
+            sorted_positions = list(positions) # Use unsorted if sort fails
+
+        partitions = {}
+        for index, pos in enumerate(sorted_positions):
+            partitions.setdefault((pos.symbol, pos.type), []).append((index, pos))
+
+        found_groups = []  # (anchor global index, group, aggregate)
+        for (symbol, _), members in partitions.items():
+            found_groups.extend(self._sweep_partition(symbol, members))
+
+        # Group counter follows the order anchors appear in the global time-sorted list
+        found_groups.sort(key=lambda item: item[0])
+        return [(group, aggregate) for _, group, aggregate in found_groups]
+
+    @staticmethod
+    def signal_tag(position):
+        """Signal tag of a "G12345_TP2" style comment ("G12345"), or None"""
+        comment = getattr(position, 'comment', '') or ''
+        if "_TP" not in comment:
+            return None
+        return comment.split("_TP")[0].strip() or None
+
+    def group_id_for(self, group, taken=()):
+        """
+        Deterministic ID for a basket: "<symbol>_<type>_<signal tag>" when every tagged
+        member carries the same tag (survives the anchor closing at TP1), otherwise
+        "<symbol>_<type>_<anchor ticket>" for the earliest opened position. An ID already
+        used by another live group (a reused tag) falls back to the anchor ticket.
+        """
+        anchor = group[0]
+        tags = {self.signal_tag(pos) for pos in group}
+        tags.discard(None)
+        if len(tags) == 1:
+            group_id = f"{anchor.symbol}_{anchor.type}_{tags.pop()}"
+            if group_id not in taken:
+                return group_id
+        return f"{anchor.symbol}_{anchor.type}_{anchor.ticket}"
+
+    def can_join(self, anchor, position):
+        """True if position belongs to the group anchored by anchor (same rule as the sweep)"""
+        if position.symbol != anchor.symbol or position.type != anchor.type:
+            return False
+        if abs(position.time - anchor.time) > self.time_threshold:
+            return False
+        pip_multiplier = self.get_pip_multiplier(anchor.symbol)
+        if pip_multiplier > 0:
+            price_diff_in_pips = abs(position.price_open - anchor.price_open) / pip_multiplier
+            return price_diff_in_pips <= self.get_price_threshold(anchor.symbol)
+        return True
+
+    def log_group(self, group_id, group):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"Identified position group: {group_id} with {len(group)} positions")
+            for pos in group:
+                tp_val = getattr(pos, 'tp', 0) # Handle potential missing attribute in mocks/real data
+                self.logger.debug(f"  - Ticket: {pos.ticket}, Entry: {pos.price_open:.5f}, TP: {tp_val:.5f}, Time: {datetime.fromtimestamp(pos.time)}")
+
+    def _sweep_partition(self, symbol, members):
+        """
+        Sweep one (symbol, type) partition. members are (global_index, position) in time order.
+        Each unclaimed position becomes an anchor and claims every unclaimed later position
+        within time_threshold seconds and price_threshold pips of the anchor's entry.
+        """
+        pip_multiplier = self.get_pip_multiplier(symbol)
+        price_threshold = self.get_price_threshold(symbol)
+        price_window = price_threshold * pip_multiplier if pip_multiplier > 0 else 0
+
+        def bucket_of(pos):
+            # One bucket when price proximity is not checked (invalid pip multiplier)
+            return int(math.floor(pos.price_open / price_window)) if price_window > 0 else 0
+
+        buckets = {}      # bucket -> [member positions in window, in time order]
+        claimed = set()   # member positions (local index) already in a group or used as anchor
+        groups = []
+        right = 0         # next member to enter the window
+        count = len(members)
+
+        for local_index, (global_index, anchor) in enumerate(members):
+            if local_index in claimed:
+                continue
+            claimed.add(local_index)
+
+            # Extend the window to every member opened within time_threshold of the anchor
+            window_end = anchor.time + self.time_threshold
+            while right < count and members[right][1].time <= window_end:
+                buckets.setdefault(bucket_of(members[right][1]), []).append(right)
+                right += 1
+
+            anchor_bucket = bucket_of(anchor)
+            # +-2 buckets guards against floating point rounding at bucket edges
+            candidates = []
+            for bucket in range(anchor_bucket - 2, anchor_bucket + 3):
+                bucket_members = buckets.get(bucket)
+                if not bucket_members:
+                    continue
+                # Drop claimed members so later anchors don't rescan them
+                bucket_members[:] = [m for m in bucket_members if m not in claimed]
+                for m in bucket_members:
+                    if m > local_index:
+                        candidates.append(m)
+
+            current_group = [anchor]
+            aggregate = GroupAggregate()
+            aggregate.add(anchor)
+            for m in sorted(candidates):
+                other_position = members[m][1]
+                if pip_multiplier > 0:
+                    price_diff_in_pips = abs(other_position.price_open - anchor.price_open) / pip_multiplier
+                    if price_diff_in_pips > price_threshold:
+                        continue
+                current_group.append(other_position)
+                aggregate.add(other_position)
+                claimed.add(m)
+
+            # Only store groups with more than one position (representing multi-TP)
+            if len(current_group) > 1:
+                groups.append((global_index, current_group, aggregate))
+
+        return groups
+
+
+# ------------------------------------------------------------------------
+# INCREMENTAL POSITION GROUP REGISTRY
+# ------------------------------------------------------------------------
+
+class PositionGroupRegistry:
+    """
+    Keeps position groups alive across check_positions cycles.
+
+    Each update() diffs the open tickets against the previous cycle and applies only
+    the removals and inserts; positions whose ticket set is unchanged (price, SL/TP
+    updates) are refreshed in place without regrouping. Group IDs are assigned once
+    when a group forms (PositionGroupingEngine.group_id_for) and stay the same for
+    the life of the group.
+    """
+    def __init__(self, engine, tp_index_func, logger=None):
+        self.engine = engine
+        self.get_tp_index = tp_index_func
+        self.logger = logger or logging.getLogger(__name__)
+        self.reset()
+
+    def reset(self):
+        self.positions = {}        # ticket -> latest position object
+        self.groups = {}           # group_id -> [positions] (anchor first, time order)
+        self.aggregates = {}       # group_id -> GroupAggregate
+        self.ticket_index = {}     # ticket -> GroupMembership
+        self.ungrouped = {}        # (symbol, type) -> set of tickets not in any group
+        self.groups_by_side = {}   # (symbol, type) -> set of group_ids
+        self.stats = {'inserted': 0, 'removed': 0, 'regroup_runs': 0, 'groups_formed': 0, 'groups_dissolved': 0}
+
+    def update(self, positions):
+        """Bring the registry in line with this cycle's positions. Returns (groups, ticket_index)."""
+        current = {pos.ticket: pos for pos in positions}
+        previous_tickets = self.positions.keys()
+        removed = [t for t in previous_tickets if t not in current]
+        added = [pos for t, pos in current.items() if t not in self.positions]
+
+        for ticket in removed:
+            self._remove(ticket)
+        self.positions = current
+        if added:
+            self._insert(added)
+        self._refresh()
+
+        if removed or added:
+            self.logger.debug(f"Group registry: +{len(added)} / -{len(removed)} positions, {len(self.groups)} groups")
+        return self.groups, self.ticket_index
+
+    # --- Removals ---
+
+    def _remove(self, ticket):
+        self.stats['removed'] += 1
+        membership = self.ticket_index.pop(ticket, None)
+        if membership is None:
+            old = self.positions.get(ticket)
+            if old is not None:
+                self.ungrouped.get((old.symbol, old.type), set()).discard(ticket)
+            return
+
+        group_id, group, _ = membership
+        removed_position = next(p for p in group if p.ticket == ticket)
+        group.remove(removed_position)
+        self.aggregates[group_id].remove(removed_position, group)
+        if len(group) < 2:
+            # A single remaining position is standalone, as it would be when grouping from scratch
+            self._dissolve(group_id)
+
+    def _dissolve(self, group_id):
+        self.stats['groups_dissolved'] += 1
+        group = self.groups.pop(group_id)
+        self.groups_by_side.get((group[0].symbol, group[0].type), set()).discard(group_id)
+        for pos in group:
+            self.ticket_index.pop(pos.ticket, None)
+            self.ungrouped.setdefault((pos.symbol, pos.type), set()).add(pos.ticket)
+        self.aggregates.pop(group_id, None)
+
+    # --- Inserts ---
+
+    def _insert(self, added):
+        self.stats['inserted'] += len(added)
+        added.sort(key=lambda p: (p.time, p.symbol, p.type))
+
+        # 1. Join an existing group whose anchor the new position matches (earliest anchor wins)
+        unjoined = []
+        for pos in added:
+            target = None
+            for group_id in self.groups_by_side.get((pos.symbol, pos.type), ()):
+                anchor = self.groups[group_id][0]
+                if self.engine.can_join(anchor, pos) and (target is None or anchor.time < self.groups[target][0].time):
+                    target = group_id
+            if target is None:
+                unjoined.append(pos)
+                continue
+            group = self.groups[target]
+            group.append(pos)
+            group.sort(key=lambda p: p.time)
+            self.aggregates[target].add(pos)
+            self.ticket_index[pos.ticket] = GroupMembership(target, group, self.get_tp_index(pos, group))
+
+        if not unjoined:
+            return
+
+        # 2. Group the rest together with nearby standalone positions of the same symbol/direction
+        window = self.engine.time_threshold
+        earliest = min(p.time for p in unjoined) - window
+        latest = max(p.time for p in unjoined) + window
+        candidates = list(unjoined)
+        for side in {(p.symbol, p.type) for p in unjoined}:
+            for ticket in self.ungrouped.get(side, ()):
+                pos = self.positions.get(ticket)
+                if pos is not None and earliest <= pos.time <= latest:
+                    candidates.append(pos)
+
+        self.stats['regroup_runs'] += 1
+        grouped_tickets = set()
+        for group, aggregate in self.engine.find_groups(candidates):
+            anchor = group[0]
+            group_id = self.engine.group_id_for(group, self.groups)
+            self.groups[group_id] = group
+            self.aggregates[group_id] = aggregate
+            self.groups_by_side.setdefault((anchor.symbol, anchor.type), set()).add(group_id)
+            for pos in group:
+                grouped_tickets.add(pos.ticket)
+                self.ticket_index[pos.ticket] = GroupMembership(group_id, group, self.get_tp_index(pos, group))
+            self.stats['groups_formed'] += 1
+            self.engine.log_group(group_id, group)
+
+        for pos in candidates:
+            side_tickets = self.ungrouped.setdefault((pos.symbol, pos.type), set())
+            if pos.ticket in grouped_tickets:
+                side_tickets.discard(pos.ticket)
+            else:
+                side_tickets.add(pos.ticket)
+
+    # --- Refresh ---
+
+    def _refresh(self):
+        """Swap in this cycle's position objects (prices, SL/TP, comment) without regrouping"""
+        for group_id, group in self.groups.items():
+            for i, old in enumerate(group):
+                pos = self.positions[old.ticket]
+                if pos is old:
+                    continue
+                group[i] = pos
+                if pos.comment != old.comment:
+                    # Progressive TP rewrites the comment, which carries the TP level
+                    self.ticket_index[pos.ticket] = GroupMembership(group_id, group, self.get_tp_index(pos, group))
+
+
+# ------------------------------------------------------------------------
+# SYMBOL METADATA CACHE
+# ------------------------------------------------------------------------
+
+SymbolMeta = namedtuple('SymbolMeta', [
+    'name', 'digits', 'point', 'stops_level', 'freeze_level', 'filling_mode', 'trade_mode', 'fetched_at'
+])
+
+
+class SymbolInfoCache:
+    """
+    Per-account cache of the symbol properties the action path needs (digits, point,
+    stops/freeze levels, filling modes, trade mode). Entries are refreshed after ttl
+    seconds, or immediately when an order retcode suggests the cached rules are stale.
+    """
+
+    # Retcodes that usually mean the broker changed the symbol's trading rules
+    STALE_RETCODES = {
+        mt5.TRADE_RETCODE_INVALID_STOPS,
+        mt5.TRADE_RETCODE_INVALID_FILL,
+        mt5.TRADE_RETCODE_TRADE_DISABLED,
+        mt5.TRADE_RETCODE_MARKET_CLOSED,
+        mt5.TRADE_RETCODE_FROZEN,
+    }
+
+    def __init__(self, broker, ttl=300, logger=None, clock=None):
+        self.broker = broker
+        self.ttl = ttl
+        self.logger = logger or logging.getLogger(__name__)
+        self.clock = clock or time.time
+        self.entries = {}  # symbol -> SymbolMeta
+        self.stats = {'hits': 0, 'misses': 0, 'refreshes': 0, 'invalidations': 0, 'fetch_failures': 0}
+
+    def get(self, symbol):
+        """Cached metadata for symbol, fetched from the broker if missing or expired (None if unavailable)"""
+        meta = self.entries.get(symbol)
+        if meta is not None and self.clock() - meta.fetched_at < self.ttl:
+            self.stats['hits'] += 1
+            return meta
+        self.stats['misses'] += 1
+        return self.refresh(symbol)
+
+    def refresh(self, symbol):
+        info = self.broker.symbol_info(symbol)
+        if info is None:
+            self.stats['fetch_failures'] += 1
+            stale = self.entries.get(symbol)
+            if stale is not None:
+                # Stale rules beat no rules; try again on the next lookup
+                self.logger.warning(f"Could not refresh symbol info for {symbol}, using cached values.")
+            return stale
+        meta = SymbolMeta(
+            name=symbol,
+            digits=info.digits,
+            point=getattr(info, 'point', 10 ** (-info.digits)),
+            stops_level=getattr(info, 'trade_stops_level', 0),
+            freeze_level=getattr(info, 'trade_freeze_level', 0),
+            filling_mode=getattr(info, 'filling_mode', 0),
+            trade_mode=getattr(info, 'trade_mode', None),
+            fetched_at=self.clock()
+        )
+        self.entries[symbol] = meta
+        self.stats['refreshes'] += 1
+        return meta
+
+    def warm(self, symbols):
+        """Pre-load metadata (e.g. at connect) so the first securing attempt doesn't pay for it"""
+        loaded = 0
+        for symbol in symbols:
+            if self.refresh(symbol) is not None:
+                loaded += 1
+        return loaded
+
+    def invalidate(self, symbol=None):
+        """Drop one symbol (or everything) so the next lookup goes to the broker"""
+        self.stats['invalidations'] += 1
+        if symbol is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(symbol, None)
+
+    def note_retcode(self, symbol, retcode):
+        """Invalidate symbol if an order result suggests its cached rules are out of date"""
+        if retcode in self.STALE_RETCODES and symbol in self.entries:
+            self.logger.info(f"Retcode {retcode} for {symbol} - refreshing cached symbol info.")
+            self.invalidate(symbol)
+
+
+class FillingModeCache:
+    """
+    Remembers which order filling mode each symbol accepts, so deals are sent with the
+    right mode first instead of walking IOC -> FOK -> RETURN -> none on every order.
+    The first guess comes from symbol_info().filling_mode; after that the mode of the
+    last successful deal is reused until the broker rejects it.
+    """
+
+    # Fallback order when nothing is known about the symbol (None = omit type_filling)
+    DEFAULT_ORDER = (mt5.ORDER_FILLING_IOC, mt5.ORDER_FILLING_FOK, mt5.ORDER_FILLING_RETURN, None)
+
+    def __init__(self, symbol_cache, logger=None):
+        self.symbol_cache = symbol_cache
+        self.logger = logger or logging.getLogger(__name__)
+        self.learned = {}  # symbol -> filling mode that last succeeded
+        self.stats = {'first_try_hits': 0, 'fallbacks': 0, 'rejections': 0}
+
+    def candidates(self, symbol):
+        """Filling modes to try for symbol, most likely first"""
+        preferred = []
+        if symbol in self.learned:
+            preferred.append(self.learned[symbol])
+        else:
+            meta = self.symbol_cache.get(symbol)
+            if meta is not None:
+                # Bitmask flags advertised by the symbol; RETURN is always allowed outside market execution
+                if meta.filling_mode & mt5.SYMBOL_FILLING_IOC:
+                    preferred.append(mt5.ORDER_FILLING_IOC)
+                if meta.filling_mode & mt5.SYMBOL_FILLING_FOK:
+                    preferred.append(mt5.ORDER_FILLING_FOK)
+        return preferred + [mode for mode in self.DEFAULT_ORDER if mode not in preferred]
+
+    def record_success(self, symbol, filling_mode, attempts):
+        if attempts == 1:
+            self.stats['first_try_hits'] += 1
+        else:
+            self.stats['fallbacks'] += 1
+        if self.learned.get(symbol, object()) != filling_mode:
+            self.logger.info(f"Filling mode for {symbol} learned: {filling_mode}")
+        self.learned[symbol] = filling_mode
+
+    def record_rejection(self, symbol, filling_mode):
+        self.stats['rejections'] += 1
+        if symbol in self.learned and self.learned[symbol] == filling_mode:
+            # Broker changed its rules - forget the cached mode and fall back
+            del self.learned[symbol]
+
+
+# ------------------------------------------------------------------------
+# ORDER RETRY SCHEDULER
+# ------------------------------------------------------------------------
+
+# A failed order request waiting for another attempt. action(*args, attempt=attempt, **kwargs)
+# is called once next_attempt_at (time.monotonic) has passed. When position_ticket is set,
+# args[0] is a position that is re-fetched from the broker before the retry.
+RetryIntent = namedtuple('RetryIntent', [
+    'key', 'action', 'args', 'kwargs', 'attempt', 'max_attempts', 'next_attempt_at',
+    'last_retcode', 'position_ticket', 'description'
+])
+
+
+class RetryScheduler:
+    """
+    Holds failed order intents and their next-attempt deadlines so order paths never
+    sleep inside a monitoring cycle. The EA services due intents between cycles
+    (PipSecureEA.service_retries). One intent per key: a path that already has a
+    retry pending must not send a duplicate request.
+    """
+
+    # Retcodes retried after a fixed short delay (seconds)
+    RETRY_DELAYS = {
+        mt5.TRADE_RETCODE_REQUOTE: 0.5,
+        mt5.TRADE_RETCODE_PRICE_CHANGED: 0.5,
+        mt5.TRADE_RETCODE_PRICE_OFF: 0.5,
+        mt5.TRADE_RETCODE_CONNECTION: 2.0,
+        mt5.TRADE_RETCODE_TIMEOUT: 2.0,
+        mt5.TRADE_RETCODE_TOO_MANY_REQUESTS: 2.0,
+    }
+    # Retcodes where another identical request cannot succeed
+    NON_RETRYABLE = {
+        mt5.TRADE_RETCODE_INVALID_STOPS,
+        mt5.TRADE_RETCODE_INVALID_ORDER,
+        mt5.TRADE_RETCODE_POSITION_CLOSED,
+        mt5.TRADE_RETCODE_INVALID_VOLUME,
+        mt5.TRADE_RETCODE_TRADE_DISABLED,
+        mt5.TRADE_RETCODE_MARKET_CLOSED,
+    }
+
+    def __init__(self, logger=None, clock=time.monotonic):
+        self.logger = logger or logging.getLogger(__name__)
+        self.clock = clock
+        self.intents = {}  # key -> RetryIntent
+        self.stats = {'scheduled': 0, 'retried': 0, 'exhausted': 0, 'not_retryable': 0, 'cancelled': 0}
+
+    def retry_delay(self, retcode, attempt):
+        """Delay before the next attempt, or None if retcode should not be retried"""
+        if retcode in self.NON_RETRYABLE:
+            return None
+        if retcode in self.RETRY_DELAYS:
+            return self.RETRY_DELAYS[retcode]
+        # order_send returned None, raised, or an unclassified error: back off 1s, 2s, ...
+        return float(attempt)
+
+    def schedule(self, key, action, args=(), kwargs=None, attempt=1, max_attempts=3,
+                 retcode=None, position_ticket=None, description=''):
+        """
+        Record that attempt number `attempt` failed with retcode (None when order_send
+        returned None or raised). Returns True if a retry was scheduled, False if the
+        request should be treated as finally failed.
+        """
+        if attempt >= max_attempts:
+            self.stats['exhausted'] += 1
+            self.intents.pop(key, None)
+            return False
+        delay = self.retry_delay(retcode, attempt)
+        if delay is None:
+            self.stats['not_retryable'] += 1
+            self.intents.pop(key, None)
+            return False
+
+        self.intents[key] = RetryIntent(
+            key=key, action=action, args=tuple(args), kwargs=dict(kwargs or {}),
+            attempt=attempt + 1, max_attempts=max_attempts,
+            next_attempt_at=self.clock() + delay, last_retcode=retcode,
+            position_ticket=position_ticket, description=description
+        )
+        self.stats['scheduled'] += 1
+        self.logger.info(f"Retry {attempt + 1}/{max_attempts} for {description or key} scheduled in {delay:.1f}s")
+        return True
+
+    def is_pending(self, key):
+        return key in self.intents
+
+    def cancel(self, key):
+        if self.intents.pop(key, None) is not None:
+            self.stats['cancelled'] += 1
+
+    def next_deadline(self):
+        """Earliest next_attempt_at of all pending intents, or None"""
+        if not self.intents:
+            return None
+        return min(intent.next_attempt_at for intent in self.intents.values())
+
+    def pop_due(self):
+        """Remove and return the intents whose deadline has passed, earliest first"""
+        now = self.clock()
+        due = [intent for intent in self.intents.values() if intent.next_attempt_at <= now]
+        due.sort(key=lambda intent: intent.next_attempt_at)
+        for intent in due:
+            del self.intents[intent.key]
+        self.stats['retried'] += len(due)
+        return due
+
+    def export(self):
+        """
+        Pending intents as plain tuples for a state handoff: the action by method name and
+        the deadline relative to now (monotonic clocks differ between processes)
+        """
+        now = self.clock()
+        exported = []
+        for intent in self.intents.values():
+            entry = tuple(intent._replace(action=intent.action.__name__,
+                                          next_attempt_at=max(0.0, intent.next_attempt_at - now)))
+            try:
+                pickle.dumps(entry)
+            except Exception:
+                continue # Arguments that cannot be handed over; the next cycle re-evaluates
+            exported.append(entry)
+        return exported
+
+    def restore(self, exported, resolve_action):
+        """Re-create exported intents; resolve_action maps a method name to a callable (or None)"""
+        now = self.clock()
+        restored = 0
+        for entry in exported:
+            intent = RetryIntent(*entry)
+            action = resolve_action(intent.action)
+            if action is None or intent.key in self.intents:
+                continue
+            self.intents[intent.key] = intent._replace(action=action, next_attempt_at=now + intent.next_attempt_at)
+            restored += 1
+        return restored
+
+    def __len__(self):
+        return len(self.intents)
+
+
+# ------------------------------------------------------------------------
+# GROUP ACTION EXECUTOR
+# ------------------------------------------------------------------------
+
+# One step of a basket's action plan: func(*args, **kwargs). A return value of False
+# means the step failed; any other value (True, a count, None) means it went through.
+# requires names the kind of another step of the plan that must have gone through
+# first (e.g. siblings are only secured once the TP1 close succeeded). retry_key is the
+# RetryScheduler key the step retries under, so a retry that was already pending when
+# the step ran (the step then returns False without sending) is waited for, not failed.
+GroupAction = namedtuple('GroupAction', ['kind', 'description', 'func', 'args', 'kwargs', 'requires', 'retry_key'],
+                         defaults=(None, None))
+
+
+class GroupActionExecutor:
+    """
+    Runs the action plan of a basket (close TP1, secure siblings, delete pending orders
+    or apply Rule 2) as one batch. Independent requests are submitted back-to-back with
+    a single attempt; steps that require another step go out as a second wave once its
+    result is in. Failures are left to the RetryScheduler instead of being retried inline.
+    The basket stays in flight until its retries resolve, and the wall-clock time from
+    the TP1 trigger until every step succeeded is recorded.
+    """
+
+    def __init__(self, retry_scheduler, logger=None, clock=time.monotonic, history=100):
+        self.retry_scheduler = retry_scheduler
+        self.logger = logger or logging.getLogger(__name__)
+        self.clock = clock
+        self.in_flight = {}      # group_id -> {'triggered_at', 'outstanding', 'failed', 'steps', 'blocked'}
+        self.retry_owner = {}    # retry key -> group_id
+        self.latencies = deque(maxlen=history)  # seconds from trigger to fully secured
+        self.stats = {'groups': 0, 'secured': 0, 'incomplete': 0, 'steps': 0, 'skipped': 0}
+
+    def execute(self, group_id, actions, triggered_at=None):
+        """
+        Submit every independent action of the plan, then the actions whose required
+        step went through. Actions whose required step failed are not sent; while it
+        is retrying they wait in the group state until the retry resolves.
+        Returns a list of (action, result) in submission order.
+        """
+        if triggered_at is None:
+            triggered_at = self.clock()
+        # A group executed again while still in flight carries on with its existing state
+        state = self.in_flight.get(group_id)
+        if state is None:
+            state = {'triggered_at': triggered_at, 'outstanding': set(), 'failed': [], 'steps': 0, 'blocked': []}
+        else:
+            self.logger.info(f"Group {group_id} is still in flight - merging the new actions into it")
+        outcomes = []  # (kind, 'ok' / 'failed' / retry keys scheduled) per submitted action
+        results = self._submit(group_id, state, [a for a in actions if a.requires is None], outcomes)
+
+        dependent = [a for a in actions if a.requires is not None]
+        for required in dict.fromkeys(a.requires for a in dependent):
+            waiting = [a for a in dependent if a.requires == required]
+            required_outcomes = [outcome for kind, outcome in outcomes if kind == required]
+            retrying = set().union(*(o for o in required_outcomes if isinstance(o, set)))
+            if 'failed' in required_outcomes:
+                self._skip(group_id, waiting, f"'{required}' failed")
+            elif retrying:
+                state['blocked'].append((retrying, waiting))
+            else:
+                results += self._submit(group_id, state, waiting)
+
+        self.stats['groups'] += 1
+        submitted_ms = (self.clock() - triggered_at) * 1000
+        self.logger.info(
+            f"Group {group_id}: {state['steps']} action(s) submitted {submitted_ms:.0f} ms after trigger "
+            f"({len(state['outstanding'])} retrying, {len(state['failed'])} failed)"
+        )
+
+        if state['outstanding']:
+            self.in_flight[group_id] = state
+        else:
+            self.in_flight.pop(group_id, None)
+            self._finish(group_id, state['triggered_at'], state['failed'])
+        return results
+
+    def _submit(self, group_id, state, actions, outcomes=None):
+        """Send actions back-to-back, recording failures and the retries they scheduled in state"""
+        results = []
+        for action in actions:
+            pending_before = set(self.retry_scheduler.intents)
+            try:
+                result = action.func(*action.args, **action.kwargs)
+            except Exception as e:
+                self.logger.error(f"Exception in group {group_id} action '{action.description}': {e}", exc_info=True)
+                result = False
+            results.append((action, result))
+            state['steps'] += 1
+            self.stats['steps'] += 1
+
+            # Retries this step scheduled keep the group in flight until they resolve. So does
+            # the step's own retry if one was already pending (not owned by another group).
+            scheduled = set(self.retry_scheduler.intents) - pending_before
+            key = action.retry_key
+            if (not scheduled and key is not None and self.retry_scheduler.is_pending(key)
+                    and self.retry_owner.get(key, group_id) == group_id):
+                scheduled = {key}
+            if scheduled:
+                state['outstanding'].update(scheduled)
+                for key in scheduled:
+                    self.retry_owner[key] = group_id
+                outcome = scheduled
+            elif result is False and key is not None and self.retry_scheduler.is_pending(key):
+                outcome = 'ok' # Its retry is already in flight for another group
+            elif result is False:
+                state['failed'].append(action.description)
+                outcome = 'failed'
+            else:
+                outcome = 'ok'
+            if outcomes is not None:
+                outcomes.append((action.kind, outcome))
+        return results
+
+    def _skip(self, group_id, actions, reason):
+        self.stats['skipped'] += len(actions)
+        for action in actions:
+            self.logger.warning(f"Group {group_id}: not sending '{action.description}' - {reason}")
+
+    def resolve_retry(self, key, ok):
+        """Called once a retry intent is finished (succeeded, gave up, or was dropped)"""
+        group_id = self.retry_owner.pop(key, None)
+        state = self.in_flight.get(group_id) if group_id is not None else None
+        if state is None:
+            return
+        state['outstanding'].discard(key)
+        if not ok:
+            state['failed'].append(str(key))
+
+        # Second-wave actions that were waiting for this retry
+        for entry in state['blocked'][:]:
+            keys, waiting = entry
+            if key not in keys:
+                continue
+            if not ok:
+                state['blocked'].remove(entry)
+                self._skip(group_id, waiting, f"retry {key} failed")
+                continue
+            keys.discard(key)
+            if not keys:
+                state['blocked'].remove(entry)
+                self._submit(group_id, state, waiting)
+
+        if not state['outstanding']:
+            del self.in_flight[group_id]
+            self._finish(group_id, state['triggered_at'], state['failed'])
+
+    def _finish(self, group_id, triggered_at, failed):
+        elapsed = self.clock() - triggered_at
+        if failed:
+            self.stats['incomplete'] += 1
+            self.logger.warning(f"Group {group_id} NOT fully secured {elapsed * 1000:.0f} ms after trigger. Failed: {', '.join(failed)}")
+        else:
+            self.stats['secured'] += 1
+            self.latencies.append(elapsed)
+            self.logger.info(f"Group {group_id} fully secured {elapsed * 1000:.0f} ms after TP1 trigger")
+
+    def latency_summary(self):
+        """(last, average, max) trigger-to-secured latency in seconds, or None"""
+        if not self.latencies:
+            return None
+        return self.latencies[-1], sum(self.latencies) / len(self.latencies), max(self.latencies)
+
+
+# ------------------------------------------------------------------------
+# ASYNC LOGGING (file/console I/O off the trading thread)
+# ------------------------------------------------------------------------
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler over a bounded queue that never blocks the caller. When the queue is
+    full the overflow policy decides what is lost:
+      'drop_new'    - the incoming record is dropped (ERROR and above still evict the oldest)
+      'drop_oldest' - the oldest queued record is evicted to make room
+    """
+
+    def __init__(self, log_queue, overflow_policy='drop_new'):
+        super().__init__(log_queue)
+        self.overflow_policy = overflow_policy
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        if self.overflow_policy == 'drop_oldest' or record.levelno >= logging.ERROR:
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+                self.queue.put_nowait(record)
+                return
+            except (queue.Empty, queue.Full):
+                pass
+        self.dropped += 1
+
+
+class AsyncLogListener(QueueListener):
+    """
+    Listener thread that owns the real (file/console) handlers. Reports records lost
+    to queue overflow as a warning in the log itself, and drains the queue on stop().
+    """
 
-        current_time = datetime.now()
-        age = current_time - last_heartbeat
-        return age.total_seconds() / 60 > max_age_minutes
+    def __init__(self, log_queue, queue_handler, *handlers):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.queue_handler = queue_handler
+        self.reported_drops = 0
+
+    def handle(self, record):
+        dropped = self.queue_handler.dropped
+        if dropped > self.reported_drops:
+            notice = logging.makeLogRecord({
+                'name': record.name, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': f"Log queue overflow: {dropped - self.reported_drops} record(s) dropped",
+            })
+            self.reported_drops = dropped
+            super().handle(notice)
+        super().handle(record)
+
+    def enqueue_sentinel(self):
+        # The queue may be full at shutdown - wait for room instead of failing
+        try:
+            self.queue.put(self._sentinel, timeout=5)
+        except queue.Full:
+            pass
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+            for handler in self.handlers:
+                try:
+                    handler.flush()
+                except Exception:
+                    pass
+
+
+# ------------------------------------------------------------------------
+# CENTRAL LOG COLLECTOR (MultiAccountMonitor: one writer for every account)
+# ------------------------------------------------------------------------
+
+class CollectorQueueHandler(DroppingQueueHandler):
+    """
+    Account-process side of the central collector: records go to the monitor's
+    multiprocessing queue tagged with the account name. The process-local drop count
+    travels with each record so the collector can report losses.
+    """
+
+    def __init__(self, log_queue, account, overflow_policy='drop_new', account_file=True):
+        super().__init__(log_queue, overflow_policy)
+        self.account = account
+        self.account_file = account_file
+
+    def prepare(self, record):
+        record = super().prepare(record) # Merges args/exc_info into msg so the record pickles
+        record.account = self.account
+        record.account_file = self.account_file
+        record.dropped = self.dropped
+        return record
+
+
+class CentralLogCollector:
+    """
+    Runs in the MultiAccountMonitor process and receives the log records of every
+    account process over one multiprocessing queue. A thread drains the queue in
+    batches and writes each batch with one write per destination:
+      logs/<account>/pip_secure.log  - per-account file (same format as a standalone EA)
+      logs/all_accounts.log + stdout - merged stream, prefixed with [account]
+    Account processes do no file or console I/O for logging, and the console has a
+    single writer, so lines from different accounts never interleave.
+    """
+
+    ACCOUNT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+    MERGED_FORMAT = '[%(account)s] %(asctime)s - %(levelname)s - %(message)s'
+
+    def __init__(self, log_dir='logs', queue_size=50000, batch_size=500, flush_interval=0.2,
+                 console=True, archiver=None):
+        self.log_dir = log_dir
+        self.queue = multiprocessing.Queue(queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.archiver = archiver
+        self.account_formatter = logging.Formatter(self.ACCOUNT_FORMAT)
+        self.merged_formatter = logging.Formatter(self.MERGED_FORMAT)
+        self.account_handlers = {}
+        self.merged_handlers = [self._file_handler(os.path.join(log_dir, 'all_accounts.log'))]
+        if console:
+            self.merged_handlers.append(logging.StreamHandler(sys.stdout))
+        self.reported_drops = {}
+        self.stats = {'records': 0, 'batches': 0, 'dropped': 0, 'write_errors': 0}
+        self.thread = None
+
+    def _file_handler(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handler = TimedRotatingFileHandler(path, when='midnight', interval=1, backupCount=7, encoding='utf-8')
+        if self.archiver is not None:
+            handler.namer = self.archiver.namer
+            handler.rotator = self.archiver.rotator
+        return handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='CentralLogCollector', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            while record is not None:
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self.write_batch(batch)
+            if record is None: # Sentinel from stop()
+                return
+
+    def write_batch(self, records):
+        by_account = {}
+        merged = []
+        for record in records:
+            account = getattr(record, 'account', 'Unknown')
+            batch = [record]
+            notice = self._drop_notice(record, account)
+            if notice is not None:
+                batch.insert(0, notice)
+            merged.extend(batch)
+            if getattr(record, 'account_file', True):
+                by_account.setdefault(account, []).extend(batch)
+
+        for account, account_records in by_account.items():
+            handler = self.account_handlers.get(account)
+            if handler is None:
+                handler = self._file_handler(os.path.join(self.log_dir, account, 'pip_secure.log'))
+                self.account_handlers[account] = handler
+            self._write(handler, self.account_formatter, account_records)
+        for handler in self.merged_handlers:
+            self._write(handler, self.merged_formatter, merged)
+
+        self.stats['records'] += len(records)
+        self.stats['batches'] += 1
+
+    def _drop_notice(self, record, account):
+        """Warning record for an increase in the account's drop counter, or None"""
+        dropped = getattr(record, 'dropped', 0)
+        previous = self.reported_drops.get(account, 0)
+        if dropped < previous:
+            previous = 0 # Counter restarted: the account process was restarted
+        self.reported_drops[account] = dropped
+        lost = dropped - previous
+        if lost <= 0:
+            return None
+        self.stats['dropped'] += lost
+        return logging.makeLogRecord({
+            'name': record.name, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+            'msg': f"Log queue overflow: {lost} record(s) dropped", 'account': account,
+            'created': record.created, 'msecs': record.msecs,
+        })
+
+    def _write(self, handler, formatter, records):
+        """One write + flush for the whole batch (rollover is checked once, on the newest record)"""
+        handler.acquire()
+        try:
+            if isinstance(handler, TimedRotatingFileHandler) and handler.shouldRollover(records[-1]):
+                handler.doRollover()
+            handler.stream.write(''.join(formatter.format(r) + handler.terminator for r in records))
+            handler.flush()
+        except Exception as e:
+            self.stats['write_errors'] += 1
+            print(f"Central log collector write error ({getattr(handler, 'baseFilename', 'console')}): {e}", file=sys.stderr)
+        finally:
+            handler.release()
+
+    def stop(self, timeout=10):
+        """Write everything already queued, then close the files"""
+        if self.thread is not None and self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+            self.thread.join(timeout)
+        for handler in list(self.account_handlers.values()) + self.merged_handlers:
+            try:
+                handler.flush()
+                if isinstance(handler, TimedRotatingFileHandler):
+                    handler.close()
+            except Exception:
+                pass
+
+
+# ------------------------------------------------------------------------
+# KEY EVENT JOURNAL
+# ------------------------------------------------------------------------
+
+class KeyEventJournal:
+    """
+    Long-lived buffered writer for key events (TP1_SECURED, PENDING_DELETED, ...).
+    Each account process appends to its own segment (logs/key_events_<account>.log), so
+    processes never interleave writes. Events are buffered in memory and written plus
+    fsync'ed once fsync_every events are pending or fsync_interval seconds have passed
+    since the last sync: a crash loses at most that much. Each flush is a single
+    O_APPEND write, so even two processes sharing a segment cannot overwrite each other.
+    Segments rotate at max_bytes, keeping backup_count old segments (.1 is the newest).
+    """
+
+    def __init__(self, path, fsync_every=20, fsync_interval=1.0, max_bytes=10 * 1024 * 1024,
+                 backup_count=5, clock=time.monotonic):
+        self.path = path
+        self.fsync_every = max(1, fsync_every)
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.clock = clock
+        self.pending = []
+        self.last_sync = clock()
+        self.fd = None
+        self.size = 0
+        self.stats = {'events': 0, 'flushes': 0, 'rotations': 0}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    def _open(self):
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.size = os.fstat(self.fd).st_size
+
+    def append(self, line):
+        self.pending.append(line if line.endswith('\n') else line + '\n')
+        self.stats['events'] += 1
+        if len(self.pending) >= self.fsync_every or self.clock() - self.last_sync >= self.fsync_interval:
+            self.flush()
+
+    def tick(self):
+        """Flush if the interval has passed (called between cycles, so quiet periods still sync)"""
+        if self.pending and self.clock() - self.last_sync >= self.fsync_interval:
+            self.flush()
+
+    def flush(self):
+        self.last_sync = self.clock()
+        if not self.pending or self.fd is None:
+            return
+        data = ''.join(self.pending).encode('utf-8')
+        self.pending = []
+        os.write(self.fd, data)
+        os.fsync(self.fd)
+        self.size += len(data)
+        self.stats['flushes'] += 1
+        if self.max_bytes and self.size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        os.close(self.fd)
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.stats['rotations'] += 1
+        self._open()
+
+    def close(self):
+        if self.fd is None:
+            return
+        try:
+            self.flush()
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+
+# ------------------------------------------------------------------------
+# GROUP DIAGNOSTICS
+# ------------------------------------------------------------------------
+
+class GroupDiagnostics:
+    """
+    Decides when the per-group diagnostics (diagnose_tp_values, direction checks) are
+    worth logging. Each subject (a group or a ticket) has a fingerprint of its SL, TP,
+    price bucket and validation result, and the details are logged only when the
+    fingerprint changes.
+      mode 'changes' - log on change only (default)
+      mode 'sampled' - also log every subject once per sample_interval seconds
+      mode 'always'  - log on every call (the old per-second behaviour)
+    A full dump of everything on the next cycle can be requested with request_dump(),
+    or by creating the trigger file (logs/<account>/dump_diagnostics).
+    """
+
+    MODES = ('changes', 'sampled', 'always')
+
+    def __init__(self, logger=None, pip_multiplier_func=None, mode='changes', sample_interval=300,
+                 bucket_pips=10, trigger_file=None, clock=time.time):
+        self.logger = logger or logging.getLogger(__name__)
+        self.pip_multiplier_func = pip_multiplier_func
+        self.mode = mode if mode in self.MODES else 'changes'
+        self.sample_interval = sample_interval
+        self.bucket_pips = bucket_pips
+        self.trigger_file = trigger_file
+        self.clock = clock
+        self.fingerprints = {}   # subject key -> last logged fingerprint
+        self.last_logged = {}    # subject key -> time of last log
+        self.dump_all = False
+        self.dump_keys = set()
+        self.stats = {'emitted': 0, 'suppressed': 0}
+
+    def price_bucket(self, symbol, price):
+        """Coarse price level (bucket_pips wide) so ticks inside a bucket do not count as a change"""
+        pip = self.pip_multiplier_func(symbol) if self.pip_multiplier_func else 0
+        if not pip or not self.bucket_pips:
+            return price
+        return math.floor(price / (pip * self.bucket_pips))
+
+    def should_emit(self, key, fingerprint):
+        """True if the diagnostics for key should be logged now; records the fingerprint"""
+        now = self.clock()
+        changed = self.fingerprints.get(key) != fingerprint
+        self.fingerprints[key] = fingerprint
+        emit = (changed or self.mode == 'always' or self.dump_all or key in self.dump_keys or
+                (self.mode == 'sampled' and now - self.last_logged.get(key, 0) >= self.sample_interval))
+        if emit:
+            self.dump_keys.discard(key)
+            self.last_logged[key] = now
+            self.stats['emitted'] += 1
+        else:
+            self.stats['suppressed'] += 1
+        return emit
+
+    def request_dump(self, key=None):
+        """Log full diagnostics for key (or for everything, if None) on the next check"""
+        if key is None:
+            self.dump_all = True
+        else:
+            self.dump_keys.add(key)
+
+    def begin_cycle(self, live_keys):
+        """
+        Called once per cycle: picks up the trigger file, ends a previous cycle's full dump
+        and forgets subjects that no longer exist (live_keys).
+        """
+        self.dump_all = False
+        if self.trigger_file and os.path.exists(self.trigger_file):
+            try:
+                os.remove(self.trigger_file)
+            except OSError:
+                pass
+            self.logger.info("Diagnostics dump requested - logging full group diagnostics this cycle")
+            self.request_dump()
+        stale = [key for key in self.fingerprints if key not in live_keys]
+        for key in stale:
+            del self.fingerprints[key]
+            self.last_logged.pop(key, None)
+        return len(stale)
+
+
+# ------------------------------------------------------------------------
+# LOG THROTTLE STORE
+# ------------------------------------------------------------------------
+
+class LogThrottle:
+    """
+    Bounded store behind log_throttled: per key, the time the message was last logged
+    and how many times it was suppressed since. Keys are kept in least-recently-used
+    order; keys idle for longer than ttl (e.g. tickets that closed) are evicted, and
+    the least recently used key is evicted when max_keys is exceeded, so memory stays
+    flat however many tickets pass through.
+    """
+
+    def __init__(self, max_keys=5000, ttl=3600, clock=time.time):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()  # key -> [last_logged, suppressed, last_touched]
+        self.stats = {'allowed': 0, 'suppressed': 0, 'evicted': 0}
+
+    def check(self, key, interval):
+        """
+        Returns None if the message for key should be suppressed now, otherwise the
+        number of times it was suppressed since it was last logged.
+        """
+        now = self.clock()
+        entry = self.entries.get(key)
+        if entry is None:
+            self.entries[key] = [now, 0, now]
+            self._evict(now)
+            self.stats['allowed'] += 1
+            return 0
+
+        self.entries.move_to_end(key)
+        entry[2] = now
+        if now - entry[0] <= interval:
+            entry[1] += 1
+            self.stats['suppressed'] += 1
+            return None
+        suppressed = entry[1]
+        entry[0], entry[1] = now, 0
+        self.stats['allowed'] += 1
+        return suppressed
+
+    def _evict(self, now):
+        # Front of the OrderedDict is the least recently touched key
+        while self.entries:
+            last_touched = next(iter(self.entries.values()))[2]
+            if len(self.entries) <= self.max_keys and now - last_touched <= self.ttl:
+                break
+            self.entries.popitem(last=False)
+            self.stats['evicted'] += 1
+
+    def prune(self, is_stale):
+        """Drop every key for which is_stale(key) is true. Returns how many were dropped."""
+        stale = [key for key in self.entries if is_stale(key)]
+        for key in stale:
+            del self.entries[key]
+        return len(stale)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# ------------------------------------------------------------------------
+# TICKET STATE RECONCILIATION
+# ------------------------------------------------------------------------
+
+class TicketStateReconciler:
+    """
+    Prunes per-ticket state (secured set, retry intents, throttle keys, ...) for tickets
+    that are no longer open. Every cycle only the tickets that disappeared since the
+    previous snapshot are pruned, so the per-cycle cost follows the number of closed
+    tickets. Every full_sweep_every cycles (and on the first cycle) a full generation
+    pass compares each store with the live tickets, reclaiming what the incremental
+    pass cannot see: state restored at warm start for tickets that closed while the EA
+    was down, or keys that were never tied to a snapshot ticket.
+    """
+
+    def __init__(self, full_sweep_every=300):
+        self.full_sweep_every = max(1, full_sweep_every)
+        self.previous_tickets = {}
+        self.cycles_until_sweep = 0  # First cycle is a full sweep
+        self.generation = 0
+        self.stores = []  # (name, prune(closed_tickets) -> n or None, sweep(live_tickets) -> n)
+        self.stats = {'cycles': 0, 'sweeps': 0, 'reclaimed': {}}
+
+    def register(self, name, sweep, prune=None):
+        """prune handles the closed tickets of one cycle; stores without one are only swept"""
+        self.stores.append((name, prune, sweep))
+        self.stats['reclaimed'][name] = 0
+
+    def reconcile(self, live_tickets):
+        """live_tickets: mapping/set of this cycle's open tickets (e.g. BrokerSnapshot.by_ticket)"""
+        self.stats['cycles'] += 1
+        reclaimed = self.stats['reclaimed']
+        if self.cycles_until_sweep <= 0:
+            self.cycles_until_sweep = self.full_sweep_every
+            self.generation += 1
+            self.stats['sweeps'] += 1
+            for name, _, sweep in self.stores:
+                reclaimed[name] += sweep(live_tickets)
+        else:
+            closed = [ticket for ticket in self.previous_tickets if ticket not in live_tickets]
+            if closed:
+                for name, prune, _ in self.stores:
+                    if prune is not None:
+                        reclaimed[name] += prune(closed)
+        self.cycles_until_sweep -= 1
+        self.previous_tickets = set(live_tickets) # A copy: the snapshot drops tickets closed during the cycle
+
+    def note(self, name, count):
+        """Count state reclaimed by a store that reconciles itself (e.g. GroupDiagnostics.begin_cycle)"""
+        self.stats['reclaimed'][name] = self.stats['reclaimed'].get(name, 0) + count
+
+    def summary(self):
+        return ", ".join(f"{name} {count}" for name, count in self.stats['reclaimed'].items())
 
 
 # ------------------------------------------------------------------------
@@ -80,9 +1717,13 @@ class HeartbeatMonitor:
 
 class PipSecureEA:
 
-    def __init__(self, account_config):
+    def __init__(self, account_config, backend=None, log_queue=None):
         # Account configuration
         self.account_config = account_config
+        # MultiAccountMonitor's central log collector queue (None: this process writes its own logs)
+        self.log_queue = log_queue
+        # Broker backend - every terminal call goes through this (real MT5 unless one is injected)
+        self.broker = backend or MT5Backend(mt5)
         self.account_name = account_config.get('name', f"Login_{account_config.get('login', 'Unknown')}") # More robust default name
         self.TEST_MODE = account_config.get('test_mode', False)
         self.TEST_SYMBOL = account_config.get('test_symbol', 'EURUSD')
@@ -92,8 +1733,15 @@ class PipSecureEA:
         self.logger = logging.getLogger(self.account_name)
         # Now call setup which configures this logger instance
         self.setup_logging() # Sets up self.logger
+        self.open_key_event_journal() # Sets up self.key_events
         self.tp1_hit_groups = set()  # Keep track of groups where TP1 was hit
         self.tp1_hit_file = f'logs/{self.account_name}/tp1_hit_groups.txt'
+        # tp1_hit_groups.snapshot + tp1_hit_groups.txt journal, compacted to the live groups
+        self.tp1_hit_log = SnapshotJournal(
+            self.tp1_hit_file,
+            max_journal_bytes=account_config.get('tp1_journal_max_bytes', 64 * 1024),
+            compact_interval=account_config.get('tp1_journal_compact_interval', 3600)
+        )
         self._load_tp1_hit_groups()  # Load saved TP1 hit groups
         # Define pip value multipliers for different currency pairs
         self.pip_multipliers = {
@@ -113,14 +1761,53 @@ class PipSecureEA:
         }
         # Set to track positions that have already been secured
         self.secured_positions = set()
+        # Broker snapshot for the check_positions cycle in progress (None outside a cycle)
+        self.snapshot = None
+        # Symbol metadata (digits, stops/freeze levels, filling modes) for the action path
+        self.symbol_cache = SymbolInfoCache(self.broker, ttl=account_config.get('symbol_cache_ttl', 300), logger=self.logger)
+        # Accepted order filling mode per symbol (learned once, reused for every deal)
+        self.filling_modes = FillingModeCache(self.symbol_cache, logger=self.logger)
+        # Failed order requests waiting for another attempt (serviced between cycles)
+        self.retry_scheduler = RetryScheduler(logger=self.logger)
+        # Group/position diagnostics are logged when their state changes, not every cycle
+        self.diagnostics = GroupDiagnostics(
+            logger=self.logger,
+            pip_multiplier_func=self.get_pip_multiplier,
+            mode=account_config.get('diagnostics_mode', 'changes'),
+            sample_interval=account_config.get('diagnostics_sample_interval', 300),
+            bucket_pips=account_config.get('diagnostics_price_bucket_pips', 10),
+            trigger_file=f'logs/{self.account_name}/dump_diagnostics'
+        )
+        # Submits a basket's TP1 action plan in one batch and tracks trigger-to-secured time
+        self.group_executor = GroupActionExecutor(self.retry_scheduler, logger=self.logger)
+        # (symbol, type) -> group_id chosen as first price level in the last cycle
+        self.first_price_selection = {}
         # Dictionary to track position groups (recalculated each cycle)
         # self.position_groups = {} # No need to store long term, recalculate in check_positions
         # Parameters for grouping positions
         self.time_proximity_threshold = 5  # seconds
         self.price_proximity_threshold = 10  # pips
+        self.grouping_engine = PositionGroupingEngine(
+            self.time_proximity_threshold,
+            self.get_pip_multiplier,
+            self.get_price_proximity_threshold,
+            logger=self.logger
+        )
+        # Groups persist across cycles; only ticket churn triggers (partial) regrouping
+        self.group_registry = PositionGroupRegistry(self.grouping_engine, self.get_position_index_in_group, logger=self.logger)
 
-        # Throttled logging state
-        self.last_logged = {}
+        # Throttled logging state (bounded: idle/least recently used keys are evicted)
+        self.log_throttle = LogThrottle(
+            max_keys=account_config.get('log_throttle_max_keys', 5000),
+            ttl=account_config.get('log_throttle_ttl', 3600)
+        )
+
+        # Drops per-ticket state of closed tickets (closed since last cycle + periodic full sweeps)
+        self.reconciler = TicketStateReconciler(full_sweep_every=account_config.get('reconcile_full_sweep_cycles', 300))
+        self.reconciler.register('secured', self._sweep_secured_positions, self._prune_secured_positions)
+        self.reconciler.register('retries', self._sweep_retry_intents, self._prune_retry_intents)
+        self.reconciler.register('throttle_keys', self._sweep_throttle_keys)
+        self.reconciler.register('signal_cache', self._sweep_signal_cache)
 
         # Summary logging state
         self.last_summary_time = 0
@@ -136,6 +1823,14 @@ class PipSecureEA:
         self.active_symbols = set() # Track symbols with positions
         # Initialize progressive TP manager
         self.progressive_tp_manager = ProgressiveTPManager(self)
+        # Durable secured tickets / TP1 groups / signal cache (warm start after a restart)
+        self.open_state_store()
+        # Warm standby handoff: the primary publishes its runtime state for the standby process
+        self.standby_snapshot = None
+        if account_config.get('warm_standby', False):
+            self.standby_snapshot = StateSnapshotFile(f'logs/{self.account_name}/standby_state.pkl')
+        self.last_standby_publish = 0.0
+        self.role = 'primary' # 'standby' while waiting to take over, 'stepped_down' after losing the lease
         # Initialize heartbeat monitoring for this specific account instance
         self.initialize_heartbeat()
 
@@ -151,7 +1846,7 @@ class PipSecureEA:
         symbol = self.TEST_SYMBOL
         
         # Get current price
-        tick = mt5.symbol_info_tick(symbol)
+        tick = self.broker.symbol_info_tick(symbol)
         if not tick:
             self.logger.error(f"Cannot get tick for {symbol}")
             return False
@@ -180,45 +1875,16 @@ class PipSecureEA:
                 "deviation": 20
             }
             
-            # Try different filling modes (same approach as close_position method)
-            filling_modes = [
-                mt5.ORDER_FILLING_IOC,
-                mt5.ORDER_FILLING_FOK,
-                mt5.ORDER_FILLING_RETURN,
-                None  # Try without filling mode as last resort
-            ]
-            
+            # Uses the cached filling mode for the symbol (same approach as close_position method)
             position_created = False
-            for filling_mode in filling_modes:
-                try:
-                    if filling_mode is not None:
-                        request["type_filling"] = filling_mode
-                    else:
-                        request.pop("type_filling", None)
-                    
-                    self.logger.debug(f"Trying to create position {i+1} with filling mode: {filling_mode}")
-                    
-                    result = mt5.order_send(request)
-                    
-                    if result and result.retcode == mt5.TRADE_RETCODE_DONE:
-                        self.logger.info(f"✅ Created TEST position {i+1}: Ticket={result.order}, TP={tp_price}")
-                        created_count += 1
-                        position_created = True
-                        break  # Success, exit filling mode loop
-                    elif result:
-                        self.logger.debug(f"Failed with filling mode {filling_mode}: {result.comment}")
-                        # If it's not a filling mode error, don't try other modes
-                        if "filling" not in result.comment.lower():
-                            self.logger.error(f"❌ Failed to create position {i+1}: {result.comment}")
-                            break
-                            
-                except AttributeError:
-                    # This filling mode constant doesn't exist, try next one
-                    continue
-                except Exception as e:
-                    self.logger.debug(f"Error with filling mode {filling_mode}: {str(e)}")
-                    continue
-            
+            result = self.send_deal_request(request, f"create position {i+1}")
+            if result and result.retcode == mt5.TRADE_RETCODE_DONE:
+                self.logger.info(f"✅ Created TEST position {i+1}: Ticket={result.order}, TP={tp_price}")
+                created_count += 1
+                position_created = True
+            elif result:
+                self.logger.error(f"❌ Failed to create position {i+1}: {result.comment}")
+
             if not position_created:
                 self.logger.error(f"❌ Failed to create position {i+1} after trying all filling modes")
                 
@@ -232,6 +1898,12 @@ class PipSecureEA:
         self.heartbeat = HeartbeatMonitor(self.account_name)
         self.logger.info("Heartbeat monitor initialized.")
 
+    def beat(self, cycle_duration=None, error_count=0):
+        """Publish a heartbeat; failed writes are reported, since missed beats trigger a standby takeover"""
+        if not self.heartbeat.update_heartbeat(cycle_duration=cycle_duration, error_count=error_count):
+            self.log_throttled('error', f"💓 Heartbeat write failed ({self.heartbeat.write_errors} failures so far): "
+                                        f"{self.heartbeat.last_write_error}", key="heartbeat_write", interval=60)
+
 
     def setup_logging(self):
         # Create logs directory if it doesn't exist
@@ -245,6 +1917,9 @@ class PipSecureEA:
                     print(f"Error creating log directory {log_dir}: {e}")
                     # Fallback or raise error? For now, let it proceed, logging might fail.
 
+        # Stop a previous listener (setup_logging called again) so its queue is flushed first
+        self.stop_logging()
+
         # --- FIX: Clear existing handlers to prevent duplicates in tests ---
         if self.logger.hasHandlers():
             for h in self.logger.handlers[:]:
@@ -254,6 +1929,18 @@ class PipSecureEA:
                 except Exception as e_close:
                      print(f"Error closing/removing handler: {e_close}")
 
+        # --- Under MultiAccountMonitor: records go to the monitor's collector, which owns the files ---
+        if self.log_queue is not None:
+            self.logger.setLevel(logging.INFO)
+            self.logger.addHandler(CollectorQueueHandler(
+                self.log_queue, self.account_name, self.account_config.get('log_overflow_policy', 'drop_new')))
+            self.logger.propagate = False
+            self.logger.info(f"Logging initialized for account {self.account_name} (central collector)")
+            return
+
+        # --- Compress segments as they rotate (older ones: `python log_archive.py compress`) ---
+        if getattr(self, 'log_archiver', None) is None:
+            self.log_archiver = LogArchiver(self.logger)
 
         # --- Set up file handler with daily rotation ---
         log_file_path = f'{log_dir}/pip_secure.log'
@@ -267,6 +1954,9 @@ class PipSecureEA:
                 encoding='utf-8' # Specify encoding
             )
             file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+            # Finished segments are compressed in the background right after rotation
+            file_handler.namer = self.log_archiver.namer
+            file_handler.rotator = self.log_archiver.rotator
         except Exception as e:
             print(f"Error setting up file logger for {log_file_path}: {e}")
             # file_handler remains None
@@ -292,11 +1982,17 @@ class PipSecureEA:
         # --- Set logger level and add handlers ---
         self.logger.setLevel(logging.INFO) # Set desired level (INFO, DEBUG, etc.)
 
-        # Add handlers if they were created successfully
-        if file_handler:
-            self.logger.addHandler(file_handler)
-        if console_handler:
-            self.logger.addHandler(console_handler)
+        # File and console handlers are owned by a listener thread; the logger itself only
+        # puts records on a bounded queue, so a slow disk or blocked console never delays
+        # the trading thread (records are dropped on overflow instead)
+        handlers = [h for h in (file_handler, console_handler) if h]
+        if handlers:
+            log_queue = queue.Queue(maxsize=self.account_config.get('log_queue_size', 10000))
+            queue_handler = DroppingQueueHandler(log_queue, self.account_config.get('log_overflow_policy', 'drop_new'))
+            self.log_listener = AsyncLogListener(log_queue, queue_handler, *handlers)
+            self.log_listener.start()
+            atexit.register(self.stop_logging)
+            self.logger.addHandler(queue_handler)
 
         # Prevent log propagation to avoid duplicate logs if root logger is configured
         self.logger.propagate = False
@@ -308,32 +2004,57 @@ class PipSecureEA:
             print(f"WARNING: No handlers configured for logger '{self.account_name}'. Logging will not work.")
 
 
+    def stop_logging(self):
+        """
+        Flush queued log records to the file/console handlers and stop the listener thread.
+        Anything logged afterwards goes to the handlers directly (synchronously).
+        """
+        listener = getattr(self, 'log_listener', None)
+        if listener is not None:
+            listener.stop()
+            self.logger.removeHandler(listener.queue_handler)
+            for handler in listener.handlers:
+                self.logger.addHandler(handler)
+            self.log_listener = None
+
+    def open_key_event_journal(self):
+        """Open this process's key event segment (logs/key_events_<account>.log)"""
+        try:
+            self.key_events = KeyEventJournal(
+                f"logs/key_events_{self.account_name}.log",
+                fsync_every=self.account_config.get('key_event_fsync_every', 20),
+                fsync_interval=self.account_config.get('key_event_fsync_interval', 1.0),
+                max_bytes=self.account_config.get('key_event_max_bytes', 10 * 1024 * 1024),
+            )
+            atexit.register(self.key_events.close)
+        except OSError as e:
+            self.key_events = None
+            self.logger.error(f"Error opening key events journal: {str(e)}")
+
     def log_key_event(self, event_type, message):
-        """Log key events to a separate file"""
+        """Log key events to this account's key event journal"""
         try:
+            if self.key_events is None:
+                return
             timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            # Ensure logs directory exists for the key events log as well
-            if not os.path.exists('logs'):
-                 os.makedirs('logs')
-            with open('logs/key_events.log', 'a', encoding='utf-8') as f:
-                f.write(f"[{timestamp}] [{self.account_name}] [{event_type}] {message}\n")
+            self.key_events.append(f"[{timestamp}] [{self.account_name}] [{event_type}] {message}")
         except Exception as e:
             self.logger.error(f"Error writing to key events log: {str(e)}")
 
 
     # --- Methods moved inside the class ---
     def log_throttled(self, level, message, key=None, interval=300):
-        """Log a message only if it hasn't been logged in the last [interval] seconds"""
-        current_time = time.time()
-        log_key = key or message
-
-        # Only log if we haven't logged this message recently
-        if log_key not in self.last_logged or (current_time - self.last_logged.get(log_key, 0)) > interval:
-            log_func = getattr(self.logger, level.lower(), self.logger.info) # Get logger method
-            log_func(message)
-
-            # Update last logged time for this message
-            self.last_logged[log_key] = current_time
+        """
+        Log a message only if it hasn't been logged in the last [interval] seconds.
+        When it is logged again, the number of suppressed repeats is appended.
+        """
+        suppressed = self.log_throttle.check(key or message, interval)
+        if suppressed is None:
+            return
+        if suppressed:
+            message = f"{message} ({suppressed} suppressed since last)"
+        log_func = getattr(self.logger, level.lower(), self.logger.info) # Get logger method
+        log_func(message)
 
     def log_summary(self, force=False):
         """Log a summary of current activity"""
@@ -351,6 +2072,19 @@ class PipSecureEA:
             self.logger.info(f"Pending orders deleted: {self.summary_counters['pending_orders_deleted']}")
             self.logger.info(f"  - Pending deleted events: {self.summary_counters['pending_deleted_events']}")
             self.logger.info(f"Errors encountered: {self.summary_counters['errors']}")
+            self.logger.info(f"Diagnostics logged: {self.diagnostics.stats['emitted']}, unchanged (suppressed): {self.diagnostics.stats['suppressed']}")
+            self.logger.info(f"Closed-ticket state reclaimed: {self.reconciler.summary()} "
+                             f"({self.reconciler.stats['sweeps']} full sweeps, {len(self.secured_positions)} secured tracked)")
+            latency = self.group_executor.latency_summary()
+            if latency:
+                self.logger.info(f"TP1 trigger-to-secured: last {latency[0] * 1000:.0f} ms, avg {latency[1] * 1000:.0f} ms, max {latency[2] * 1000:.0f} ms")
+            signal_cache = self.progressive_tp_manager.signal_data_cache
+            self.logger.info(f"Signal cache: {len(signal_cache)} entries, {signal_cache.stats['hits']} hits, "
+                             f"{signal_cache.stats['misses']} misses, {signal_cache.stats['evictions']} evicted")
+            if self.state_store is not None:
+                store_stats = self.state_store.stats
+                self.logger.info(f"State store: {store_stats['writes']} writes in {store_stats['syncs']} cycles, "
+                                 f"{store_stats['rows_written']} rows written, {store_stats['rows_deleted']} deleted")
             self.logger.info(f"Active symbols: {active_symbols_str}")
             self.logger.info("=========================")
 
@@ -371,11 +2105,9 @@ class PipSecureEA:
     def _load_tp1_hit_groups(self):
         """Load saved TP1 hit groups from file"""
         try:
-            if os.path.exists(self.tp1_hit_file):
-                with open(self.tp1_hit_file, 'r') as f:
-                    for line in f:
-                        self.tp1_hit_groups.add(line.strip())
-                
+            if self.tp1_hit_log.exists():
+                self.tp1_hit_groups.update(self.tp1_hit_log.load())
+
                 # Use safer logging
                 if hasattr(self, 'logger'):
                     self.logger.info(f"Loaded {len(self.tp1_hit_groups)} TP1 hit groups from file")
@@ -393,12 +2125,179 @@ class PipSecureEA:
         try:
             if group_id not in self.tp1_hit_groups:
                 self.tp1_hit_groups.add(group_id)
-                with open(self.tp1_hit_file, 'a') as f:
-                    f.write(f"{group_id}\n")
+                if self.state_store is not None:
+                    return # Persisted with the rest of the cycle's state by persist_state()
+                self.tp1_hit_log.append(group_id)
                 self.logger.info(f"Saved group {group_id} to TP1 hit groups file")
         except Exception as e:
             self.logger.error(f"Error saving TP1 hit group: {str(e)}")
 
+    def open_state_store(self):
+        """Open logs/<account>/state.sqlite and warm-start from it (state_store: false disables it)"""
+        self.state_store = None
+        if not self.account_config.get('state_store', True):
+            return
+        try:
+            self.state_store = StateStore(f'logs/{self.account_name}/state.sqlite')
+            secured, tp1_groups, signals = self.state_store.load()
+        except (sqlite3.Error, OSError, ValueError) as e:
+            self.state_store = None
+            self.logger.error(f"Error opening state store, running without persisted state: {str(e)}")
+            return
+        self.secured_positions.update(secured)
+        self.tp1_hit_groups.update(tp1_groups)
+        self.progressive_tp_manager.signal_data_cache.load(signals)
+        self.logger.info(f"Warm start from state store: {len(secured)} secured positions, "
+                         f"{len(tp1_groups)} TP1 hit groups, {len(signals)} cached signals")
+
+        # Groups from the TP1 hit groups files move into the store once
+        if self.tp1_hit_log.exists() and self.persist_state():
+            try:
+                self.tp1_hit_log.retire('.migrated')
+                self.logger.info("Migrated TP1 hit groups file into the state store")
+            except OSError as e:
+                self.logger.error(f"Error renaming migrated TP1 hit groups file: {str(e)}")
+
+    def persist_state(self):
+        """Write this cycle's state changes to the state store in one transaction"""
+        if self.state_store is None:
+            # File-backed TP1 groups: rewrite the snapshot from the live groups when due
+            try:
+                self.tp1_hit_log.maybe_compact(self.tp1_hit_groups)
+            except OSError as e:
+                self.log_throttled('error', f"Error compacting TP1 hit groups file: {str(e)}", key="tp1_compact", interval=60)
+            return False
+        try:
+            self.state_store.sync(self.secured_positions, self.tp1_hit_groups,
+                                  self.progressive_tp_manager.signal_data_cache)
+            return True
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self.log_throttled('error', f"Error persisting EA state: {str(e)}", key="state_store_sync", interval=60)
+            self.summary_counters['errors'] += 1
+            return False
+
+    # --- Ticket state reconciliation (see TicketStateReconciler) ---
+    def _prune_secured_positions(self, closed_tickets):
+        before = len(self.secured_positions)
+        self.secured_positions.difference_update(closed_tickets)
+        return before - len(self.secured_positions)
+
+    def _sweep_secured_positions(self, live_tickets):
+        stale = [ticket for ticket in self.secured_positions if ticket not in live_tickets]
+        self.secured_positions.difference_update(stale)
+        return len(stale)
+
+    def _drop_retry_intents(self, is_closed):
+        dropped = 0
+        for intent in list(self.retry_scheduler.intents.values()):
+            if intent.position_ticket is not None and is_closed(intent.position_ticket):
+                self.retry_scheduler.cancel(intent.key)
+                self.group_executor.resolve_retry(intent.key, False)
+                dropped += 1
+        return dropped
+
+    def _prune_retry_intents(self, closed_tickets):
+        if not self.retry_scheduler.intents:
+            return 0
+        closed = set(closed_tickets)
+        return self._drop_retry_intents(lambda ticket: ticket in closed)
+
+    def _sweep_retry_intents(self, live_tickets):
+        return self._drop_retry_intents(lambda ticket: ticket not in live_tickets)
+
+    def _sweep_throttle_keys(self, live_tickets):
+        # Per-ticket keys end in "_<ticket>" (secured_123, retry_pending_123, ...)
+        def is_stale(key):
+            suffix = str(key).rpartition('_')[2]
+            return suffix.isdigit() and int(suffix) not in live_tickets
+        return self.log_throttle.prune(is_stale)
+
+    def _sweep_signal_cache(self, live_tickets):
+        # Keyed by group, not ticket: entries simply age out after signal_cache_ttl
+        return self.progressive_tp_manager.signal_data_cache.expire()
+
+    def export_state(self):
+        """Runtime state a standby needs to continue where this process stops"""
+        return {
+            'pid': os.getpid(),
+            'secured_positions': set(self.secured_positions),
+            'tp1_hit_groups': set(self.tp1_hit_groups),
+            'signal_data': dict(self.progressive_tp_manager.signal_data_cache.items()),
+            'retries': self.retry_scheduler.export(),
+        }
+
+    def import_state(self, state):
+        """Merge a handed-over state into this process (a superset is safe: stale entries are pruned by the cycles)"""
+        self.secured_positions.update(state.get('secured_positions', ()))
+        self.tp1_hit_groups.update(state.get('tp1_hit_groups', ()))
+        self.progressive_tp_manager.signal_data_cache.load(state.get('signal_data', {}))
+        resolve = lambda name: getattr(self, name, None) if isinstance(name, str) else None
+        return self.retry_scheduler.restore(state.get('retries', ()), resolve)
+
+    def publish_standby_snapshot(self, force=False):
+        """Hand the current state to the warm standby (at most every standby_snapshot_interval seconds)"""
+        if self.standby_snapshot is None:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_standby_publish < self.account_config.get('standby_snapshot_interval', 1.0):
+            return
+        try:
+            self.standby_snapshot.write(self.export_state())
+            self.last_standby_publish = now
+        except (OSError, pickle.PicklingError, TypeError) as e:
+            self.log_throttled('error', f"Error publishing standby snapshot: {str(e)}", key="standby_publish", interval=60)
+
+    def wait_as_standby(self):
+        """
+        Warm standby: stay connected without acting until the primary's heartbeat goes
+        stale - older than standby_takeover_after seconds once the primary has beaten
+        since this standby started, or no beat at all within standby_startup_grace - then
+        take over with the primary's last state.
+        """
+        takeover_after = self.account_config.get('standby_takeover_after', 5.0)
+        startup_grace = self.account_config.get('standby_startup_grace', 120.0)
+        poll_interval = self.account_config.get('standby_poll_interval', 0.25)
+        started = time.monotonic()
+        seen_primary = False
+        self.logger.info(f"🕒 Warm standby for {self.account_name} ready - watching the primary's heartbeat")
+        while True:
+            slot = self.heartbeat.get_slot()
+            if slot is not None and slot.monotonic_ts >= started:
+                seen_primary = True
+            if seen_primary:
+                if slot.age_seconds > takeover_after:
+                    reason = f"primary heartbeat stale for {slot.age_seconds:.1f}s (PID {slot.pid})"
+                    break
+            elif time.monotonic() - started > startup_grace:
+                reason = f"no primary heartbeat within {startup_grace:.0f}s"
+                break
+            if self.key_events is not None:
+                self.key_events.tick()
+            time.sleep(poll_interval)
+        self.take_over(reason)
+
+    def take_over(self, reason):
+        """Become the active EA: load the primary's last state and claim the heartbeat slot"""
+        takeover_started = time.monotonic()
+        restored_retries = 0
+        if self.state_store is not None:
+            try:
+                secured, tp1_groups, signals = self.state_store.load() # The primary's last committed cycle
+                self.import_state({'secured_positions': secured, 'tp1_hit_groups': tp1_groups, 'signal_data': signals})
+            except (sqlite3.Error, ValueError) as e:
+                self.logger.error(f"Error reloading state store on takeover: {str(e)}")
+        state = self.standby_snapshot.read() if self.standby_snapshot is not None else None
+        if state is not None:
+            restored_retries = self.import_state(state)
+        # First beat as the active process: a primary that comes back sees it lost the lease
+        self.beat()
+        self.role = 'primary'
+        message = (f"Standby took over ({reason}): {len(self.secured_positions)} secured positions, "
+                   f"{len(self.tp1_hit_groups)} TP1 hit groups, {restored_retries} pending retries, "
+                   f"handoff {(time.monotonic() - takeover_started) * 1000:.0f} ms")
+        self.logger.warning(f"🔁 {message}")
+        self.log_key_event("STANDBY_TAKEOVER", message)
+
     def should_evaluate_tp_conditions(self, group, current_price):
         """
         Determine if TP conditions should be evaluated for a position group.
@@ -439,7 +2338,9 @@ class PipSecureEA:
     def connect(self):
         # Initialize connection to MetaTrader 5
         self.logger.info(f"Attempting to connect to account {self.account_name}...")
-        init_success = mt5.initialize(
+        if self.broker.SIMULATED or not MT5_AVAILABLE:
+            self.logger.warning(f"Account {self.account_name} is using a SIMULATED terminal - no real orders will be sent.")
+        init_success = self.broker.initialize(
             path=self.account_config.get('terminal_path', None),
             login=self.account_config.get('login'),
             password=self.account_config.get('password'),
@@ -448,29 +2349,41 @@ class PipSecureEA:
         )
 
         if not init_success:
-            error_code = mt5.last_error()
+            error_code = self.broker.last_error()
             self.logger.error(f"MT5 initialization failed for account {self.account_name}. Error code: {error_code}")
             self.summary_counters['errors'] += 1
             return False
 
-        account_info = mt5.account_info()
+        account_info = self.broker.account_info()
         if account_info is None:
-             error_code = mt5.last_error()
+             error_code = self.broker.last_error()
              self.logger.error(f"Failed to get account info after MT5 initialization for {self.account_name}. Error: {error_code}")
-             mt5.shutdown()
+             self.broker.shutdown()
              self.summary_counters['errors'] += 1
              return False
 
 
         self.logger.info(f"Connected to MT5 account {self.account_name} (Login: {account_info.login}, Server: {account_info.server}) successfully")
 
-        # Update heartbeat on successful connection
-        self.heartbeat.update_heartbeat()
+        # Warm the symbol cache for everything we may have to act on (cleared first, a reconnect may mean new rules)
+        self.symbol_cache.invalidate()
+        open_positions = self.broker.positions_get() or ()
+        warm_symbols = {pos.symbol for pos in open_positions}
+        if self.TEST_MODE:
+            warm_symbols.add(self.TEST_SYMBOL)
+        if warm_symbols:
+            loaded = self.symbol_cache.warm(sorted(warm_symbols))
+            self.logger.info(f"Symbol cache warmed for {loaded}/{len(warm_symbols)} symbols")
+
+        # Update heartbeat on successful connection. Not while waiting as a warm standby:
+        # the slot is the account's lease, and a beat would make the primary step down.
+        if self.role != 'standby':
+            self.beat()
         return True
 
     def disconnect(self):
         # Shut down connection to MetaTrader 5
-        mt5.shutdown()
+        self.broker.shutdown()
         self.logger.info(f"Disconnected from MT5 account {self.account_name}")
 
     def get_pip_multiplier(self, symbol):
@@ -488,15 +2401,17 @@ class PipSecureEA:
         # Fallback to default
         return self.pip_multipliers['DEFAULT']
 
-    def secure_position(self, position, log_as_tp1_hit=False):
+    def get_sl_threshold(self, symbol):
+        """Smallest SL difference that matters for symbol (one unit of its last digit)"""
+        symbol_meta = self.symbol_cache.get(symbol)
+        if not symbol_meta:
+            self.log_throttled('warning', f"Could not get symbol info for {symbol} to check SL precision.", key=f"sl_precision_{symbol}")
+            return 0.00001 # Default small threshold
+        return 10**(-symbol_meta.digits) # Threshold based on symbol precision
+
+    def secure_position(self, position, log_as_tp1_hit=False, attempt=1, verified=False):
         # Check if stop loss is already at entry price (with small threshold for floating point comparison)
-        # Get symbol info for digits
-        symbol_info = mt5.symbol_info(position.symbol)
-        if not symbol_info:
-            self.logger.warning(f"Could not get symbol info for {position.symbol} to check SL precision.")
-            sl_threshold = 0.00001 # Default small threshold
-        else:
-            sl_threshold = 10**(-symbol_info.digits) # Threshold based on symbol precision
+        sl_threshold = self.get_sl_threshold(position.symbol)
 
         if abs(position.sl - position.price_open) < sl_threshold:
             self.log_throttled('info', f"Position {position.ticket} already secured at entry.", key=f"secured_{position.ticket}")
@@ -507,8 +2422,14 @@ class PipSecureEA:
         self.logger.info(f"[TARGET] Securing position {position.ticket} ({position.symbol}) at entry price {position.price_open}")
         self.logger.info(f"  Type: {'BUY' if position.type == mt5.ORDER_TYPE_BUY else 'SELL'}, Volume: {position.volume}, Current SL: {position.sl}")
 
-        # Verify position still exists before modification
-        position_check = mt5.positions_get(ticket=position.ticket)
+        # Verify position still exists before modification (from the cycle snapshot when available).
+        # Retries pass verified=True: service_retries has just fetched the position from the broker.
+        if verified:
+            position_check = position
+        elif self.snapshot is not None:
+            position_check = self.snapshot.position(position.ticket)
+        else:
+            position_check = self.broker.positions_get(ticket=position.ticket)
         if not position_check:
             self.logger.error(f"Position {position.ticket} no longer exists, cannot secure.")
             self.summary_counters['errors'] += 1
@@ -532,73 +2453,81 @@ class PipSecureEA:
            "comment": "PipSecure Entry"
         }
 
-        # Add retry mechanism for order modification
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                # Ensure request dict is correctly formatted before sending
-                # self.logger.debug(f"Sending order_send request: {request}")
-                result = mt5.order_send(request)
-
-                if result is None:
-                    error_code = mt5.last_error()
-                    error_desc = mt5.last_error()[1] if isinstance(mt5.last_error(), tuple) else str(mt5.last_error())
-                    self.logger.error(f"Attempt {attempt + 1}/{max_retries}: order_send returned None for securing {position.ticket}")
-                    self.logger.error(f"  - System error code: {error_code}")
-                    self.logger.error(f"  - System error desc: {error_desc}")
-                    self.summary_counters['errors'] += 1
-                    if attempt < max_retries - 1:
-                        time.sleep(1 + attempt) # Exponential backoff
-                    continue
+        # A retry is already scheduled for this ticket - let service_retries send it
+        retry_key = ('secure', position.ticket)
+        if attempt == 1 and self.retry_scheduler.is_pending(retry_key):
+            self.log_throttled('debug', f"Securing {position.ticket} has a retry pending, skipping.", key=f"retry_pending_{position.ticket}")
+            return False
 
-                # Check result code: https://www.mql5.com/en/docs/constants/tradingconstants/enum_trade_return_codes
-                if result.retcode == mt5.TRADE_RETCODE_DONE:
-                    self.logger.info(f"[SUCCESS] Successfully secured position {position.ticket} for {position.symbol}")
-                    self.logger.info(f"  Stop loss moved to entry: {position.price_open}")
-                    self.secured_positions.add(position.ticket)
-                    self.summary_counters['positions_secured'] += 1
-                    if log_as_tp1_hit:
-                        self.summary_counters['tp1_secured_events'] += 1
-                        # Log key event specifically for TP1 hit leading to secure
-                        self.log_key_event("TP1_SECURED", f"Position {position.ticket} ({position.symbol}) secured at entry {position.price_open} after TP1 condition met.")
-                    return True
-                else:
-                    # Log specific error message from result
-                    self.logger.error(f"Attempt {attempt + 1}/{max_retries}: Failed to modify SL for {position.ticket}")
-                    self.logger.error(f"  - Error code: {result.retcode}")
-                    self.logger.error(f"  - Error message: {result.comment}")
-                    self.summary_counters['errors'] += 1
+        max_retries = 3
+        retcode = None
+        try:
+            # Ensure request dict is correctly formatted before sending
+            # self.logger.debug(f"Sending order_send request: {request}")
+            result = self.broker.order_send(request)
+
+            if result is None:
+                error_code = self.broker.last_error()
+                error_desc = self.broker.last_error()[1] if isinstance(self.broker.last_error(), tuple) else str(self.broker.last_error())
+                self.logger.error(f"Attempt {attempt}/{max_retries}: order_send returned None for securing {position.ticket}")
+                self.logger.error(f"  - System error code: {error_code}")
+                self.logger.error(f"  - System error desc: {error_desc}")
+                self.summary_counters['errors'] += 1
 
-                    # Specific handling for common errors
-                    if result.retcode == mt5.TRADE_RETCODE_INVALID_STOPS:
-                        self.logger.error("  - Reason: Invalid Stop Loss/Take Profit levels. SL might be too close to current market price.")
-                        # Possibly add logic here to slightly adjust SL if allowed, or just fail.
-                        break # Don't retry if stops are invalid
-                    elif result.retcode == mt5.TRADE_RETCODE_REQUOTE:
-                         self.logger.warning("  - Reason: Requote. Retrying...")
-                         time.sleep(0.5) # Quick retry for requote
-                         continue
-                    elif result.retcode == mt5.TRADE_RETCODE_CONNECTION:
-                         self.logger.error("  - Reason: Connection issue. Retrying...")
-                         time.sleep(2)
-                         continue
-
-
-                    if attempt < max_retries - 1:
-                        time.sleep(1 + attempt) # Exponential backoff
-                    else:
-                         # Log key event failure only after all retries
-                        if log_as_tp1_hit:
-                             self.log_key_event("TP1_SECURE_FAILED", f"Failed to secure position {position.ticket} ({position.symbol}) after TP1 condition met. Error: {result.retcode} - {result.comment}")
+            # Check result code: https://www.mql5.com/en/docs/constants/tradingconstants/enum_trade_return_codes
+            elif result.retcode == mt5.TRADE_RETCODE_DONE:
+                self.logger.info(f"[SUCCESS] Successfully secured position {position.ticket} for {position.symbol}")
+                self.logger.info(f"  Stop loss moved to entry: {position.price_open}")
+                self.secured_positions.add(position.ticket)
+                if self.snapshot is not None:
+                    self.snapshot.apply_sltp(position.ticket, sl=position.price_open)
+                self.summary_counters['positions_secured'] += 1
+                if log_as_tp1_hit:
+                    self.summary_counters['tp1_secured_events'] += 1
+                    # Log key event specifically for TP1 hit leading to secure
+                    self.log_key_event("TP1_SECURED", f"Position {position.ticket} ({position.symbol}) secured at entry {position.price_open} after TP1 condition met.")
+                return True
+            else:
+                # Log specific error message from result
+                retcode = result.retcode
+                self.logger.error(f"Attempt {attempt}/{max_retries}: Failed to modify SL for {position.ticket}")
+                self.logger.error(f"  - Error code: {result.retcode}")
+                self.logger.error(f"  - Error message: {result.comment}")
+                self.summary_counters['errors'] += 1
+                self.symbol_cache.note_retcode(position.symbol, result.retcode)
 
+                # Specific handling for common errors (retry delays come from RetryScheduler)
+                if result.retcode == mt5.TRADE_RETCODE_INVALID_STOPS:
+                    self.logger.error("  - Reason: Invalid Stop Loss/Take Profit levels. SL might be too close to current market price.")
+                    # Possibly add logic here to slightly adjust SL if allowed, or just fail.
+                elif result.retcode == mt5.TRADE_RETCODE_REQUOTE:
+                    self.logger.warning("  - Reason: Requote. Retrying...")
+                elif result.retcode == mt5.TRADE_RETCODE_CONNECTION:
+                    self.logger.error("  - Reason: Connection issue. Retrying...")
 
-            except Exception as e:
-                self.logger.error(f"Exception during order_send for securing {position.ticket}: {str(e)}", exc_info=True)
-                self.summary_counters['errors'] += 1
-                if attempt < max_retries - 1:
-                    time.sleep(1 + attempt)
+        except Exception as e:
+            self.logger.error(f"Exception during order_send for securing {position.ticket}: {str(e)}", exc_info=True)
+            self.summary_counters['errors'] += 1
 
-        return False # Failed after retries
+        # Failed: hand the request to the retry scheduler instead of sleeping here
+        if not self.retry_scheduler.schedule(retry_key, self.secure_position, args=(position,),
+                                             kwargs={'log_as_tp1_hit': log_as_tp1_hit, 'verified': True}, attempt=attempt,
+                                             max_attempts=max_retries, retcode=retcode,
+                                             position_ticket=position.ticket,
+                                             description=f"securing {position.ticket}"):
+            # Log key event failure only after all retries
+            if log_as_tp1_hit:
+                self.log_key_event("TP1_SECURE_FAILED", f"Failed to secure position {position.ticket} ({position.symbol}) after TP1 condition met. Last error: {retcode}")
+
+        return False # Failed (a retry may be pending)
+
+    def get_price_proximity_threshold(self, symbol):
+        """Price tolerance in pips for grouping positions of this symbol"""
+        # Set higher price tolerance for commodities and indices
+        if (symbol in ['OILCash', 'XAUUSDx', 'US30Cash', 'US100Cash', 'JP225Cash', 'GER40Cash'] or
+            'XAU' in symbol.upper() or 'GOLD' in symbol.upper()):
+            return 100  # Increased from 20 to 100 pips for GOLD
+        return self.price_proximity_threshold
 
     def identify_position_groups(self):
         """
@@ -607,99 +2536,30 @@ class PipSecureEA:
         2. Same direction (buy/sell)
         3. Close entry times (using position.time - the open time)
         4. Similar entry prices (with more tolerance for certain instruments)
+        Groups are maintained incrementally by self.group_registry: only positions that
+        opened or closed since the last cycle are (re)grouped, and group IDs stay stable.
+
+        Returns (position_groups, ticket_index) where ticket_index maps each grouped
+        ticket to GroupMembership(group_id, group, tp_index).
         """
-        positions = mt5.positions_get()
+        if self.snapshot is not None:
+            positions = self.snapshot.positions
+        else:
+            positions = self.broker.positions_get()
         if positions is None:
-            error_code, error_desc = mt5.last_error()
+            error_code, error_desc = self.broker.last_error()
             # Throttle this specific error if it repeats
             self.log_throttled('error', f"Failed to get positions: {error_code} - {error_desc}", key="get_positions_fail")
             self.summary_counters['errors'] += 1
-            return {}
+            return {}, {}
 
         if not positions:
             self.logger.debug("No open positions found for grouping.")
-            return {}
-
-        # Sort positions primarily by time, then symbol, then type for consistent grouping
-        try:
-            sorted_positions = sorted(positions, key=lambda p: (p.time, p.symbol, p.type))
-        except Exception as e:
-            self.logger.error(f"Error sorting positions: {e}", exc_info=True)
-            sorted_positions = list(positions) # Use unsorted if sort fails
-
-
-        position_groups = {}
-        group_counter = 0
-        processed_tickets = set()
-
-        for i, position in enumerate(sorted_positions):
-            if position.ticket in processed_tickets:
-                continue
-
-            # Start a new potential group
-            current_group = [position]
-            processed_tickets.add(position.ticket)
-            # Use position type directly in group ID (0 for Buy, 1 for Sell)
-            group_id = f"{position.symbol}_{position.type}_{group_counter}" # More specific ID
+            self.group_registry.reset()
+            return {}, {}
 
-            # Look at subsequent positions that are close in time
-            for j in range(i + 1, len(sorted_positions)):
-                other_position = sorted_positions[j]
-
-                if other_position.ticket in processed_tickets:
-                    continue
-
-                # Check time difference first (most important)
-                time_diff = abs(other_position.time - position.time)
-                if time_diff > self.time_proximity_threshold:
-                    # Since positions are sorted by time, we can break early
-                    # if the symbol/type also matches, but check all for safety
-                    continue # Too far apart in time
-
-                # Check symbol and type
-                if (other_position.symbol == position.symbol and
-                    other_position.type == position.type):
-
-                    # Set higher price tolerance for commodities and indices
-               
-                    price_proximity_override = None
-                    if (position.symbol in ['OILCash', 'XAUUSDx', 'US30Cash', 'US100Cash', 'JP225Cash', 'GER40Cash'] or
-                        'XAU' in position.symbol.upper() or 'GOLD' in position.symbol.upper()):
-                        price_proximity_override = 100  # Increased from 20 to 100 pips for GOLD
-                    
-                        
-                    
-                    # Use the override if available, otherwise use default
-                    price_threshold = price_proximity_override or self.price_proximity_threshold
-
-                    # Optional: Check price proximity
-                    pip_multiplier = self.get_pip_multiplier(position.symbol)
-                    if pip_multiplier > 0: # Avoid division by zero
-                        price_diff_in_pips = abs(other_position.price_open - position.price_open) / pip_multiplier
-                        if price_diff_in_pips <= price_threshold:
-                            # Add to the current group
-                            current_group.append(other_position)
-                            processed_tickets.add(other_position.ticket)
-                            self.logger.debug(f"Added position {other_position.ticket} to group {group_id}: price diff {price_diff_in_pips:.1f} pips <= {price_threshold}")
-                        else:
-                            self.logger.debug(f"Skipping {other_position.ticket} from group {group_id}: price diff {price_diff_in_pips:.1f} pips > {price_threshold}")
-
-                    else: # If pip_multiplier is 0 or invalid, rely only on time/symbol/type
-                        current_group.append(other_position)
-                        processed_tickets.add(other_position.ticket)
-
-
-            # Only store groups with more than one position (representing multi-TP)
-            if len(current_group) > 1:
-                position_groups[group_id] = current_group
-                group_counter += 1
-                # Log the found group
-                self.logger.debug(f"Identified position group: {group_id} with {len(current_group)} positions")
-                for pos in current_group:
-                    tp_val = getattr(pos, 'tp', 0) # Handle potential missing attribute in mocks/real data
-                    self.logger.debug(f"  - Ticket: {pos.ticket}, Entry: {pos.price_open:.5f}, TP: {tp_val:.5f}, Time: {datetime.fromtimestamp(pos.time)}")
-
-        return position_groups
+        self.grouping_engine.time_threshold = self.time_proximity_threshold
+        return self.group_registry.update(positions)
 
     def get_position_index_in_group(self, position, group):
         """Determine the index (TP1, TP2, etc.) of a position within its group"""
@@ -728,7 +2588,7 @@ class PipSecureEA:
         except (IndexError, KeyError):
             return None
 
-    def secure_and_progress_tp(self, position, next_tp_price, next_tp_level, group_id):
+    def secure_and_progress_tp(self, position, next_tp_price, next_tp_level, group_id, attempt=1):
         """Secure position AND progress to next TP in ONE atomic operation"""
         if next_tp_price is None:
             # No more TPs, close the position
@@ -750,29 +2610,46 @@ class PipSecureEA:
             "comment": new_comment
         }
         
+        retry_key = ('progress', position.ticket)
+        if attempt == 1 and self.retry_scheduler.is_pending(retry_key):
+            self.log_throttled('debug', f"TP progression for {position.ticket} has a retry pending, skipping.", key=f"retry_pending_progress_{position.ticket}")
+            return False
+
         max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                result = mt5.order_send(request)
-                
-                if result and result.retcode == mt5.TRADE_RETCODE_DONE:
-                    self.logger.info(f"✅ Secured position {position.ticket} and progressed to TP{next_tp_level} at {next_tp_price}")
-                    self.secured_positions.add(position.ticket)
-                    return True
-                else:
-                    self.logger.error(f"Attempt {attempt + 1}: Failed to secure and progress {position.ticket}")
-                    if attempt < max_retries - 1:
-                        time.sleep(1)
-            except Exception as e:
-                self.logger.error(f"Exception during secure_and_progress_tp: {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(1)
-        
+        retcode = None
+        try:
+            result = self.broker.order_send(request)
+
+            if result and result.retcode == mt5.TRADE_RETCODE_DONE:
+                self.logger.info(f"✅ Secured position {position.ticket} and progressed to TP{next_tp_level} at {next_tp_price}")
+                self.secured_positions.add(position.ticket)
+                if self.snapshot is not None:
+                    self.snapshot.apply_sltp(position.ticket, sl=position.price_open, tp=next_tp_price)
+                return True
+            else:
+                retcode = result.retcode if result else None
+                self.logger.error(f"Attempt {attempt}: Failed to secure and progress {position.ticket}")
+        except Exception as e:
+            self.logger.error(f"Exception during secure_and_progress_tp: {e}")
+
+        self.retry_scheduler.schedule(retry_key, self.secure_and_progress_tp,
+                                      args=(position, next_tp_price, next_tp_level, group_id),
+                                      attempt=attempt, max_attempts=max_retries, retcode=retcode,
+                                      position_ticket=position.ticket,
+                                      description=f"securing and progressing {position.ticket}")
         return False
 
 
-    def diagnose_tp_values(self, group):
-        """Diagnose TP values in a position group"""
+    def diagnose_tp_values(self, group, group_id=None, force=False):
+        """Diagnose TP values in a position group (logged only when the group's state changes)"""
+        key = ('tp', group_id if group_id is not None else tuple(pos.ticket for pos in group))
+        fingerprint = tuple(
+            (pos.ticket, pos.sl, getattr(pos, 'tp', 0), self.diagnostics.price_bucket(pos.symbol, pos.price_current))
+            for pos in group
+        )
+        if not force and not self.diagnostics.should_emit(key, fingerprint):
+            return
+
         self.logger.info("🔍 DIAGNOSING TP VALUES:")
         
         for i, pos in enumerate(group):
@@ -796,38 +2673,48 @@ class PipSecureEA:
         else:
             self.logger.error(f"❌ DIFFERENT TP VALUES FOUND: {unique_tps}")
 
-    def validate_signal_direction_logic(self, position, group):
-            """Validate that BUY/SELL logic is applied correctly"""
-            try:
-                is_buy = position.type == mt5.ORDER_TYPE_BUY
-                symbol = position.symbol
-                
+    def validate_signal_direction_logic(self, position, group, force=False):
+            """
+            Validate that BUY/SELL logic is applied correctly.
+            The check runs every call; its details are logged only when the position's
+            SL, TP, price bucket or result changed (see GroupDiagnostics).
+            """
+            try:
+                is_buy = position.type == mt5.ORDER_TYPE_BUY
+                symbol = position.symbol
+                pos_tp = getattr(position, 'tp', 0)
+
+                # Check if TP makes sense for the direction
+                error = None
+                if pos_tp > 0:
+                    if is_buy and pos_tp <= position.price_open:
+                        error = f"❌ BUY position TP ({pos_tp}) should be ABOVE entry ({position.price_open})"
+                    elif not is_buy and pos_tp >= position.price_open:
+                        error = f"❌ SELL position TP ({pos_tp}) should be BELOW entry ({position.price_open})"
+
+                # Check if SL makes sense for the direction
+                if error is None:
+                    if is_buy and position.sl >= position.price_open:
+                        error = f"❌ BUY position SL ({position.sl}) should be BELOW entry ({position.price_open})"
+                    elif not is_buy and position.sl <= position.price_open:
+                        error = f"❌ SELL position SL ({position.sl}) should be ABOVE entry ({position.price_open})"
+
+                fingerprint = (position.sl, pos_tp, self.diagnostics.price_bucket(symbol, position.price_current), error is None)
+                if not force and not self.diagnostics.should_emit(('direction', position.ticket), fingerprint):
+                    return error is None
+
                 # Log the position details for debugging
                 self.logger.info(f"🔍 Direction Check - {symbol}:")
                 self.logger.info(f"  Position Type: {'BUY' if is_buy else 'SELL'}")
                 self.logger.info(f"  Entry: {position.price_open:.2f}")
                 self.logger.info(f"  Current: {position.price_current:.2f}")
-                self.logger.info(f"  TP: {getattr(position, 'tp', 0):.2f}")
+                self.logger.info(f"  TP: {pos_tp:.2f}")
                 self.logger.info(f"  SL: {position.sl:.2f}")
-                
-                # Check if TP makes sense for the direction
-                pos_tp = getattr(position, 'tp', 0)
-                if pos_tp > 0:
-                    if is_buy and pos_tp <= position.price_open:
-                        self.logger.error(f"❌ BUY position TP ({pos_tp}) should be ABOVE entry ({position.price_open})")
-                        return False
-                    elif not is_buy and pos_tp >= position.price_open:
-                        self.logger.error(f"❌ SELL position TP ({pos_tp}) should be BELOW entry ({position.price_open})")
-                        return False
-                
-                # Check if SL makes sense for the direction  
-                if is_buy and position.sl >= position.price_open:
-                    self.logger.error(f"❌ BUY position SL ({position.sl}) should be BELOW entry ({position.price_open})")
-                    return False
-                elif not is_buy and position.sl <= position.price_open:
-                    self.logger.error(f"❌ SELL position SL ({position.sl}) should be ABOVE entry ({position.price_open})")
+
+                if error is not None:
+                    self.logger.error(error)
                     return False
-                    
+
                 # Check price movement direction
                 pip_multiplier = self.get_pip_multiplier(symbol)
                 if is_buy:
@@ -843,39 +2730,45 @@ class PipSecureEA:
                 self.logger.error(f"Error in direction validation: {e}")
                 return True  # Allow processing to continue
 
-    def get_true_first_price_group(self, position_groups):
-            """Get the group that represents the actual first price level based on signal logic"""
-            
-            if not position_groups:
-                return None, None
-                
-            valid_groups = {gid: group for gid, group in position_groups.items() if len(group) > 1}
-            
-            if len(valid_groups) == 0:
-                return None, None
-                
-            if len(valid_groups) == 1:
-                # Only one group, it must be first price
-                group_id = list(valid_groups.keys())[0]
-                return valid_groups[group_id], group_id
-            
-            # Multiple groups - determine which is logically the first price
-            # Get a sample position to determine direction
-            sample_position = list(valid_groups.values())[0][0]
-            is_sell = sample_position.type == mt5.ORDER_TYPE_SELL
-            
-            if is_sell:
-                # For SELL: first price should be the LOWER entry (price falls to hit it first)
-                lowest_group = min(valid_groups.items(), key=lambda x: sum(p.price_open for p in x[1])/len(x[1]))
-                avg_entry = sum(p.price_open for p in lowest_group[1]) / len(lowest_group[1])
-                self.logger.info(f"SELL: First price group identified (lowest entry): {lowest_group[0]}, avg: {avg_entry:.2f}")
-                return lowest_group[1], lowest_group[0]
-            else:
-                # For BUY: first price should be the HIGHER entry (price rises to hit it first)  
-                highest_group = max(valid_groups.items(), key=lambda x: sum(p.price_open for p in x[1])/len(x[1]))
-                avg_entry = sum(p.price_open for p in highest_group[1]) / len(highest_group[1])
-                self.logger.info(f"BUY: First price group identified (highest entry): {highest_group[0]}, avg: {avg_entry:.2f}")
-                return highest_group[1], highest_group[0]
+    def select_first_price_groups(self, position_groups, aggregates=None):
+        """
+        Per-cycle stage: pick the group that represents the first price level for every
+        (symbol, direction) that has groups, using the groups' running entry aggregates.
+        SELL: first price is the LOWEST average entry (price falls to hit it first).
+        BUY: first price is the HIGHEST average entry (price rises to hit it first).
+
+        Returns {(symbol, type): (group_id, group)}.
+        """
+        if aggregates is None:
+            aggregates = self.group_registry.aggregates
+
+        first_price_groups = {}
+        best_entry = {}
+        for group_id, group in position_groups.items():
+            if len(group) < 2:
+                continue
+            aggregate = aggregates.get(group_id)
+            if aggregate is None:
+                aggregate = GroupAggregate()
+                for pos in group:
+                    aggregate.add(pos)
+            side = (group[0].symbol, group[0].type)
+            avg_entry = aggregate.average_entry
+            current = best_entry.get(side)
+            is_sell = group[0].type == mt5.ORDER_TYPE_SELL
+            if current is None or (avg_entry < current if is_sell else avg_entry > current):
+                best_entry[side] = avg_entry
+                first_price_groups[side] = (group_id, group)
+
+        # Log only when the selection for a symbol/direction changes
+        for side, (group_id, _) in first_price_groups.items():
+            if self.first_price_selection.get(side) != group_id:
+                symbol, position_type = side
+                direction = 'SELL' if position_type == mt5.ORDER_TYPE_SELL else 'BUY'
+                rule = 'lowest' if position_type == mt5.ORDER_TYPE_SELL else 'highest'
+                self.logger.info(f"{direction} {symbol}: First price group identified ({rule} entry): {group_id}, avg: {best_entry[side]:.5f}")
+        self.first_price_selection = {side: group_id for side, (group_id, _) in first_price_groups.items()}
+        return first_price_groups
 
 
 
@@ -884,9 +2777,12 @@ class PipSecureEA:
         Identifies pending orders. Currently doesn't group them but returns all.
         Grouping logic might be added later if needed, similar to position grouping.
         """
-        pending_orders = mt5.orders_get() # Gets both pending and active orders initially
+        if self.snapshot is not None:
+            pending_orders = None if self.snapshot.orders_error else self.snapshot.orders
+        else:
+            pending_orders = self.broker.orders_get() # Gets both pending and active orders initially
         if pending_orders is None:
-            error_code, error_desc = mt5.last_error()
+            error_code, error_desc = self.broker.last_error()
             self.log_throttled('error', f"Failed to get orders: {error_code} - {error_desc}", key="get_orders_fail")
             self.summary_counters['errors'] += 1
             return [] # Return empty list on failure
@@ -935,7 +2831,10 @@ class PipSecureEA:
         position_type = sample_position.type
 
         # Get ALL orders for this symbol
-        all_orders = mt5.orders_get(symbol=symbol)
+        if self.snapshot is not None:
+            all_orders = self.snapshot.orders_for(symbol)
+        else:
+            all_orders = self.broker.orders_get(symbol=symbol)
         if not all_orders:
             self.logger.info(f"No orders found for {symbol}")
             return None
@@ -959,7 +2858,8 @@ class PipSecureEA:
     def delete_pending_orders(self, orders_to_delete):
         """
         Deletes a list of pending orders.
-        Returns the number of successfully deleted orders.
+        Returns the number of successfully deleted orders (failed deletions are
+        handed to the retry scheduler).
         """
         if not orders_to_delete:
             self.logger.info("No pending orders provided for deletion.")
@@ -969,63 +2869,70 @@ class PipSecureEA:
         self.logger.info(f"Attempting to delete {len(orders_to_delete)} pending orders...")
 
         for order in orders_to_delete:
-            order_ticket = getattr(order, 'ticket', None)
-            order_symbol = getattr(order, 'symbol', 'N/A')
-            if order_ticket is None:
+            if getattr(order, 'ticket', None) is None:
                 self.logger.warning("Skipping order deletion: order object missing 'ticket' attribute.")
                 continue
+            if self._delete_pending_order(order):
+                deleted_count += 1
 
-            self.logger.info(f"  Deleting pending order {order_ticket} for {order_symbol}...")
-            request = {
-                "action": mt5.TRADE_ACTION_REMOVE, # Action to remove pending order
-                "order": order_ticket,            # Ticket of the pending order
-                "comment": "PipSecure Delete"
-            }
+        self.logger.info(f"Finished deletion attempt: {deleted_count} / {len(orders_to_delete)} orders successfully deleted.")
+        return deleted_count
 
-            # Send the request
-            max_retries = 2
-            for attempt in range(max_retries):
-                try:
-                    # self.logger.debug(f"Sending order_send request: {request}")
-                    result = mt5.order_send(request)
-
-                    if result and result.retcode == mt5.TRADE_RETCODE_DONE:
-                        self.logger.info(f"  [SUCCESS] Successfully deleted pending order {order_ticket}")
-                        self.summary_counters['pending_orders_deleted'] += 1
-                        self.summary_counters['pending_deleted_events'] += 1
-                        # Log key event for deletion
-                        self.log_key_event("PENDING_DELETED", f"Pending order {order_ticket} ({order_symbol}, Price: {getattr(order, 'price_open', 'N/A')}) deleted due to TP1 hit on related position.")
-                        deleted_count += 1
-                        break # Success, move to next order
-                    elif result:
-                        # Deletion failed
-                        self.logger.error(f"  Attempt {attempt + 1}/{max_retries}: Failed to delete pending order {order_ticket}. Code: {result.retcode}, Msg: {result.comment}")
-                        self.summary_counters['errors'] += 1
-                        if attempt < max_retries - 1:
-                            time.sleep(0.5 + attempt) # Short delay before retry
-                        else:
-                            # Log key event failure only after all retries
-                            self.log_key_event("PENDING_DELETE_FAILED", f"Failed to delete pending order {order_ticket} ({order_symbol}). Error: {result.retcode} - {result.comment}")
+    def _delete_pending_order(self, order, attempt=1):
+        """Send one delete request for a pending order; schedules a retry on failure"""
+        order_ticket = order.ticket
+        order_symbol = getattr(order, 'symbol', 'N/A')
+        retry_key = ('delete', order_ticket)
+        if attempt == 1 and self.retry_scheduler.is_pending(retry_key):
+            self.log_throttled('debug', f"Deleting pending order {order_ticket} has a retry pending, skipping.", key=f"retry_pending_delete_{order_ticket}")
+            return False
 
-                    else:
-                        # order_send returned None
-                        error_code, error_desc = mt5.last_error()
-                        self.logger.error(f"  Attempt {attempt + 1}/{max_retries}: order_send returned None for deleting {order_ticket}. Error: {error_code} - {error_desc}")
-                        self.summary_counters['errors'] += 1
-                        if attempt < max_retries - 1:
-                            time.sleep(1 + attempt)
-                        else:
-                            self.log_key_event("PENDING_DELETE_FAILED", f"Failed to delete pending order {order_ticket} ({order_symbol}). System Error: {error_code} - {error_desc}")
-                except Exception as e:
-                     self.logger.error(f"Exception during order_send for deleting {order_ticket}: {e}", exc_info=True)
-                     self.summary_counters['errors'] += 1
-                     if attempt == max_retries - 1:
-                         self.log_key_event("PENDING_DELETE_FAILED", f"Failed to delete pending order {order_ticket} ({order_symbol}). Exception: {str(e)}")
-                     if attempt < max_retries - 1: time.sleep(1+attempt)
+        self.logger.info(f"  Deleting pending order {order_ticket} for {order_symbol}...")
+        request = {
+            "action": mt5.TRADE_ACTION_REMOVE, # Action to remove pending order
+            "order": order_ticket,            # Ticket of the pending order
+            "comment": "PipSecure Delete"
+        }
 
+        # Send the request
+        max_retries = 2
+        retcode = None
+        try:
+            # self.logger.debug(f"Sending order_send request: {request}")
+            result = self.broker.order_send(request)
+
+            if result and result.retcode == mt5.TRADE_RETCODE_DONE:
+                self.logger.info(f"  [SUCCESS] Successfully deleted pending order {order_ticket}")
+                self.summary_counters['pending_orders_deleted'] += 1
+                self.summary_counters['pending_deleted_events'] += 1
+                if self.snapshot is not None:
+                    self.snapshot.remove_order(order_ticket)
+                # Log key event for deletion
+                self.log_key_event("PENDING_DELETED", f"Pending order {order_ticket} ({order_symbol}, Price: {getattr(order, 'price_open', 'N/A')}) deleted due to TP1 hit on related position.")
+                return True
+            elif result:
+                # Deletion failed
+                retcode = result.retcode
+                failure = f"Error: {result.retcode} - {result.comment}"
+                self.logger.error(f"  Attempt {attempt}/{max_retries}: Failed to delete pending order {order_ticket}. Code: {result.retcode}, Msg: {result.comment}")
+                self.summary_counters['errors'] += 1
+            else:
+                # order_send returned None
+                error_code, error_desc = self.broker.last_error()
+                failure = f"System Error: {error_code} - {error_desc}"
+                self.logger.error(f"  Attempt {attempt}/{max_retries}: order_send returned None for deleting {order_ticket}. Error: {error_code} - {error_desc}")
+                self.summary_counters['errors'] += 1
+        except Exception as e:
+            failure = f"Exception: {str(e)}"
+            self.logger.error(f"Exception during order_send for deleting {order_ticket}: {e}", exc_info=True)
+            self.summary_counters['errors'] += 1
 
-        self.logger.info(f"Finished deletion attempt: {deleted_count} / {len(orders_to_delete)} orders successfully deleted.")
-        return deleted_count
+        if not self.retry_scheduler.schedule(retry_key, self._delete_pending_order, args=(order,),
+                                             attempt=attempt, max_attempts=max_retries, retcode=retcode,
+                                             description=f"deleting pending order {order_ticket}"):
+            # Log key event failure only after all retries
+            self.log_key_event("PENDING_DELETE_FAILED", f"Failed to delete pending order {order_ticket} ({order_symbol}). {failure}")
+        return False
 
     def secure_second_price_positions(self, first_price_group, first_price_entry_value):
         """
@@ -1053,7 +2960,10 @@ class PipSecureEA:
         self.logger.info(f"Searching for second price positions for {symbol} (Type: {'BUY' if position_type == mt5.ORDER_TYPE_BUY else 'SELL'}) to secure at SL={first_price_entry_value:.5f}")
 
         # Get all positions for this symbol and type
-        all_symbol_positions = mt5.positions_get(symbol=symbol)
+        if self.snapshot is not None:
+            all_symbol_positions = self.snapshot.positions_for(symbol)
+        else:
+            all_symbol_positions = self.broker.positions_get(symbol=symbol)
         if not all_symbol_positions:
             self.logger.info(f"No open positions found for {symbol} to check for second price.")
             return 0
@@ -1074,8 +2984,7 @@ class PipSecureEA:
         for position in second_price_candidates:
             # --- Refined Check: Skip if ALREADY secured by Rule 2 OR at its own entry ---
             if position.ticket in self.secured_positions:
-                 symbol_info = mt5.symbol_info(position.symbol)
-                 sl_threshold = 10**(-symbol_info.digits) if symbol_info else 0.00001
+                 sl_threshold = self.get_sl_threshold(position.symbol)
 
                  # Check if SL matches Rule 2 target
                  if abs(position.sl - first_price_entry_value) < sl_threshold:
@@ -1093,81 +3002,137 @@ class PipSecureEA:
                       continue
 
 
-            self.logger.info(f"[TARGET RULE 2] Securing second price position {position.ticket} ({position.symbol})")
-            self.logger.info(f"  Setting SL to FIRST price entry: {first_price_entry_value:.5f} (Original Entry: {position.price_open:.5f}, Current SL: {position.sl:.5f})")
+            if self._secure_second_price_position(position, first_price_entry_value):
+                secured_count += 1
 
-            request = {
-                "action": mt5.TRADE_ACTION_SLTP,
-                "position": position.ticket,
-                "symbol": position.symbol,
-                "sl": first_price_entry_value, # <<< Key part of RULE 2
-                "tp": position.tp,             # Keep original TP
-                "comment": "PipSecure 1st"
-            }
+        self.logger.info(f"Finished securing second price positions: {secured_count} / {len(second_price_candidates)} successfully had secure request sent (Rule 2).")
+        return secured_count
 
-            # Send the request (with retries)
-            max_retries = 3
-            success_sent = False # Flag to track if sending request succeeded
-            for attempt in range(max_retries):
-                try:
-                    # self.logger.debug(f"Sending order_send request: {request}")
-                    result = mt5.order_send(request)
-
-                    if result is None:
-                        error_code, error_desc = mt5.last_error()
-                        self.logger.error(f"Attempt {attempt + 1}/{max_retries}: order_send returned None for securing 2nd price {position.ticket}")
-                        self.logger.error(f"  - System error: {error_code} - {error_desc}")
-                        self.summary_counters['errors'] += 1
-                        if attempt < max_retries - 1: time.sleep(1 + attempt)
-                        continue
+    def _secure_second_price_position(self, position, first_price_entry_value, attempt=1):
+        """Send one Rule 2 SL modification for a second price position; schedules a retry on failure"""
+        retry_key = ('secure_2nd', position.ticket)
+        if attempt == 1 and self.retry_scheduler.is_pending(retry_key):
+            self.log_throttled('debug', f"Securing 2nd price {position.ticket} has a retry pending, skipping.", key=f"retry_pending_sec2_{position.ticket}")
+            return False
 
-                    if result.retcode == mt5.TRADE_RETCODE_DONE:
-                        self.logger.info(f"[SUCCESS RULE 2] Successfully sent request to secure second price position {position.ticket}")
-                        self.logger.info(f"  Stop loss intended for first price entry: {first_price_entry_value:.5f}")
-                        # Log Key Event for Rule 2
-                        self.log_key_event("SECOND_PRICE_SECURED", f"Position {position.ticket} ({position.symbol}, Entry: {position.price_open:.5f}) secured with SL at FIRST price entry {first_price_entry_value:.5f} (Rule 2).")
-
-                        # --- !!! IMPORTANT: Update internal state immediately !!! ---
-                        # Mark this position as handled by Rule 2 so the main loop skips it.
-                        self.secured_positions.add(position.ticket)
-                        # --- End Important Update ---
-
-                        self.summary_counters['positions_secured'] += 1 # Count towards total secured
-                        self.summary_counters['second_price_secured_events'] += 1
-                        secured_count += 1
-                        success_sent = True # Mark success
-                        break # Success for this position
-                    else:
-                        self.logger.error(f"Attempt {attempt + 1}/{max_retries}: Failed to modify SL for 2nd price {position.ticket} (Rule 2)")
-                        self.logger.error(f"  - Error code: {result.retcode}")
-                        self.logger.error(f"  - Error message: {result.comment}")
-                        self.summary_counters['errors'] += 1
-                        # Check for specific non-retryable errors like invalid stops
-                        if result.retcode == mt5.TRADE_RETCODE_INVALID_STOPS:
-                             self.logger.error(f"  - Reason: Invalid Stop Loss level {first_price_entry_value:.5f}. Might be too close to market.")
-                             # Log Key Event for Rule 2 Failure
-                             self.log_key_event("SECOND_PRICE_SECURE_FAILED", f"Failed to secure position {position.ticket} ({position.symbol}) with SL at first price entry {first_price_entry_value:.5f}. Invalid SL.")
-                             break # Don't retry invalid stops
-                        elif attempt < max_retries - 1:
-                             time.sleep(1 + attempt)
-                        else:
-                            # Log key event failure after all retries
-                             self.log_key_event("SECOND_PRICE_SECURE_FAILED", f"Failed to secure position {position.ticket} ({position.symbol}) with SL at first price entry {first_price_entry_value:.5f}. Error: {result.retcode} - {result.comment}")
+        self.logger.info(f"[TARGET RULE 2] Securing second price position {position.ticket} ({position.symbol})")
+        self.logger.info(f"  Setting SL to FIRST price entry: {first_price_entry_value:.5f} (Original Entry: {position.price_open:.5f}, Current SL: {position.sl:.5f})")
 
+        request = {
+            "action": mt5.TRADE_ACTION_SLTP,
+            "position": position.ticket,
+            "symbol": position.symbol,
+            "sl": first_price_entry_value, # <<< Key part of RULE 2
+            "tp": position.tp,             # Keep original TP
+            "comment": "PipSecure 1st"
+        }
 
-                except Exception as e:
-                    self.logger.error(f"Exception during order_send for securing 2nd price {position.ticket}: {str(e)}", exc_info=True)
-                    self.summary_counters['errors'] += 1
-                    if attempt == max_retries - 1:
-                        # Log key event failure after exception
-                        self.log_key_event("SECOND_PRICE_SECURE_FAILED", f"Failed to secure position {position.ticket} ({position.symbol}) with SL at first price entry {first_price_entry_value:.5f}. Exception: {str(e)}")
-                    if attempt < max_retries - 1:
-                        time.sleep(1+attempt)
+        # Send the request (retries go through the retry scheduler)
+        max_retries = 3
+        retcode = None
+        try:
+            # self.logger.debug(f"Sending order_send request: {request}")
+            result = self.broker.order_send(request)
+
+            if result is None:
+                error_code, error_desc = self.broker.last_error()
+                failure = f"System error: {error_code} - {error_desc}"
+                self.logger.error(f"Attempt {attempt}/{max_retries}: order_send returned None for securing 2nd price {position.ticket}")
+                self.logger.error(f"  - System error: {error_code} - {error_desc}")
+                self.summary_counters['errors'] += 1
 
+            elif result.retcode == mt5.TRADE_RETCODE_DONE:
+                self.logger.info(f"[SUCCESS RULE 2] Successfully sent request to secure second price position {position.ticket}")
+                self.logger.info(f"  Stop loss intended for first price entry: {first_price_entry_value:.5f}")
+                # Log Key Event for Rule 2
+                self.log_key_event("SECOND_PRICE_SECURED", f"Position {position.ticket} ({position.symbol}, Entry: {position.price_open:.5f}) secured with SL at FIRST price entry {first_price_entry_value:.5f} (Rule 2).")
+
+                # --- !!! IMPORTANT: Update internal state immediately !!! ---
+                # Mark this position as handled by Rule 2 so the main loop skips it.
+                self.secured_positions.add(position.ticket)
+                if self.snapshot is not None:
+                    self.snapshot.apply_sltp(position.ticket, sl=first_price_entry_value)
+                # --- End Important Update ---
+
+                self.summary_counters['positions_secured'] += 1 # Count towards total secured
+                self.summary_counters['second_price_secured_events'] += 1
+                return True
+            else:
+                retcode = result.retcode
+                failure = f"Error: {result.retcode} - {result.comment}"
+                self.logger.error(f"Attempt {attempt}/{max_retries}: Failed to modify SL for 2nd price {position.ticket} (Rule 2)")
+                self.logger.error(f"  - Error code: {result.retcode}")
+                self.logger.error(f"  - Error message: {result.comment}")
+                self.summary_counters['errors'] += 1
+                self.symbol_cache.note_retcode(position.symbol, result.retcode)
+                # Invalid stops are not retried by the scheduler
+                if result.retcode == mt5.TRADE_RETCODE_INVALID_STOPS:
+                    failure = "Invalid SL."
+                    self.logger.error(f"  - Reason: Invalid Stop Loss level {first_price_entry_value:.5f}. Might be too close to market.")
+
+        except Exception as e:
+            failure = f"Exception: {str(e)}"
+            self.logger.error(f"Exception during order_send for securing 2nd price {position.ticket}: {str(e)}", exc_info=True)
+            self.summary_counters['errors'] += 1
+
+        if not self.retry_scheduler.schedule(retry_key, self._secure_second_price_position,
+                                             args=(position, first_price_entry_value), attempt=attempt,
+                                             max_attempts=max_retries, retcode=retcode,
+                                             position_ticket=position.ticket,
+                                             description=f"securing 2nd price {position.ticket}"):
+            # Log Key Event for Rule 2 failure after all retries
+            self.log_key_event("SECOND_PRICE_SECURE_FAILED", f"Failed to secure position {position.ticket} ({position.symbol}) with SL at first price entry {first_price_entry_value:.5f}. {failure}")
+        return False
 
-        self.logger.info(f"Finished securing second price positions: {secured_count} / {len(second_price_candidates)} successfully had secure request sent (Rule 2).")
-        return secured_count
 
+    def build_tp1_action_plan(self, position, group, group_id):
+        """
+        Action plan for a basket whose TP1 position triggered:
+          1. Close the TP1 position (or progress it to the next TP for progressive groups)
+          2. Secure the other positions of the group at entry
+          3. Delete the corresponding pending orders, or apply Rule 2 if there are none
+        GroupActionExecutor submits the independent steps back-to-back. The siblings of a
+        closed TP1 position are only secured once the close succeeded (requires='close'),
+        so they go out as a second wave after the close result.
+        """
+        actions = []
+
+        # Action 1: Close TP1 position (check if this uses progressive TP system)
+        progressive = self.progressive_tp_manager.should_handle_tp_progression(position, group, group_id)
+        if progressive:
+            self.logger.info(f"Progressive TP: Handling TP hit for {position.ticket}")
+            actions.append(GroupAction('progress_tp', f"progress TP of {position.ticket}",
+                                       self.progressive_tp_manager.handle_tp_hit, (position, group, group_id), {},
+                                       retry_key=('progress', position.ticket)))
+        else:
+            self.logger.info(f"Action 1: Closing TP1 position {position.ticket}")
+            actions.append(GroupAction('close', f"close TP1 position {position.ticket}",
+                                       self.close_position, (position,), {}))
+
+        # Action 2: Secure other positions in the group
+        self.logger.info(f"Action 2: Securing other positions in group {group_id}")
+        for other_pos in group:
+            if other_pos.ticket != position.ticket and other_pos.ticket not in self.secured_positions:
+                self.logger.info(f"Securing related position {other_pos.ticket} (TP{self.get_position_index_in_group(other_pos, group)})")
+                actions.append(GroupAction('secure', f"secure {other_pos.ticket}",
+                                           self.secure_position, (other_pos,), {'log_as_tp1_hit': False},
+                                           requires=None if progressive else 'close',
+                                           retry_key=('secure', other_pos.ticket)))
+
+        # Action 3: Delete pending orders, or secure second price positions if there are none
+        self.logger.info(f"Action 3: Deleting pending orders for {position.symbol}")
+        corresponding_pending = self.find_corresponding_pending_orders(group)
+        if corresponding_pending:
+            self.logger.info(f"Found {len(corresponding_pending)} pending orders. Deleting...")
+            for order in corresponding_pending:
+                actions.append(GroupAction('delete_pending', f"delete pending order {order.ticket}",
+                                           self._delete_pending_order, (order,), {},
+                                           retry_key=('delete', order.ticket)))
+        else:
+            self.logger.info(f"No pending orders found, checking for second price positions")
+            actions.append(GroupAction('second_price', f"Rule 2 for group {group_id}",
+                                       self.secure_second_price_positions, (group, position.price_open), {}))
+        return actions
 
     def check_positions(self):
         """
@@ -1187,7 +3152,7 @@ class PipSecureEA:
             # Set to track which TP1 groups have triggered an action in this cycle
             tp1_action_triggered_groups = set()
             # Verify MT5 connection is still active
-            terminal_info = mt5.terminal_info()
+            terminal_info = self.broker.terminal_info()
             if not terminal_info or terminal_info.connected is False:
                 self.logger.error("MT5 connection lost - attempting to reconnect...")
                 self.summary_counters['errors'] += 1
@@ -1198,13 +3163,16 @@ class PipSecureEA:
                 else:
                     self.logger.info("Successfully reconnected to MT5.")
 
-            # Get positions
-            positions = mt5.positions_get()
-            if positions is None:
-                error_code, error_desc = mt5.last_error()
+            # Take the cycle snapshot - the only positions_get round-trip of this cycle
+            self.snapshot = BrokerSnapshot.take(self.broker)
+            if self.snapshot is None:
+                error_code, error_desc = self.broker.last_error()
                 self.log_throttled('error', f"Failed to get positions: {error_code} - {error_desc}", key="check_get_pos_fail")
                 self.summary_counters['errors'] += 1
                 return
+            positions = self.snapshot.positions
+            # Forget per-ticket state of tickets that closed since the last cycle
+            self.reconciler.reconcile(self.snapshot.by_ticket)
             # In check_positions method, add after getting positions:
             for position in positions:
                 if 'XAU' in position.symbol.upper() or 'GOLD' in position.symbol.upper():
@@ -1227,12 +3195,20 @@ class PipSecureEA:
                 return
 
             # Identify position groups
-            position_groups = self.identify_position_groups()
+            position_groups, ticket_index = self.identify_position_groups()
             
             # Clean up tp1_hit_groups - remove groups that no longer exist
             existing_group_ids = set(position_groups.keys())
             self.tp1_hit_groups = self.tp1_hit_groups.intersection(existing_group_ids)
 
+            # Diagnostics: forget closed groups/tickets, pick up on-demand dump requests
+            live_keys = {('tp', group_id) for group_id in position_groups}
+            live_keys.update(('direction', ticket) for ticket in ticket_index)
+            self.reconciler.note('diagnostics', self.diagnostics.begin_cycle(live_keys))
+
+            # First price group per (symbol, direction) - computed once per cycle
+            first_price_groups = self.select_first_price_groups(position_groups)
+
             # Process each position
             for position in list(positions):
                 try:
@@ -1266,28 +3242,22 @@ class PipSecureEA:
                     else:
                         pips_gained = (position.price_open - position.price_current) / pip_multiplier
 
-                    # Find group
-                    group = None
-                    group_id = None
-                    for gid, group_positions in position_groups.items():
-                        if any(p.ticket == position.ticket for p in group_positions):
-                            group = group_positions
-                            group_id = gid
-                            break
+                    # Find group (O(1) via the ticket index built by the grouping stage)
+                    membership = ticket_index.get(position.ticket)
 
                     # Process grouped positions
-                        if group:
-                            self.diagnose_tp_values(group)
-                            # Add validation for BUY/SELL logic
-                            if not self.validate_signal_direction_logic(position, group):
-                                self.logger.error(f"❌ Direction logic validation failed for {position.ticket}")
-                                continue
-                            # Find the true first price group
-                            true_first_price_group, true_first_price_group_id = self.get_true_first_price_group(position_groups)
-                            position_index = self.get_position_index_in_group(position, group)
-                            if position_index is None:
-                                self.logger.debug(f"Could not determine TP index for position {position.ticket} in group {group_id}. Skipping TP logic.")
-                                continue                       
+                    if membership:
+                        group_id, group, position_index = membership
+                        self.diagnose_tp_values(group, group_id)
+                        # Add validation for BUY/SELL logic
+                        if not self.validate_signal_direction_logic(position, group):
+                            self.logger.error(f"❌ Direction logic validation failed for {position.ticket}")
+                            continue
+                        # Find the true first price group for this symbol and direction
+                        true_first_price_group_id, true_first_price_group = first_price_groups.get((symbol, position.type), (None, None))
+                        if position_index is None:
+                            self.logger.debug(f"Could not determine TP index for position {position.ticket} in group {group_id}. Skipping TP logic.")
+                            continue
                     self.logger.debug(
                         f"Processing grouped position {position.ticket} (TP{position_index}) "
                         f"in group {group_id} - {symbol}. "
@@ -1385,51 +3355,14 @@ class PipSecureEA:
 
                         if should_act and pips_gained >= min_pips_required:
                             self.logger.info(f"TP1 trigger condition met for {position.ticket} ({symbol}): {action_reason}")
+                            triggered_at = time.monotonic()
                             tp1_action_triggered_groups.add(group_id)
                             self._save_tp1_hit_group(group_id)
-                            # Action 1: Close TP1 position
-                            self.logger.info(f"Action 1: Closing TP1 position {position.ticket}")
-                        if should_act and pips_gained >= min_pips_required:
-                            self.logger.info(f"TP1 trigger condition met for {position.ticket} ({symbol}): {action_reason}")
-                            tp1_action_triggered_groups.add(group_id)
-                            self._save_tp1_hit_group(group_id)
-                            
-                            # Check if this uses progressive TP system
-                            if self.progressive_tp_manager.should_handle_tp_progression(position, group, group_id):
-                                # Progressive TP handling
-                                self.logger.info(f"Progressive TP: Handling TP hit for {position.ticket}")
-                                self.progressive_tp_manager.handle_tp_hit(position, group, group_id)
-                                
-                                # Still secure other positions in group
-                                self.logger.info(f"Action 2: Securing other positions in group {group_id}")
-                                for other_pos in group:
-                                    if other_pos.ticket != position.ticket and other_pos.ticket not in self.secured_positions:
-                                        self.logger.info(f"Securing related position {other_pos.ticket}")
-                                        self.secure_position(other_pos, log_as_tp1_hit=False)
-                            else:
-                                # Original logic for non-progressive positions
-                                self.logger.info(f"Action 1: Closing TP1 position {position.ticket}")
-                                if self.close_position(position):
-                                    self.logger.info(f"TP1 position {position.ticket} closed successfully")
-                                    
-                                    # Action 2: Secure other positions in the group
-                                    self.logger.info(f"Action 2: Securing other positions in group {group_id}")
-                                    for other_pos in group:
-                                        if other_pos.ticket != position.ticket and other_pos.ticket not in self.secured_positions:
-                                            self.logger.info(f"Securing related position {other_pos.ticket} (TP{self.get_position_index_in_group(other_pos, group)})")
-                                            self.secure_position(other_pos, log_as_tp1_hit=False)
-                            
-                            # Action 3: Delete pending orders (keep this unchanged)
-                            self.logger.info(f"Action 3: Deleting pending orders for {symbol}")
-                            corresponding_pending = self.find_corresponding_pending_orders(group)
-                            if corresponding_pending:
-                                self.logger.info(f"Found {len(corresponding_pending)} pending orders. Deleting...")
-                                deleted_count = self.delete_pending_orders(corresponding_pending)
-                                self.logger.info(f"Deleted {deleted_count} pending orders")
-                            else:
-                                self.logger.info(f"No pending orders found, checking for second price positions")
-                                first_price_entry = position.price_open
-                                self.secure_second_price_positions(group, first_price_entry)
+
+                            # Build the basket's whole action plan, then submit it back-to-back
+                            # (failed requests are retried by the retry scheduler, not inline)
+                            actions = self.build_tp1_action_plan(position, group, group_id)
+                            self.group_executor.execute(group_id, actions, triggered_at)
                         
                         # Check other positions if TP1 in group was hit (either in this cycle or previously)
                         elif position_index > 1 and (group_id in self.tp1_hit_groups or group_id in tp1_action_triggered_groups):
@@ -1454,24 +3387,26 @@ class PipSecureEA:
         except Exception as e:
             self.logger.critical(f"Critical error in check_positions: {str(e)}", exc_info=True)
             self.summary_counters['errors'] += 1
+        finally:
+            # Snapshot is only valid for this cycle
+            self.snapshot = None
             
       #tp1 close when 5 pips reach      
     def close_position(self, position):
         """Close a specific position with simple filling mode approach"""
         try:
-            # Get current price
-            tick = mt5.symbol_info_tick(position.symbol)
-            if tick is None:
-                self.logger.error(f"Failed to get tick data for {position.symbol}")
-                return False
-                
-            # Determine closing price and type
-            if position.type == mt5.ORDER_TYPE_BUY:
-                close_type = mt5.ORDER_TYPE_SELL
-                close_price = tick.bid
-            else:
-                close_type = mt5.ORDER_TYPE_BUY
-                close_price = tick.ask
+            # Determine closing price and type. The snapshot's price_current is already the
+            # price a close fills at (bid for BUY, ask for SELL), so a tick is only fetched
+            # when it is missing or the broker says the price moved.
+            is_buy = position.type == mt5.ORDER_TYPE_BUY
+            close_type = mt5.ORDER_TYPE_SELL if is_buy else mt5.ORDER_TYPE_BUY
+            close_price = getattr(position, 'price_current', 0)
+            price_refreshed = False
+            if not close_price:
+                close_price = self._fetch_close_price(position)
+                price_refreshed = True
+                if close_price is None:
+                    return False
             
             # Build the basic request without filling mode
             request = {
@@ -1485,53 +3420,125 @@ class PipSecureEA:
                 "comment": "PipSecureEA: TP1 Close",
             }
             
-            # Try different filling modes in order of likelihood
-            filling_modes = [
-                mt5.ORDER_FILLING_IOC,
-                mt5.ORDER_FILLING_FOK,
-                mt5.ORDER_FILLING_RETURN,
-                None  # Try without filling mode as last resort
-            ]
-            
-            for filling_mode in filling_modes:
-                try:
-                    if filling_mode is not None:
-                        request["type_filling"] = filling_mode
-                    else:
-                        request.pop("type_filling", None)
-                    
-                    self.logger.debug(f"Trying to close position {position.ticket} with filling mode: {filling_mode}")
-                    
-                    result = mt5.order_send(request)
-                    
-                    if result and result.retcode == mt5.TRADE_RETCODE_DONE:
-                        self.logger.info(f"[SUCCESS] Closed position {position.ticket} at {close_price}")
-                        return True
-                    elif result:
-                        self.logger.debug(f"Failed with filling mode {filling_mode}: {result.comment}")
-                        # If it's not a filling mode error, don't try other modes
-                        if "filling" not in result.comment.lower():
-                            self.logger.error(f"Failed to close position {position.ticket}: {result.comment}")
-                            return False
-                            
-                except AttributeError:
-                    # This filling mode constant doesn't exist, try next one
-                    continue
-                except Exception as e:
-                    self.logger.debug(f"Error with filling mode {filling_mode}: {str(e)}")
-                    continue
-            
+            # Send with the symbol's known filling mode (falls back through the others only if rejected)
+            result = self.send_deal_request(request, f"close position {position.ticket}")
+
+            if result and result.retcode in (mt5.TRADE_RETCODE_REQUOTE, mt5.TRADE_RETCODE_PRICE_CHANGED) and not price_refreshed:
+                # Price moved since the snapshot - refresh once and resend
+                fresh_price = self._fetch_close_price(position)
+                if fresh_price is not None:
+                    close_price = fresh_price
+                    request["price"] = close_price
+                    result = self.send_deal_request(request, f"close position {position.ticket}")
+
+            if result and result.retcode == mt5.TRADE_RETCODE_DONE:
+                self.logger.info(f"[SUCCESS] Closed position {position.ticket} at {close_price}")
+                if self.snapshot is not None:
+                    self.snapshot.remove(position.ticket)
+                return True
+            elif result:
+                self.logger.error(f"Failed to close position {position.ticket}: {result.comment}")
+                return False
+
             self.logger.error(f"Failed to close position {position.ticket} after trying all filling modes")
             return False
                 
         except Exception as e:
             self.logger.error(f"Error closing position {position.ticket}: {str(e)}")
             return False
+
+    def send_deal_request(self, request, description):
+        """
+        Send a TRADE_ACTION_DEAL request using the symbol's cached filling mode. Other modes
+        are tried only when the broker rejects the filling mode. Returns the last result
+        (None if every attempt returned None or raised).
+        """
+        symbol = request["symbol"]
+        result = None
+        attempts = 0
+        for filling_mode in self.filling_modes.candidates(symbol):
+            attempts += 1
+            try:
+                if filling_mode is not None:
+                    request["type_filling"] = filling_mode
+                else:
+                    request.pop("type_filling", None)
+
+                self.logger.debug(f"Trying to {description} with filling mode: {filling_mode}")
+                result = self.broker.order_send(request)
+
+                if result and result.retcode == mt5.TRADE_RETCODE_DONE:
+                    self.filling_modes.record_success(symbol, filling_mode, attempts)
+                    return result
+                elif result:
+                    self.logger.debug(f"Failed with filling mode {filling_mode}: {result.comment}")
+                    self.symbol_cache.note_retcode(symbol, result.retcode)
+                    # If it's not a filling mode error, don't try other modes
+                    if result.retcode != mt5.TRADE_RETCODE_INVALID_FILL and "filling" not in result.comment.lower():
+                        return result
+                    self.filling_modes.record_rejection(symbol, filling_mode)
+
+            except Exception as e:
+                self.logger.debug(f"Error with filling mode {filling_mode}: {str(e)}")
+                continue
+        return result
+
+    def _fetch_close_price(self, position):
+        """Current price a close of this position would fill at, straight from the terminal"""
+        tick = self.broker.symbol_info_tick(position.symbol)
+        if tick is None:
+            self.logger.error(f"Failed to get tick data for {position.symbol}")
+            return None
+        return tick.bid if position.type == mt5.ORDER_TYPE_BUY else tick.ask
     
-    def run(self):
+    def service_retries(self):
+        """
+        Send the retry intents whose deadline has passed. Position-based intents are
+        re-sent with the current position from the broker (the only lookup of the
+        attempt), or dropped if it has closed.
+        Returns the number of retries sent.
+        """
+        sent = 0
+        for intent in self.retry_scheduler.pop_due():
+            args = intent.args
+            if intent.position_ticket is not None:
+                fresh = self.broker.positions_get(ticket=intent.position_ticket)
+                if not fresh:
+                    self.logger.info(f"Dropping retry for {intent.description}: position no longer open")
+                    self.group_executor.resolve_retry(intent.key, False)
+                    continue
+                args = (fresh[0],) + args[1:]
+            try:
+                result = intent.action(*args, attempt=intent.attempt, **intent.kwargs)
+                sent += 1
+            except Exception as e:
+                self.logger.error(f"Exception while retrying {intent.description}: {e}", exc_info=True)
+                self.summary_counters['errors'] += 1
+                result = False
+            if not self.retry_scheduler.is_pending(intent.key):
+                self.group_executor.resolve_retry(intent.key, result is not False)
+        return sent
+
+    def wait_for_next_cycle(self, next_cycle_at):
+        """Sleep until next_cycle_at (time.monotonic), waking up to service due order retries"""
+        while True:
+            self.service_retries()
+            if self.key_events is not None:
+                self.key_events.tick()
+            now = time.monotonic()
+            if now >= next_cycle_at:
+                return
+            wake_at = next_cycle_at
+            next_retry_at = self.retry_scheduler.next_deadline()
+            if next_retry_at is not None:
+                wake_at = min(wake_at, next_retry_at)
+            time.sleep(max(0.0, wake_at - now))
+
+    def run(self, standby=False):
         """
         The main execution loop for a single PipSecureEA instance.
         Connects, checks positions periodically, and disconnects on exit.
+        With standby=True the instance connects and waits as a warm standby first.
         """
         self.logger.info(f"Starting PipSecureEA monitoring for account {self.account_name}")
         
@@ -1539,10 +3546,14 @@ class PipSecureEA:
         if self.TEST_MODE:
             self.logger.info("🧪 RUNNING IN TEST MODE")
         
+        if standby:
+            self.role = 'standby' # Before connecting: a standby never beats the primary's slot
         if self.connect():
             try:
+                if standby:
+                    self.wait_as_standby()
                 # 🧪 CREATE TEST POSITIONS IF IN TEST MODE
-                if self.TEST_MODE:
+                elif self.TEST_MODE:
                     self.logger.info("⏳ Creating test positions...")
                     time.sleep(3)  # Wait for connection stability
                     if self.create_test_positions():
@@ -1553,12 +3564,23 @@ class PipSecureEA:
                 
                 # Main execution loop
                 while True:
+                    # A standby that took over owns the account now - never act alongside it
+                    if not self.heartbeat.holds_lease():
+                        self.logger.critical(f"Heartbeat slot of {self.account_name} taken over by another process - stepping down.")
+                        self.role = 'stepped_down'
+                        break
+
                     # --- Main Loop Actions ---
+                    cycle_started = time.monotonic()
                     self.check_positions()
-                    self.heartbeat.update_heartbeat() # Update heartbeat regularly
+                    self.persist_state() # One transaction with everything this cycle changed
+                    self.publish_standby_snapshot()
+                    # Update heartbeat regularly (a few stores into the shared slot file)
+                    self.beat(cycle_duration=time.monotonic() - cycle_started,
+                              error_count=self.summary_counters['errors'])
 
-                    # --- Sleep Interval ---
-                    time.sleep(1) # Check every second
+                    # --- Sleep Interval (order retries are serviced while waiting) ---
+                    self.wait_for_next_cycle(time.monotonic() + 1) # Check every second
 
             except KeyboardInterrupt:
                 self.logger.info(f"KeyboardInterrupt received for account {self.account_name}. Shutting down.")
@@ -1567,30 +3589,93 @@ class PipSecureEA:
             finally:
                 self.logger.info(f"Disconnecting EA for account {self.account_name}.")
                 self.disconnect()
+                if self.role == 'primary': # Only the active process writes the shared state
+                    self.persist_state()
+                    self.publish_standby_snapshot(force=True)
                 self.log_summary(force=True) # Log final summary
+                if self.state_store is not None:
+                    self.state_store.close()
+                    self.state_store = None
+                if self.key_events is not None:
+                    self.key_events.close() # Flush buffered key events
+                self.stop_logging() # Flush queued log records
         else:
             self.logger.error(f"Could not connect account {self.account_name}. EA will not run.")
+class SignalDataCache:
+    """
+    group_id -> {'tp_levels', 'created_at'} kept in expiry order. Every entry lives for
+    the same ttl, so insertion order (re-caching moves an entry to the end) is expiry
+    order: inserts are O(1) and expired entries are dropped from the front lazily on
+    access, instead of rebuilding the whole dict on every insert. The EA also expires
+    the cache from its reconciler sweeps, so entries age out between accesses too.
+    """
+
+    def __init__(self, ttl=86400, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def expire(self):
+        """Drop the entries older than ttl; returns how many were dropped"""
+        cutoff = self.clock() - self.ttl
+        evicted = 0
+        while self.entries:
+            group_id, data = next(iter(self.entries.items()))
+            if data['created_at'] >= cutoff:
+                break
+            del self.entries[group_id]
+            evicted += 1
+        self.stats['evictions'] += evicted
+        return evicted
+
+    def put(self, group_id, tp_levels):
+        self.entries[group_id] = {'tp_levels': tp_levels, 'created_at': self.clock()}
+        self.entries.move_to_end(group_id)
+        self.expire()
+
+    def load(self, signals):
+        """Restore persisted entries (warm start), keeping their original creation times"""
+        for group_id, data in sorted(signals.items(), key=lambda item: item[1].get('created_at', 0)):
+            self.entries[group_id] = data
+            self.entries.move_to_end(group_id)
+        self.expire()
+
+    def get(self, group_id, default=None):
+        self.expire()
+        data = self.entries.get(group_id)
+        if data is None:
+            self.stats['misses'] += 1
+            return default
+        self.stats['hits'] += 1
+        return data
+
+    def __contains__(self, group_id):
+        self.expire()
+        return group_id in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def keys(self):
+        return self.entries.keys()
+
+    def items(self):
+        return self.entries.items()
+
+
 class ProgressiveTPManager:
     """Manages progressive TP placement and tracking"""
     
     def __init__(self, pip_secure_ea):
         self.ea = pip_secure_ea
         self.logger = pip_secure_ea.logger
-        # Store original signal data for TP progression
-        self.signal_data_cache = {}  # group_id -> signal_data
+        # Store original signal data for TP progression (entries expire after 24 hours)
+        self.signal_data_cache = SignalDataCache(ttl=pip_secure_ea.account_config.get('signal_cache_ttl', 86400))
     
     def cache_signal_data(self, group_id, tp_levels):
         """Cache original TP levels for later progression"""
-        self.signal_data_cache[group_id] = {
-            'tp_levels': tp_levels,
-            'created_at': time.time()
-        }
-        # Clean old cache entries (older than 24 hours)
-        current_time = time.time()
-        self.signal_data_cache = {
-            gid: data for gid, data in self.signal_data_cache.items()
-            if current_time - data['created_at'] < 86400
-        }
+        self.signal_data_cache.put(group_id, tp_levels)
     
     def handle_tp_hit(self, position, group, group_id):
         """Handle TP hit with progressive advancement"""
@@ -1625,16 +3710,168 @@ class ProgressiveTPManager:
         # Only handle progression for positions with our comment format
         comment = getattr(position, 'comment', '')
         return "_TP" in comment and group_id in self.signal_data_cache                
+
+
+# ------------------------------------------------------------------------
+# PROCESS SUPERVISOR (restart policy for the account processes)
+# ------------------------------------------------------------------------
+
+# Exit code of an account process that stepped down because its warm standby took over
+# the lease: a handoff, not a crash - it is restarted as the standby without backoff.
+EXIT_STEPPED_DOWN = 75
+
+class RestartPolicy:
+    """
+    When to restart an account process that exited: exponential backoff from base_delay
+    up to max_delay, each delay spread by +/- jitter so accounts that die together do not
+    reconnect in lockstep. A process that stayed up for stable_after seconds starts over
+    at base_delay. More than max_restarts exits within crash_window seconds is a crash
+    loop: the account is quarantined for quarantine_period seconds (0: until the monitor
+    is restarted) instead of hammering the terminal.
+    """
+
+    def __init__(self, base_delay=1.0, max_delay=60.0, jitter=0.2, stable_after=60.0,
+                 max_restarts=5, crash_window=300.0, quarantine_period=1800.0, rng=None):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.stable_after = stable_after
+        self.max_restarts = max_restarts
+        self.crash_window = crash_window
+        self.quarantine_period = quarantine_period
+        self.rng = rng or random.Random()
+
+    @classmethod
+    def from_config(cls, account_config):
+        return cls(
+            base_delay=account_config.get('restart_base_delay', 1.0),
+            max_delay=account_config.get('restart_max_delay', 60.0),
+            jitter=account_config.get('restart_jitter', 0.2),
+            stable_after=account_config.get('restart_stable_after', 60.0),
+            max_restarts=account_config.get('crash_loop_max_restarts', 5),
+            crash_window=account_config.get('crash_loop_window', 300.0),
+            quarantine_period=account_config.get('crash_loop_quarantine', 1800.0),
+        )
+
+    def backoff(self, failures):
+        """Delay before restart number `failures` of the current run of quick exits"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (failures - 1))
+        return delay * (1 + self.rng.uniform(-self.jitter, self.jitter))
+
+
+class SupervisedProcess:
+    """
+    One supervised process slot of MultiAccountMonitor: an account's EA or its warm
+    standby. Tracks the live process, its restart count and the exit history the
+    RestartPolicy decides on. All times are time.monotonic() values.
+    """
+
+    def __init__(self, account_name, account_config, standby=False, policy=None):
+        self.account_name = account_name
+        self.account_config = account_config
+        self.name = f"{account_name} (standby)" if standby else account_name
+        self.process_name = f"EA_{account_name}_standby" if standby else f"EA_{account_name}"
+        self.standby = standby # Role of the current (or last) launch
+        self.policy = policy or RestartPolicy.from_config(account_config)
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.quarantines = 0
+        self.handovers = 0 # Clean step-downs after the standby took over (not failures)
+        self.failures = 0 # Quick exits in a row (reset by a stable run)
+        self.recent_exits = deque()
+        self.last_exitcode = None
+        self.restart_at = None # When the next launch is due (None: running or given up)
+        self.quarantined_until = None
+
+    def is_running(self):
+        return self.process is not None and self.process.exitcode is None
+
+    def started(self, process, standby, now):
+        if self.started_at is not None:
+            self.restarts += 1
+        self.process = process
+        self.standby = standby
+        self.started_at = now
+        self.restart_at = None
+        self.quarantined_until = None
+
+    def exited(self, now):
+        """
+        Record the exit of the current process and schedule the next launch.
+        Returns the restart delay in seconds, or None if the slot was quarantined.
+        """
+        self.last_exitcode = self.process.exitcode if self.process is not None else None
+        uptime = now - self.started_at if self.started_at is not None else 0.0
+        self.process = None
+        if uptime >= self.policy.stable_after:
+            self.failures = 0
+        self.failures += 1
+        self.recent_exits.append(now)
+        while self.recent_exits and now - self.recent_exits[0] > self.policy.crash_window:
+            self.recent_exits.popleft()
+
+        if len(self.recent_exits) > self.policy.max_restarts:
+            self.quarantines += 1
+            self.quarantined_until = now + self.policy.quarantine_period if self.policy.quarantine_period > 0 else math.inf
+            self.restart_at = self.quarantined_until if self.policy.quarantine_period > 0 else None
+            self.recent_exits.clear()
+            self.failures = 0
+            return None
+        delay = self.policy.backoff(self.failures)
+        self.restart_at = now + delay
+        return delay
+
+    def stepped_down(self, now):
+        """The process handed the account to its standby: restart it after base_delay, outside the crash-loop history"""
+        self.last_exitcode = self.process.exitcode if self.process is not None else None
+        self.process = None
+        self.handovers += 1
+        self.restart_at = now + self.policy.base_delay
+        return self.policy.base_delay
+
+    def status(self, now):
+        if self.is_running():
+            state, pid = 'running', self.process.pid
+        elif self.started_at is None:
+            state, pid = 'starting', None
+        elif self.quarantined_until is not None:
+            state, pid = 'quarantined', None
+        elif self.restart_at is not None:
+            state, pid = 'restarting', None
+        else:
+            state, pid = 'stopped', None
+        return {
+            'account': self.account_name,
+            'state': state,
+            'role': 'standby' if self.standby else 'primary',
+            'pid': pid,
+            'restarts': self.restarts,
+            'quarantines': self.quarantines,
+            'handovers': self.handovers,
+            'last_exitcode': self.last_exitcode,
+            'uptime_seconds': round(now - self.started_at, 1) if state == 'running' else None,
+            'restart_in_seconds': (round(max(0.0, self.restart_at - now), 1)
+                                   if self.restart_at is not None and state != 'running' else None),
+        }
+
+
 # ------------------------------------------------------------------------
 # SOLUTION 1: MULTI-ACCOUNT MONITOR CLASS (Manages multiple EA instances)
 # ------------------------------------------------------------------------
 
 class MultiAccountMonitor:
-    def __init__(self, config_file='accounts_config.json'):
+    def __init__(self, config_file='accounts_config.json', central_logging=True, status_interval=300):
         self.config_file = config_file
         self.accounts = []
         self.processes = {} # Dictionary to store name -> process object
+        self.slots = {} # name -> SupervisedProcess (restart state of each account process and warm standby)
+        self.status_interval = status_interval # Seconds between supervisor status lines
+        self.status_file = os.path.join('heartbeats', 'supervisor_status.json')
+        self.log_queue = None
         self.monitored_accounts = set() # Track names of accounts being monitored
+        self.central_logging = central_logging # Account processes log through self.log_collector
+        self.log_collector = None
 
         # --- MOVED LOGGER INITIALIZATION HERE ---
         # Basic logger for the monitor itself (must be initialized before use)
@@ -1676,13 +3913,39 @@ class MultiAccountMonitor:
              sys.exit(1)
 
 
+    def start_log_collector(self):
+        """Start the central collector and route the monitor's own messages through it"""
+        self.log_archiver = LogArchiver(self.monitor_logger)
+        self.log_collector = CentralLogCollector('logs', archiver=self.log_archiver)
+        self.log_collector.start()
+        self.monitor_console_handlers = [h for h in self.monitor_logger.handlers if isinstance(h, logging.StreamHandler)]
+        for handler in self.monitor_console_handlers:
+            self.monitor_logger.removeHandler(handler)
+        self.monitor_logger.addHandler(CollectorQueueHandler(self.log_collector.queue, 'Monitor', account_file=False))
+
+    def stop_log_collector(self):
+        if self.log_collector is None:
+            return
+        for handler in self.monitor_logger.handlers[:]:
+            if isinstance(handler, CollectorQueueHandler):
+                self.monitor_logger.removeHandler(handler)
+        for handler in self.monitor_console_handlers:
+            self.monitor_logger.addHandler(handler)
+        self.log_collector.stop()
+        stats = self.log_collector.stats
+        self.monitor_logger.info(f"Central log collector stopped: {stats['records']} records in {stats['batches']} batches, "
+                                 f"{stats['dropped']} dropped by account processes")
+        self.log_collector = None
+
     @staticmethod
-    def _run_ea_process(account_config):
-        """Static method to be run in a separate process for one account."""
+    def _run_ea_process(account_config, log_queue=None, standby=False):
+        """Static method to be run in a separate process for one account (or its warm standby)."""
         try:
             # Create and run the EA instance for this specific account
-            ea = PipSecureEA(account_config)
-            ea.run() # This method now contains the connect/loop/disconnect logic
+            ea = PipSecureEA(account_config, log_queue=log_queue)
+            ea.run(standby=standby) # This method now contains the connect/loop/disconnect logic
+            if ea.role == 'stepped_down':
+                sys.exit(EXIT_STEPPED_DOWN) # Tell the supervisor this was a handoff, not a crash
         except Exception as e:
             # Log critical errors within the process if possible
             # Using print as logger setup might fail or be specific to the instance
@@ -1690,7 +3953,111 @@ class MultiAccountMonitor:
             print(f"CRITICAL ERROR in process for account {account_name_err}: {e}", file=sys.stderr)
             import traceback
             traceback.print_exc() # Print full traceback from the process
+            sys.exit(1) # Non-zero exit code for the supervisor
+
+
+    def _running_sibling(self, slot):
+        """The other live process of the same account (its warm standby, or the EA it stands by for)"""
+        for other in self.slots.values():
+            if other is not slot and other.account_name == slot.account_name and other.process is not None and other.process.is_alive():
+                return other
+        return None
+
+    def _launch(self, slot):
+        """
+        Start (or restart) the process of a slot. It starts as the warm standby whenever
+        the account's other process is alive: after a crash that process has taken over
+        (or is about to), so the restarted one must never act alongside it.
+        """
+        standby = self._running_sibling(slot) is not None
+        try:
+            p = Process(target=self._run_ea_process, args=(slot.account_config, self.log_queue, standby), name=slot.process_name)
+            p.start()
+        except Exception as e:
+            self.monitor_logger.error(f"Failed to start process for account '{slot.name}': {e}", exc_info=True)
+            slot.started_at = slot.started_at or time.monotonic()
+            delay = slot.exited(time.monotonic())
+            if delay is not None:
+                self.monitor_logger.info(f"Retrying '{slot.name}' in {delay:.1f}s")
+            return False
+
+        restart = slot.started_at is not None
+        slot.started(p, standby, time.monotonic())
+        self.processes[slot.name] = p
+        self.monitored_accounts.add(slot.name)
+        role = "warm standby" if standby else "process"
+        if restart:
+            self.monitor_logger.warning(f"🔄 Restarted '{slot.name}' as {role} PID {p.pid} (restart #{slot.restarts})")
+        elif standby:
+            self.monitor_logger.info(f"Started warm standby PID {p.pid} for account '{slot.account_name}'")
+        else:
+            self.monitor_logger.info(f"Started process PID {p.pid} for account '{slot.account_name}'")
+        return True
 
+    def _handle_exit(self, slot, now):
+        """A supervised process exited: log it and schedule its restart (or quarantine it)"""
+        process = slot.process
+        process.join(timeout=5) # Reap it; the sentinel fires as the process exits
+        uptime = now - slot.started_at
+        self.processes.pop(slot.name, None)
+        self.monitored_accounts.discard(slot.name)
+        if process.exitcode == EXIT_STEPPED_DOWN:
+            delay = slot.stepped_down(now)
+            sibling = self._running_sibling(slot)
+            if sibling is not None:
+                sibling.standby = False # It holds the lease now
+            self.monitor_logger.warning(f"Process for account '{slot.name}' (PID {process.pid}) stepped down after {uptime:.1f}s: "
+                                        f"its warm standby took over. Restarting it in {delay:.1f}s.")
+            return
+        self.monitor_logger.error(f"Process for account '{slot.name}' (PID {process.pid}) terminated unexpectedly "
+                                  f"with exit code {process.exitcode} after {uptime:.1f}s.")
+        sibling = self._running_sibling(slot)
+        if sibling is not None and not slot.standby:
+            sibling.standby = False # Nothing else can hold the lease: it is the primary from here on
+            self.monitor_logger.warning(f"Warm standby PID {sibling.process.pid} takes over '{slot.account_name}' once its heartbeat is stale.")
+
+        delay = slot.exited(now)
+        if delay is not None:
+            self.monitor_logger.info(f"Restarting '{slot.name}' in {delay:.1f}s "
+                                     f"({slot.failures} quick exit(s) in a row, {slot.restarts} restart(s) so far)")
+            return
+        policy = slot.policy
+        until = (f"for {policy.quarantine_period:.0f}s" if policy.quarantine_period > 0
+                 else "until the monitor is restarted")
+        self.monitor_logger.critical(f"🚫 Crash loop: '{slot.name}' exited more than {policy.max_restarts} times within "
+                                     f"{policy.crash_window:.0f}s - quarantined {until} ({slot.restarts} restart(s) so far)")
+
+    def supervisor_status(self):
+        """State, role, PID and restart counts of every supervised process, by slot name"""
+        now = time.monotonic()
+        return {name: slot.status(now) for name, slot in self.slots.items()}
+
+    def restart_counts(self):
+        return {name: slot.restarts for name, slot in self.slots.items()}
+
+    def write_supervisor_status(self):
+        """Publish supervisor_status() for --status (temp file + atomic replace)"""
+        try:
+            os.makedirs(os.path.dirname(self.status_file), exist_ok=True)
+            tmp = f"{self.status_file}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump({'updated_at': time.time(), 'monitor_pid': os.getpid(),
+                           'processes': self.supervisor_status()}, f, indent=2)
+            os.replace(tmp, self.status_file)
+        except (OSError, TypeError) as e:
+            self.monitor_logger.error(f"Error writing supervisor status {self.status_file}: {e}")
+
+    def log_supervisor_status(self):
+        parts = []
+        for name, status in self.supervisor_status().items():
+            if status['state'] == 'running':
+                detail = f"PID {status['pid']} {status['role']}"
+            elif status['restart_in_seconds'] is not None:
+                detail = f"{status['state']}, next start in {status['restart_in_seconds']:.0f}s"
+            else:
+                detail = status['state']
+            parts.append(f"{name}: {detail}, {status['restarts']} restart(s)")
+        self.monitor_logger.info(f"📋 Supervisor: {' | '.join(parts)}")
 
     def run(self):
         # Ensure logger exists before starting
@@ -1699,8 +4066,13 @@ class MultiAccountMonitor:
              sys.exit(1)
 
         self.monitor_logger.info("Starting Multi-Account Monitor")
+        if self.central_logging:
+            self.start_log_collector()
+        self.log_queue = self.log_collector.queue if self.log_collector else None
 
-        # Start a process for each account
+        # One supervised slot per account (plus its warm standby); the supervise loop
+        # starts them 1s apart, so an early exit is already caught while others start
+        first_start_at = time.monotonic()
         for account_config in self.accounts:
             account_name = account_config.get('name', f"Login_{account_config.get('login', 'Unknown')}")
             if not account_config.get('login'): # Check for essential login info
@@ -1711,48 +4083,47 @@ class MultiAccountMonitor:
                  account_name = f"Login_{account_config['login']}" # Ensure defined name
                  self.monitor_logger.warning(f"Account config missing 'name', using default: {account_name}")
 
-
-            try:
-                 p = Process(target=self._run_ea_process, args=(account_config,), name=f"EA_{account_name}")
-                 self.processes[account_name] = p
-                 p.start()
-                 self.monitor_logger.info(f"Started process PID {p.pid} for account '{account_name}'")
-                 self.monitored_accounts.add(account_name)
-                 time.sleep(1) # Slightly shorter stagger
-            except Exception as e:
-                 self.monitor_logger.error(f"Failed to start process for account '{account_name}': {e}", exc_info=True) # Add exc_info
-
-
-        # Monitor the processes
+            start_at = first_start_at + len({slot.account_name for slot in self.slots.values()}) # Slightly shorter stagger
+            slot = SupervisedProcess(account_name, account_config)
+            slot.restart_at = start_at
+            self.slots[slot.name] = slot
+            if account_config.get('warm_standby', False):
+                # Started right after the primary: connected but idle until its heartbeat goes stale
+                standby = SupervisedProcess(account_name, account_config, standby=True)
+                standby.restart_at = start_at
+                self.slots[standby.name] = standby
+
+        # Supervise the processes: wake on any process exit (its sentinel), a due (re)start
+        # or the periodic status line - a dead account is noticed immediately
         try:
+            last_status_log = time.monotonic()
             while True:
-                time.sleep(30) # Check process status every 30 seconds
-                processes_to_remove = [] # Collect names to remove after iteration
-
-                for name, process in self.processes.items(): # Iterate over items
-                    if not process.is_alive():
-                        exitcode = process.exitcode
-                        self.monitor_logger.error(f"Process for account '{name}' (PID {process.pid}) terminated unexpectedly with exit code {exitcode}.")
-                        processes_to_remove.append(name)
-                        if name in self.monitored_accounts:
-                             self.monitored_accounts.remove(name) # Keep monitored_accounts sync
-
-                        # Optional: Implement restart logic here if desired
-
-                # Remove dead processes from the dictionary
-                for name in processes_to_remove:
-                    if name in self.processes: # Check if not already removed
-                         del self.processes[name]
-
-                if not self.processes and processes_to_remove: # Only exit if processes *were* running and *all* were removed now
-                     self.monitor_logger.warning("All monitored processes have terminated.")
-                     break # Exit monitor if no processes left
-
-                if not self.processes and not processes_to_remove and self.monitored_accounts:
-                     # Handles case where processes failed to start initially
-                     self.monitor_logger.warning("No active processes running, but monitor was started. Exiting.")
-                     break
+                now = time.monotonic()
+                launched = False
+                for slot in list(self.slots.values()):
+                    if slot.process is None and slot.restart_at is not None and slot.restart_at <= now:
+                        if slot.quarantined_until is not None:
+                            self.monitor_logger.warning(f"Quarantine of '{slot.name}' is over - restarting it")
+                        launched = self._launch(slot) or launched
+
+                running = {slot.process.sentinel: slot for slot in self.slots.values() if slot.process is not None}
+                pending = [slot.restart_at for slot in self.slots.values() if slot.process is None and slot.restart_at is not None]
+                if launched:
+                    self.write_supervisor_status()
+                if not running and not pending:
+                    self.monitor_logger.warning("No account process running or scheduled to restart. Exiting.")
+                    break
 
+                wake_at = min(pending + [last_status_log + self.status_interval])
+                ready = multiprocessing.connection.wait(list(running), timeout=max(0.0, wake_at - time.monotonic()))
+                now = time.monotonic()
+                for sentinel in ready:
+                    self._handle_exit(running[sentinel], now)
+                if ready:
+                    self.write_supervisor_status()
+                if now - last_status_log >= self.status_interval:
+                    self.log_supervisor_status()
+                    last_status_log = now
 
         except KeyboardInterrupt:
             self.monitor_logger.info("KeyboardInterrupt received. Terminating all account processes...")
@@ -1784,6 +4155,8 @@ class MultiAccountMonitor:
                       if process.is_alive(): process.kill(); process.join(1)
                  except: pass # Ignore errors during emergency shutdown
              self.monitor_logger.info("Emergency termination attempt complete.")
+        finally:
+            self.stop_log_collector()
 
 
 # ------------------------------------------------------------------------
@@ -1873,65 +4246,6 @@ class MultiAccountMonitor:
             print(f"\nERROR: Could not create sample config file {config_file}: {e}")
 
 
-# ------------------------------------------------------------------------
-# UTILITY FUNCTION TO CHECK EA STATUS VIA HEARTBEATS
-# ------------------------------------------------------------------------
-
-    def check_ea_status(max_age_minutes=5):
-        """
-        Checks EA status based on heartbeat files found in the 'heartbeats' directory.
-        """
-        import glob
-
-        heartbeat_dir = 'heartbeats'
-        print(f"\n--- EA Heartbeat Status Check (Stale if > {max_age_minutes} minutes old) ---")
-        if not os.path.exists(heartbeat_dir) or not os.path.isdir(heartbeat_dir):
-            print(f"Heartbeat directory '{heartbeat_dir}' not found.")
-            print("-" * 50)
-            return
-
-        heartbeat_files = glob.glob(os.path.join(heartbeat_dir, '*_heartbeat.txt'))
-        if not heartbeat_files:
-            print("No heartbeat files found.")
-            print("-" * 50)
-            return
-
-        current_time = datetime.now()
-        print(f"Current time: {current_time.strftime('%Y-%m-%d %H:%M:%S')}")
-        print("-" * 50)
-
-        stale_count = 0
-        active_count = 0
-
-        for hb_file in sorted(heartbeat_files):
-            try:
-                account_name = os.path.basename(hb_file).replace('_heartbeat.txt', '')
-                monitor = HeartbeatMonitor(account_name, heartbeat_dir=heartbeat_dir) # Pass dir just in case
-
-                last_heartbeat = monitor.get_last_heartbeat()
-                if last_heartbeat is None:
-                    print(f"Account: {account_name:<20} | Status: UNKNOWN (No valid heartbeat data)")
-                    continue
-
-                age = current_time - last_heartbeat
-                age_minutes = age.total_seconds() / 60
-
-                if monitor.is_stale(max_age_minutes):
-                    status = "STALE"
-                    stale_count += 1
-                else:
-                    status = "ACTIVE"
-                    active_count += 1
-
-                print(f"Account: {account_name:<20} | Status: {status:<7} | Last Beat: {last_heartbeat.strftime('%Y-%m-%d %H:%M:%S')} ({age_minutes:.1f} min ago)")
-
-            except Exception as e:
-                print(f"Error processing heartbeat file {hb_file}: {e}")
-
-        print("-" * 50)
-        print(f"Summary: {active_count} ACTIVE, {stale_count} STALE (or Unknown)")
-        print("-" * 50)
-
 # Add this function OUTSIDE of all classes, before the "if __name__ == '__main__':" section
 
 def run_single_account(account_name):
@@ -2008,20 +4322,28 @@ def create_sample_config():
 
 def check_ea_status(max_age_minutes=5):
     """
-    Checks EA status based on heartbeat files found in the 'heartbeats' directory.
+    Checks EA status from the heartbeat slots in the 'heartbeats' directory.
+    Takes one lock-free snapshot of every account's slot.
     """
-    import glob
-
     heartbeat_dir = 'heartbeats'
     print(f"\n--- EA Heartbeat Status Check (Stale if > {max_age_minutes} minutes old) ---")
-    if not os.path.exists(heartbeat_dir) or not os.path.isdir(heartbeat_dir):
-        print(f"Heartbeat directory '{heartbeat_dir}' not found.")
+    slot_file = os.path.join(heartbeat_dir, HeartbeatSlots.FILE_NAME)
+    if not os.path.exists(slot_file):
+        print(f"Heartbeat slot file '{slot_file}' not found.")
+        print("-" * 50)
+        return
+
+    try:
+        slots = HeartbeatSlots(heartbeat_dir, readonly=True)
+        snapshot = slots.snapshot()
+        slots.close()
+    except Exception as e:
+        print(f"Error reading heartbeat slots {slot_file}: {e}")
         print("-" * 50)
         return
 
-    heartbeat_files = glob.glob(os.path.join(heartbeat_dir, '*_heartbeat.txt'))
-    if not heartbeat_files:
-        print("No heartbeat files found.")
+    if not snapshot:
+        print("No heartbeats recorded.")
         print("-" * 50)
         return
 
@@ -2032,34 +4354,40 @@ def check_ea_status(max_age_minutes=5):
     stale_count = 0
     active_count = 0
 
-    for hb_file in sorted(heartbeat_files):
-        try:
-            account_name = os.path.basename(hb_file).replace('_heartbeat.txt', '')
-            monitor = HeartbeatMonitor(account_name, heartbeat_dir=heartbeat_dir) # Pass dir just in case
-
-            last_heartbeat = monitor.get_last_heartbeat()
-            if last_heartbeat is None:
-                print(f"Account: {account_name:<20} | Status: UNKNOWN (No valid heartbeat data)")
-                continue
-
-            age = current_time - last_heartbeat
-            age_minutes = age.total_seconds() / 60
-
-            if monitor.is_stale(max_age_minutes):
-                status = "STALE"
-                stale_count += 1
-            else:
-                status = "ACTIVE"
-                active_count += 1
-
-            print(f"Account: {account_name:<20} | Status: {status:<7} | Last Beat: {last_heartbeat.strftime('%Y-%m-%d %H:%M:%S')} ({age_minutes:.1f} min ago)")
+    for account_name, slot in sorted(snapshot.items()):
+        age_minutes = slot.age_seconds / 60
+        if age_minutes > max_age_minutes:
+            status = "STALE"
+            stale_count += 1
+        else:
+            status = "ACTIVE"
+            active_count += 1
 
-        except Exception as e:
-            print(f"Error processing heartbeat file {hb_file}: {e}")
+        last_beat = datetime.fromtimestamp(slot.wall_ts).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"Account: {account_name:<20} | Status: {status:<7} | Last Beat: {last_beat} ({age_minutes:.1f} min ago) | "
+              f"PID: {slot.pid} | Cycles: {slot.cycles} | Last cycle: {slot.last_cycle_duration * 1000:.0f} ms | Errors: {slot.errors}")
 
     print("-" * 50)
     print(f"Summary: {active_count} ACTIVE, {stale_count} STALE (or Unknown)")
     print("-" * 50)
+
+    # Restart counts published by a running MultiAccountMonitor
+    status_file = os.path.join(heartbeat_dir, 'supervisor_status.json')
+    if os.path.exists(status_file):
+        try:
+            with open(status_file, 'r') as f:
+                supervisor = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Error reading supervisor status {status_file}: {e}")
+            return
+        updated = datetime.fromtimestamp(supervisor['updated_at']).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"Supervisor (monitor PID {supervisor['monitor_pid']}, updated {updated}):")
+        for name, status in sorted(supervisor['processes'].items()):
+            print(f"Process: {name:<30} | State: {status['state']:<11} | Role: {status['role']:<7} | "
+                  f"PID: {status['pid']} | Restarts: {status['restarts']} | Quarantines: {status['quarantines']} | "
+                  f"Handovers: {status.get('handovers', 0)} | "
+                  f"Last exit code: {status['last_exitcode']}")
+        print("-" * 50)
 # ------------------------------------------------------------------------
 # MAIN ENTRY POINT
 # ------------------------------------------------------------------------
@@ -0,0 +1,669 @@
+"""
+Simulated MT5 Terminal - In-process stand-in for the MetaTrader5 module
+Keeps positions, pending orders, ticks, retcodes and filling-mode rules in memory so
+PipSecureEA can be exercised and benchmarked on machines without a Windows terminal.
+
+Use it either as a backend:
+    sim = SimulatedMT5Backend()
+    ea = PipSecureEA(account_config, backend=sim)
+or as a drop-in module (import simulated_mt5 as mt5), which binds the MT5 API
+functions to a default terminal instance. multi_account_ea.py imports it in place of
+MetaTrader5 only when PIP_SECURE_BACKEND=simulated is set.
+"""
+
+import time
+import fnmatch
+from collections import namedtuple, Counter, deque
+
+from broker_backend import BrokerBackend
+
+# ------------------------------------------------------------------------
+# MT5 CONSTANTS (same values as the MetaTrader5 package)
+# ------------------------------------------------------------------------
+
+ORDER_TYPE_BUY = 0
+ORDER_TYPE_SELL = 1
+ORDER_TYPE_BUY_LIMIT = 2
+ORDER_TYPE_SELL_LIMIT = 3
+ORDER_TYPE_BUY_STOP = 4
+ORDER_TYPE_SELL_STOP = 5
+ORDER_TYPE_BUY_STOP_LIMIT = 6
+ORDER_TYPE_SELL_STOP_LIMIT = 7
+
+POSITION_TYPE_BUY = 0
+POSITION_TYPE_SELL = 1
+
+ORDER_STATE_STARTED = 0
+ORDER_STATE_PLACED = 1
+ORDER_STATE_CANCELED = 2
+ORDER_STATE_PARTIAL = 3
+ORDER_STATE_FILLED = 4
+ORDER_STATE_REJECTED = 5
+ORDER_STATE_EXPIRED = 6
+
+ORDER_FILLING_FOK = 0
+ORDER_FILLING_IOC = 1
+ORDER_FILLING_RETURN = 2
+
+ORDER_TIME_GTC = 0
+
+# symbol_info.filling_mode is a bitmask of these flags (RETURN is implied when 0)
+SYMBOL_FILLING_FOK = 1
+SYMBOL_FILLING_IOC = 2
+
+SYMBOL_TRADE_MODE_DISABLED = 0
+SYMBOL_TRADE_MODE_LONGONLY = 1
+SYMBOL_TRADE_MODE_SHORTONLY = 2
+SYMBOL_TRADE_MODE_CLOSEONLY = 3
+SYMBOL_TRADE_MODE_FULL = 4
+
+TRADE_ACTION_DEAL = 1
+TRADE_ACTION_PENDING = 5
+TRADE_ACTION_SLTP = 6
+TRADE_ACTION_MODIFY = 7
+TRADE_ACTION_REMOVE = 8
+
+TRADE_RETCODE_REQUOTE = 10004
+TRADE_RETCODE_REJECT = 10006
+TRADE_RETCODE_PLACED = 10008
+TRADE_RETCODE_DONE = 10009
+TRADE_RETCODE_ERROR = 10011
+TRADE_RETCODE_TIMEOUT = 10012
+TRADE_RETCODE_INVALID = 10013
+TRADE_RETCODE_INVALID_VOLUME = 10014
+TRADE_RETCODE_INVALID_PRICE = 10015
+TRADE_RETCODE_INVALID_STOPS = 10016
+TRADE_RETCODE_TRADE_DISABLED = 10017
+TRADE_RETCODE_MARKET_CLOSED = 10018
+TRADE_RETCODE_PRICE_CHANGED = 10020
+TRADE_RETCODE_PRICE_OFF = 10021
+TRADE_RETCODE_TOO_MANY_REQUESTS = 10024
+TRADE_RETCODE_NO_CHANGES = 10025
+TRADE_RETCODE_LOCKED = 10028
+TRADE_RETCODE_FROZEN = 10029
+TRADE_RETCODE_INVALID_FILL = 10030
+TRADE_RETCODE_CONNECTION = 10031
+TRADE_RETCODE_INVALID_ORDER = 10035
+TRADE_RETCODE_POSITION_CLOSED = 10036
+
+RES_S_OK = 1
+RES_E_FAIL = -1
+RES_E_INVALID_PARAMS = -2
+RES_E_NOT_FOUND = -4
+RES_E_INTERNAL_FAIL_CONNECT = -10004
+
+RETCODE_COMMENTS = {
+    TRADE_RETCODE_REQUOTE: "Requote",
+    TRADE_RETCODE_REJECT: "Request rejected",
+    TRADE_RETCODE_PLACED: "Order placed",
+    TRADE_RETCODE_DONE: "Request executed",
+    TRADE_RETCODE_ERROR: "Request processing error",
+    TRADE_RETCODE_TIMEOUT: "Request canceled by timeout",
+    TRADE_RETCODE_INVALID: "Invalid request",
+    TRADE_RETCODE_INVALID_VOLUME: "Invalid volume",
+    TRADE_RETCODE_INVALID_PRICE: "Invalid price",
+    TRADE_RETCODE_INVALID_STOPS: "Invalid stops",
+    TRADE_RETCODE_TRADE_DISABLED: "Trade disabled",
+    TRADE_RETCODE_MARKET_CLOSED: "Market closed",
+    TRADE_RETCODE_PRICE_CHANGED: "Prices changed",
+    TRADE_RETCODE_PRICE_OFF: "No quotes",
+    TRADE_RETCODE_TOO_MANY_REQUESTS: "Too many requests",
+    TRADE_RETCODE_NO_CHANGES: "No changes",
+    TRADE_RETCODE_LOCKED: "Request locked",
+    TRADE_RETCODE_FROZEN: "Order or position frozen",
+    TRADE_RETCODE_INVALID_FILL: "Unsupported filling mode",
+    TRADE_RETCODE_CONNECTION: "No connection",
+    TRADE_RETCODE_INVALID_ORDER: "Invalid order",
+    TRADE_RETCODE_POSITION_CLOSED: "Position already closed",
+}
+
+# ------------------------------------------------------------------------
+# MT5 STRUCTURES (immutable, like the tuples returned by the real terminal)
+# ------------------------------------------------------------------------
+
+TradePosition = namedtuple('TradePosition', [
+    'ticket', 'time', 'time_msc', 'time_update', 'time_update_msc', 'type', 'magic',
+    'identifier', 'volume', 'price_open', 'sl', 'tp', 'price_current', 'swap',
+    'profit', 'symbol', 'comment'
+])
+
+TradeOrder = namedtuple('TradeOrder', [
+    'ticket', 'time_setup', 'time_setup_msc', 'type', 'type_time', 'type_filling',
+    'state', 'magic', 'volume_initial', 'volume_current', 'price_open', 'sl', 'tp',
+    'price_current', 'symbol', 'comment'
+])
+
+Tick = namedtuple('Tick', ['time', 'bid', 'ask', 'last', 'volume', 'time_msc', 'flags'])
+
+SymbolInfo = namedtuple('SymbolInfo', [
+    'name', 'digits', 'point', 'spread', 'trade_stops_level', 'trade_freeze_level',
+    'filling_mode', 'trade_mode', 'trade_contract_size', 'volume_min', 'volume_max',
+    'volume_step', 'bid', 'ask', 'visible', 'select'
+])
+
+OrderSendResult = namedtuple('OrderSendResult', [
+    'retcode', 'deal', 'order', 'volume', 'price', 'bid', 'ask', 'comment',
+    'request_id', 'retcode_external', 'request'
+])
+
+AccountInfo = namedtuple('AccountInfo', [
+    'login', 'server', 'name', 'company', 'currency', 'leverage', 'balance', 'equity'
+])
+
+TerminalInfo = namedtuple('TerminalInfo', [
+    'connected', 'trade_allowed', 'name', 'company', 'path', 'build', 'ping_last'
+])
+
+BUY_SIDE_TYPES = (ORDER_TYPE_BUY, ORDER_TYPE_BUY_LIMIT, ORDER_TYPE_BUY_STOP, ORDER_TYPE_BUY_STOP_LIMIT)
+PENDING_TYPES = (ORDER_TYPE_BUY_LIMIT, ORDER_TYPE_SELL_LIMIT, ORDER_TYPE_BUY_STOP,
+                 ORDER_TYPE_SELL_STOP, ORDER_TYPE_BUY_STOP_LIMIT, ORDER_TYPE_SELL_STOP_LIMIT)
+
+
+class SimulatedSymbol:
+    """Mutable trading rules for one simulated symbol"""
+
+    def __init__(self, name, digits=5, stops_level=0, freeze_level=0,
+                 fillings=(ORDER_FILLING_FOK, ORDER_FILLING_IOC, ORDER_FILLING_RETURN),
+                 trade_mode=SYMBOL_TRADE_MODE_FULL, contract_size=100000.0):
+        self.name = name
+        self.digits = digits
+        self.point = 10 ** (-digits)
+        self.stops_level = stops_level      # in points
+        self.freeze_level = freeze_level    # in points
+        self.fillings = set(fillings)       # accepted ORDER_FILLING_* values
+        self.trade_mode = trade_mode
+        self.contract_size = contract_size
+
+    @property
+    def filling_mode(self):
+        """Bitmask as reported by symbol_info().filling_mode"""
+        mask = 0
+        if ORDER_FILLING_FOK in self.fillings:
+            mask |= SYMBOL_FILLING_FOK
+        if ORDER_FILLING_IOC in self.fillings:
+            mask |= SYMBOL_FILLING_IOC
+        return mask
+
+
+# ------------------------------------------------------------------------
+# SIMULATED TERMINAL
+# ------------------------------------------------------------------------
+
+class SimulatedMT5Backend(BrokerBackend):
+    """
+    In-memory MT5 terminal for one account.
+
+    Every API call is counted in call_counts (terminal round-trips) and can be given an
+    artificial latency to approximate IPC cost. Results for upcoming order_send calls can
+    be forced with inject_retcode() to exercise retry and fallback paths.
+    """
+
+    SIMULATED = True
+
+    def __init__(self, login=1000000, server='Simulated-Server', clock=None, latency=0.0):
+        self.login = login
+        self.server = server
+        self.clock = clock or time.time
+        self.latency = latency  # seconds added to every API call
+        self.connected = False
+        self.trade_allowed = True
+        self.balance = 10000.0
+
+        self.symbols = {}       # name -> SimulatedSymbol
+        self.ticks = {}         # name -> Tick
+        self.positions = {}     # ticket -> TradePosition
+        self.orders = {}        # ticket -> TradeOrder (pending only)
+        self.history = []       # closed positions as (TradePosition, close_price, close_time)
+
+        self.call_counts = Counter()
+        self.sent_requests = []  # (request, result) for every order_send
+        self._injected_results = deque()
+        self._next_ticket = 100000
+        self._last_error = (RES_S_OK, 'Success')
+
+    # --- Internal helpers ---
+
+    def _call(self, name):
+        self.call_counts[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _new_ticket(self):
+        self._next_ticket += 1
+        return self._next_ticket
+
+    def _set_error(self, code, desc):
+        self._last_error = (code, desc)
+
+    def _result(self, retcode, request, order=0, deal=0, volume=0.0, price=0.0, comment=None):
+        tick = self.ticks.get(request.get('symbol')) if isinstance(request, dict) else None
+        return OrderSendResult(
+            retcode=retcode,
+            deal=deal,
+            order=order,
+            volume=volume,
+            price=price,
+            bid=tick.bid if tick else 0.0,
+            ask=tick.ask if tick else 0.0,
+            comment=comment if comment is not None else RETCODE_COMMENTS.get(retcode, "Unknown"),
+            request_id=len(self.sent_requests) + 1,
+            retcode_external=0,
+            request=dict(request) if isinstance(request, dict) else request,
+        )
+
+    @staticmethod
+    def _matches(symbol, group):
+        """Support the MT5 'group' filter (comma separated wildcards, '!' negates)"""
+        included = False
+        for pattern in group.split(','):
+            pattern = pattern.strip()
+            if pattern.startswith('!'):
+                if fnmatch.fnmatchcase(symbol, pattern[1:]):
+                    return False
+            elif fnmatch.fnmatchcase(symbol, pattern):
+                included = True
+        return included
+
+    def _filter(self, items, symbol=None, group=None, ticket=None):
+        if ticket is not None:
+            item = items.get(ticket)
+            return (item,) if item else ()
+        result = items.values()
+        if symbol is not None:
+            result = [i for i in result if i.symbol == symbol]
+        elif group is not None:
+            result = [i for i in result if self._matches(i.symbol, group)]
+        return tuple(result)
+
+    def _market_price(self, symbol, is_buy):
+        tick = self.ticks.get(symbol)
+        if not tick:
+            return None
+        return tick.ask if is_buy else tick.bid
+
+    def _stops_valid(self, sym, is_buy, sl, tp):
+        """Check SL/TP against the symbol's stops level using the price a close would fill at"""
+        tick = self.ticks.get(sym.name)
+        if not tick:
+            return False
+        min_distance = sym.stops_level * sym.point
+        close_price = tick.bid if is_buy else tick.ask
+        if is_buy:
+            if sl and sl > close_price - min_distance:
+                return False
+            if tp and tp < close_price + min_distance:
+                return False
+        else:
+            if sl and sl < close_price + min_distance:
+                return False
+            if tp and tp > close_price - min_distance:
+                return False
+        return True
+
+    def _is_frozen(self, sym, is_buy, sl, tp):
+        """True if an existing SL/TP sits inside the freeze level and may not be changed"""
+        if not sym.freeze_level:
+            return False
+        tick = self.ticks.get(sym.name)
+        if not tick:
+            return False
+        close_price = tick.bid if is_buy else tick.ask
+        freeze_distance = sym.freeze_level * sym.point
+        return any(level and abs(close_price - level) < freeze_distance for level in (sl, tp))
+
+    def _profit(self, position, price):
+        sym = self.symbols.get(position.symbol)
+        contract_size = sym.contract_size if sym else 1.0
+        direction = 1 if position.type == ORDER_TYPE_BUY else -1
+        return round((price - position.price_open) * direction * position.volume * contract_size, 2)
+
+    # --- Simulation setup (not part of the MT5 API) ---
+
+    def add_symbol(self, name, bid, ask=None, digits=5, **rules):
+        """Register a symbol with its trading rules and an initial quote"""
+        sym = SimulatedSymbol(name, digits=digits, **rules)
+        self.symbols[name] = sym
+        self.set_tick(name, bid, ask if ask is not None else bid, process=False)
+        return sym
+
+    def set_tick(self, symbol, bid, ask=None, process=True):
+        """
+        Publish a new quote. Updates price_current/profit of open positions and, when
+        process is True, fills triggered pending orders and closes positions at SL/TP.
+        """
+        ask = ask if ask is not None else bid
+        now = self.clock()
+        self.ticks[symbol] = Tick(time=int(now), bid=bid, ask=ask, last=0.0, volume=0,
+                                  time_msc=int(now * 1000), flags=6)
+
+        for ticket, pos in list(self.positions.items()):
+            if pos.symbol != symbol:
+                continue
+            price = bid if pos.type == ORDER_TYPE_BUY else ask
+            self.positions[ticket] = pos._replace(price_current=price, profit=self._profit(pos, price))
+
+        if process:
+            self._trigger_pending_orders(symbol)
+            self._trigger_stops(symbol)
+
+    def _trigger_pending_orders(self, symbol):
+        tick = self.ticks[symbol]
+        for ticket, order in list(self.orders.items()):
+            if order.symbol != symbol:
+                continue
+            triggered = (
+                (order.type == ORDER_TYPE_BUY_LIMIT and tick.ask <= order.price_open) or
+                (order.type == ORDER_TYPE_SELL_LIMIT and tick.bid >= order.price_open) or
+                (order.type in (ORDER_TYPE_BUY_STOP, ORDER_TYPE_BUY_STOP_LIMIT) and tick.ask >= order.price_open) or
+                (order.type in (ORDER_TYPE_SELL_STOP, ORDER_TYPE_SELL_STOP_LIMIT) and tick.bid <= order.price_open)
+            )
+            if triggered:
+                del self.orders[ticket]
+                position_type = ORDER_TYPE_BUY if order.type in BUY_SIDE_TYPES else ORDER_TYPE_SELL
+                self.open_position(symbol, position_type, order.volume_current, price=order.price_open,
+                                   sl=order.sl, tp=order.tp, comment=order.comment, magic=order.magic,
+                                   ticket=ticket)
+
+    def _trigger_stops(self, symbol):
+        tick = self.ticks[symbol]
+        for ticket, pos in list(self.positions.items()):
+            if pos.symbol != symbol:
+                continue
+            if pos.type == ORDER_TYPE_BUY:
+                hit = (pos.sl and tick.bid <= pos.sl) or (pos.tp and tick.bid >= pos.tp)
+                price = tick.bid
+            else:
+                hit = (pos.sl and tick.ask >= pos.sl) or (pos.tp and tick.ask <= pos.tp)
+                price = tick.ask
+            if hit:
+                self._close(ticket, pos.volume, price)
+
+    def open_position(self, symbol, position_type, volume=0.01, price=None, sl=0.0, tp=0.0,
+                      comment='', magic=0, open_time=None, ticket=None):
+        """Create an open position directly (no order_send round-trip). Returns the ticket."""
+        if price is None:
+            price = self._market_price(symbol, position_type == ORDER_TYPE_BUY)
+        ticket = ticket or self._new_ticket()
+        open_time = self.clock() if open_time is None else open_time
+        tick = self.ticks.get(symbol)
+        current = price
+        if tick:
+            current = tick.bid if position_type == ORDER_TYPE_BUY else tick.ask
+        pos = TradePosition(
+            ticket=ticket, time=int(open_time), time_msc=int(open_time * 1000),
+            time_update=int(open_time), time_update_msc=int(open_time * 1000),
+            type=position_type, magic=magic, identifier=ticket, volume=volume,
+            price_open=price, sl=sl, tp=tp, price_current=current, swap=0.0, profit=0.0,
+            symbol=symbol, comment=comment
+        )
+        self.positions[ticket] = pos._replace(profit=self._profit(pos, current))
+        return ticket
+
+    def place_pending_order(self, symbol, order_type, price, volume=0.01, sl=0.0, tp=0.0,
+                            comment='', magic=0, setup_time=None, ticket=None):
+        """Create a pending order directly (no order_send round-trip). Returns the ticket."""
+        ticket = ticket or self._new_ticket()
+        setup_time = self.clock() if setup_time is None else setup_time
+        tick = self.ticks.get(symbol)
+        self.orders[ticket] = TradeOrder(
+            ticket=ticket, time_setup=int(setup_time), time_setup_msc=int(setup_time * 1000),
+            type=order_type, type_time=ORDER_TIME_GTC, type_filling=ORDER_FILLING_RETURN,
+            state=ORDER_STATE_PLACED, magic=magic, volume_initial=volume, volume_current=volume,
+            price_open=price, sl=sl, tp=tp,
+            price_current=(tick.ask if order_type in BUY_SIDE_TYPES else tick.bid) if tick else price,
+            symbol=symbol, comment=comment
+        )
+        return ticket
+
+    def inject_retcode(self, retcode, comment=None, count=1):
+        """Force the next `count` order_send calls to fail with retcode (None = return None)"""
+        for _ in range(count):
+            self._injected_results.append((retcode, comment))
+
+    def set_connected(self, connected):
+        """Simulate the terminal losing or regaining its broker connection"""
+        self.connected = connected
+
+    def reset_call_counts(self):
+        self.call_counts.clear()
+
+    # --- MT5 API ---
+
+    def initialize(self, **kwargs):
+        self._call('initialize')
+        if kwargs.get('login') is not None:
+            self.login = kwargs['login']
+        if kwargs.get('server'):
+            self.server = kwargs['server']
+        self.connected = True
+        self._set_error(RES_S_OK, 'Success')
+        return True
+
+    def shutdown(self):
+        self._call('shutdown')
+        self.connected = False
+        return True
+
+    def last_error(self):
+        return self._last_error
+
+    def account_info(self):
+        self._call('account_info')
+        if not self.connected:
+            self._set_error(RES_E_INTERNAL_FAIL_CONNECT, 'No IPC connection')
+            return None
+        equity = self.balance + sum(p.profit for p in self.positions.values())
+        return AccountInfo(login=self.login, server=self.server, name='Simulated', company='Simulated',
+                           currency='USD', leverage=100, balance=self.balance, equity=equity)
+
+    def terminal_info(self):
+        self._call('terminal_info')
+        return TerminalInfo(connected=self.connected, trade_allowed=self.trade_allowed,
+                            name='Simulated MT5', company='Simulated', path='', build=0, ping_last=0)
+
+    def positions_get(self, symbol=None, group=None, ticket=None):
+        self._call('positions_get')
+        if not self.connected:
+            self._set_error(RES_E_INTERNAL_FAIL_CONNECT, 'No IPC connection')
+            return None
+        return self._filter(self.positions, symbol=symbol, group=group, ticket=ticket)
+
+    def orders_get(self, symbol=None, group=None, ticket=None):
+        self._call('orders_get')
+        if not self.connected:
+            self._set_error(RES_E_INTERNAL_FAIL_CONNECT, 'No IPC connection')
+            return None
+        return self._filter(self.orders, symbol=symbol, group=group, ticket=ticket)
+
+    def symbol_info(self, symbol):
+        self._call('symbol_info')
+        sym = self.symbols.get(symbol)
+        if sym is None:
+            self._set_error(RES_E_NOT_FOUND, 'Symbol not found')
+            return None
+        tick = self.ticks.get(symbol)
+        bid = tick.bid if tick else 0.0
+        ask = tick.ask if tick else 0.0
+        return SymbolInfo(
+            name=sym.name, digits=sym.digits, point=sym.point,
+            spread=int(round((ask - bid) / sym.point)), trade_stops_level=sym.stops_level,
+            trade_freeze_level=sym.freeze_level, filling_mode=sym.filling_mode,
+            trade_mode=sym.trade_mode, trade_contract_size=sym.contract_size,
+            volume_min=0.01, volume_max=100.0, volume_step=0.01, bid=bid, ask=ask,
+            visible=True, select=True
+        )
+
+    def symbol_info_tick(self, symbol):
+        self._call('symbol_info_tick')
+        tick = self.ticks.get(symbol)
+        if tick is None:
+            self._set_error(RES_E_NOT_FOUND, 'Symbol not found')
+        return tick
+
+    def order_send(self, request):
+        self._call('order_send')
+        result = self._execute(request)
+        self.sent_requests.append((dict(request) if isinstance(request, dict) else request, result))
+        return result
+
+    # --- Request execution ---
+
+    def _execute(self, request):
+        if not isinstance(request, dict) or 'action' not in request:
+            self._set_error(RES_E_INVALID_PARAMS, 'Invalid arguments')
+            return None
+        if not self.connected:
+            self._set_error(RES_E_INTERNAL_FAIL_CONNECT, 'No IPC connection')
+            return None
+        if self._injected_results:
+            retcode, comment = self._injected_results.popleft()
+            if retcode is None:
+                self._set_error(RES_E_FAIL, 'Generic fail')
+                return None
+            return self._result(retcode, request, comment=comment)
+
+        action = request['action']
+        if action == TRADE_ACTION_SLTP:
+            return self._execute_sltp(request)
+        if action == TRADE_ACTION_DEAL:
+            return self._execute_deal(request)
+        if action == TRADE_ACTION_REMOVE:
+            return self._execute_remove(request)
+        if action == TRADE_ACTION_PENDING:
+            return self._execute_pending(request)
+        if action == TRADE_ACTION_MODIFY:
+            return self._execute_modify(request)
+        return self._result(TRADE_RETCODE_INVALID, request)
+
+    def _execute_sltp(self, request):
+        pos = self.positions.get(request.get('position'))
+        if pos is None:
+            return self._result(TRADE_RETCODE_POSITION_CLOSED, request)
+        sym = self.symbols.get(pos.symbol)
+        if sym is None or sym.trade_mode == SYMBOL_TRADE_MODE_DISABLED:
+            return self._result(TRADE_RETCODE_TRADE_DISABLED, request)
+        sl = request.get('sl', 0.0) or 0.0
+        tp = request.get('tp', 0.0) or 0.0
+        if sl == pos.sl and tp == pos.tp:
+            return self._result(TRADE_RETCODE_NO_CHANGES, request)
+        is_buy = pos.type == ORDER_TYPE_BUY
+        if self._is_frozen(sym, is_buy, pos.sl, pos.tp):
+            return self._result(TRADE_RETCODE_FROZEN, request)
+        if not self._stops_valid(sym, is_buy, sl, tp):
+            return self._result(TRADE_RETCODE_INVALID_STOPS, request)
+        now = self.clock()
+        self.positions[pos.ticket] = pos._replace(sl=sl, tp=tp, time_update=int(now),
+                                                  time_update_msc=int(now * 1000))
+        return self._result(TRADE_RETCODE_DONE, request, order=pos.ticket)
+
+    def _execute_deal(self, request):
+        symbol = request.get('symbol')
+        sym = self.symbols.get(symbol)
+        if sym is None:
+            return self._result(TRADE_RETCODE_INVALID, request)
+        if sym.trade_mode == SYMBOL_TRADE_MODE_DISABLED:
+            return self._result(TRADE_RETCODE_TRADE_DISABLED, request)
+        filling = request.get('type_filling', ORDER_FILLING_FOK)
+        if filling not in sym.fillings:
+            return self._result(TRADE_RETCODE_INVALID_FILL, request)
+
+        is_buy = request.get('type') == ORDER_TYPE_BUY
+        market_price = self._market_price(symbol, is_buy)
+        if market_price is None:
+            return self._result(TRADE_RETCODE_PRICE_OFF, request)
+        requested_price = request.get('price')
+        deviation = request.get('deviation', 0)
+        if requested_price and abs(requested_price - market_price) > deviation * sym.point + 1e-12:
+            return self._result(TRADE_RETCODE_REQUOTE, request)
+
+        volume = request.get('volume', 0.0)
+        ticket = request.get('position')
+        if ticket:
+            # Closing (or partially closing) an existing position
+            pos = self.positions.get(ticket)
+            if pos is None:
+                return self._result(TRADE_RETCODE_POSITION_CLOSED, request)
+            if pos.type == request.get('type') or volume <= 0 or volume > pos.volume + 1e-9:
+                return self._result(TRADE_RETCODE_INVALID_VOLUME, request)
+            deal = self._new_ticket()
+            self._close(ticket, volume, market_price)
+            return self._result(TRADE_RETCODE_DONE, request, order=deal, deal=deal,
+                                volume=volume, price=market_price)
+
+        # Opening a new position
+        if volume <= 0:
+            return self._result(TRADE_RETCODE_INVALID_VOLUME, request)
+        if sym.trade_mode == SYMBOL_TRADE_MODE_CLOSEONLY or \
+                (sym.trade_mode == SYMBOL_TRADE_MODE_LONGONLY and not is_buy) or \
+                (sym.trade_mode == SYMBOL_TRADE_MODE_SHORTONLY and is_buy):
+            return self._result(TRADE_RETCODE_TRADE_DISABLED, request)
+        sl = request.get('sl', 0.0) or 0.0
+        tp = request.get('tp', 0.0) or 0.0
+        if not self._stops_valid(sym, is_buy, sl, tp):
+            return self._result(TRADE_RETCODE_INVALID_STOPS, request)
+        new_ticket = self.open_position(symbol, request.get('type'), volume, price=market_price, sl=sl, tp=tp,
+                                        comment=request.get('comment', ''), magic=request.get('magic', 0))
+        return self._result(TRADE_RETCODE_DONE, request, order=new_ticket, deal=new_ticket,
+                            volume=volume, price=market_price)
+
+    def _close(self, ticket, volume, price):
+        pos = self.positions[ticket]
+        closed = pos._replace(volume=volume, price_current=price)
+        closed = closed._replace(profit=self._profit(closed, price))
+        self.history.append((closed, price, self.clock()))
+        self.balance += closed.profit
+        remaining = round(pos.volume - volume, 8)
+        if remaining > 1e-9:
+            self.positions[ticket] = pos._replace(volume=remaining)
+        else:
+            del self.positions[ticket]
+
+    def _execute_remove(self, request):
+        ticket = request.get('order')
+        if ticket not in self.orders:
+            return self._result(TRADE_RETCODE_INVALID_ORDER, request)
+        del self.orders[ticket]
+        return self._result(TRADE_RETCODE_DONE, request, order=ticket)
+
+    def _execute_pending(self, request):
+        symbol = request.get('symbol')
+        sym = self.symbols.get(symbol)
+        order_type = request.get('type')
+        if sym is None or order_type not in PENDING_TYPES:
+            return self._result(TRADE_RETCODE_INVALID, request)
+        if sym.trade_mode in (SYMBOL_TRADE_MODE_DISABLED, SYMBOL_TRADE_MODE_CLOSEONLY):
+            return self._result(TRADE_RETCODE_TRADE_DISABLED, request)
+        if not request.get('price'):
+            return self._result(TRADE_RETCODE_INVALID_PRICE, request)
+        ticket = self.place_pending_order(symbol, order_type, request['price'], volume=request.get('volume', 0.01),
+                                          sl=request.get('sl', 0.0), tp=request.get('tp', 0.0),
+                                          comment=request.get('comment', ''), magic=request.get('magic', 0))
+        return self._result(TRADE_RETCODE_DONE, request, order=ticket, volume=request.get('volume', 0.01),
+                            price=request['price'])
+
+    def _execute_modify(self, request):
+        ticket = request.get('order')
+        order = self.orders.get(ticket)
+        if order is None:
+            return self._result(TRADE_RETCODE_INVALID_ORDER, request)
+        self.orders[ticket] = order._replace(price_open=request.get('price', order.price_open),
+                                             sl=request.get('sl', order.sl), tp=request.get('tp', order.tp))
+        return self._result(TRADE_RETCODE_DONE, request, order=ticket)
+
+
+# ------------------------------------------------------------------------
+# DROP-IN MODULE API (import simulated_mt5 as mt5)
+# ------------------------------------------------------------------------
+
+default_terminal = SimulatedMT5Backend()
+
+initialize = default_terminal.initialize
+shutdown = default_terminal.shutdown
+last_error = default_terminal.last_error
+account_info = default_terminal.account_info
+terminal_info = default_terminal.terminal_info
+positions_get = default_terminal.positions_get
+orders_get = default_terminal.orders_get
+order_send = default_terminal.order_send
+symbol_info = default_terminal.symbol_info
+symbol_info_tick = default_terminal.symbol_info_tick
@@ -0,0 +1,236 @@
+"""
+EA State Store
+Durable per-account runtime state (secured tickets, TP1-hit groups, cached signal data)
+in a local SQLite database in WAL mode, so a restarted EA resumes where it stopped
+instead of re-checking every ticket and re-sending SLTP modifications.
+
+The EA keeps working on its in-memory sets/dicts; once per cycle sync() diffs them
+against what was last persisted and writes only the changes, in one transaction.
+"""
+
+import os
+import json
+import time
+import pickle
+import sqlite3
+from contextlib import contextmanager
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS secured_positions (
+    ticket INTEGER PRIMARY KEY,
+    secured_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tp1_hit_groups (
+    group_id TEXT PRIMARY KEY,
+    hit_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS signal_data (
+    group_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,             -- JSON
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class StateStore:
+    """
+    SQLite (WAL) store for one account. load() returns the persisted state for a warm
+    start; sync() persists the difference between the live state and the last sync.
+    Writes are grouped into a single transaction per sync, with synchronous=NORMAL:
+    in WAL mode a committed cycle survives a process crash, and at most the last
+    cycles are lost on power failure.
+    """
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self.conn.executescript(SCHEMA)
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        # What the database currently holds (compared against the live state in sync)
+        self.persisted_secured = set()
+        self.persisted_tp1 = set()
+        self.persisted_signals = {}  # group_id -> JSON text
+        self.stats = {'syncs': 0, 'writes': 0, 'rows_written': 0, 'rows_deleted': 0}
+
+    def load(self):
+        """(secured_positions, tp1_hit_groups, signal_data) as persisted by the last sync"""
+        self.persisted_secured = {row[0] for row in self.conn.execute("SELECT ticket FROM secured_positions")}
+        self.persisted_tp1 = {row[0] for row in self.conn.execute("SELECT group_id FROM tp1_hit_groups")}
+        self.persisted_signals = dict(self.conn.execute("SELECT group_id, data FROM signal_data"))
+        signals = {group_id: json.loads(data) for group_id, data in self.persisted_signals.items()}
+        return set(self.persisted_secured), set(self.persisted_tp1), signals
+
+    def sync(self, secured_positions, tp1_hit_groups, signal_data):
+        """Persist what changed since the last sync. Returns the number of rows touched."""
+        self.stats['syncs'] += 1
+        secured_added = secured_positions - self.persisted_secured
+        secured_removed = self.persisted_secured - secured_positions
+        tp1_added = tp1_hit_groups - self.persisted_tp1
+        tp1_removed = self.persisted_tp1 - tp1_hit_groups
+
+        signals = {}
+        for group_id, data in signal_data.items():
+            encoded = json.dumps(data, sort_keys=True, default=str)
+            if self.persisted_signals.get(group_id) != encoded:
+                signals[group_id] = encoded
+        signals_removed = self.persisted_signals.keys() - signal_data.keys()
+
+        changes = (len(secured_added) + len(secured_removed) + len(tp1_added) + len(tp1_removed)
+                   + len(signals) + len(signals_removed))
+        if not changes:
+            return 0
+
+        now = self.clock()
+        with self.transaction():
+            self.conn.executemany("INSERT OR REPLACE INTO secured_positions (ticket, secured_at) VALUES (?, ?)",
+                                  [(ticket, now) for ticket in secured_added])
+            self.conn.executemany("DELETE FROM secured_positions WHERE ticket = ?",
+                                  [(ticket,) for ticket in secured_removed])
+            self.conn.executemany("INSERT OR REPLACE INTO tp1_hit_groups (group_id, hit_at) VALUES (?, ?)",
+                                  [(group_id, now) for group_id in tp1_added])
+            self.conn.executemany("DELETE FROM tp1_hit_groups WHERE group_id = ?",
+                                  [(group_id,) for group_id in tp1_removed])
+            self.conn.executemany("INSERT OR REPLACE INTO signal_data (group_id, data, updated_at) VALUES (?, ?, ?)",
+                                  [(group_id, encoded, now) for group_id, encoded in signals.items()])
+            self.conn.executemany("DELETE FROM signal_data WHERE group_id = ?",
+                                  [(group_id,) for group_id in signals_removed])
+
+        # Only after the commit: a failed transaction is retried in full next sync
+        self.persisted_secured.difference_update(secured_removed)
+        self.persisted_secured.update(secured_added)
+        self.persisted_tp1.difference_update(tp1_removed)
+        self.persisted_tp1.update(tp1_added)
+        for group_id in signals_removed:
+            del self.persisted_signals[group_id]
+        self.persisted_signals.update(signals)
+        self.stats['writes'] += 1
+        self.stats['rows_written'] += len(secured_added) + len(tp1_added) + len(signals)
+        self.stats['rows_deleted'] += len(secured_removed) + len(tp1_removed) + len(signals_removed)
+        return changes
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT, rolled back on error (the connection runs in autocommit mode)"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class SnapshotJournal:
+    """
+    File-backed set of strings (TP1-hit group IDs when the SQLite store is disabled):
+    a snapshot file holding the live members plus an append-only journal of additions.
+    Loading reads the snapshot and replays the journal. compact() rewrites the snapshot
+    from the live set (temp file + fsync + atomic replace) and then truncates the
+    journal, so both files scale with the live set rather than the account's history.
+    A crash between the two steps only replays additions the snapshot already has.
+    Journal lines written before this format (bare IDs, no snapshot) load unchanged.
+    """
+
+    def __init__(self, journal_path, snapshot_path=None, max_journal_bytes=64 * 1024,
+                 compact_interval=3600, clock=time.time):
+        self.journal_path = journal_path
+        self.snapshot_path = snapshot_path or os.path.splitext(journal_path)[0] + '.snapshot'
+        self.max_journal_bytes = max_journal_bytes
+        self.compact_interval = compact_interval
+        self.clock = clock
+        self.journal_bytes = 0
+        self.last_compaction = clock()
+        self.stats = {'appends': 0, 'compactions': 0}
+
+    def exists(self):
+        return os.path.exists(self.journal_path) or os.path.exists(self.snapshot_path)
+
+    def load(self):
+        members = set()
+        for path in (self.snapshot_path, self.journal_path):
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    members.update(line.strip() for line in f if line.strip())
+        self.journal_bytes = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+        return members
+
+    def append(self, member):
+        line = f"{member}\n".encode('utf-8')
+        with open(self.journal_path, 'ab') as f:
+            f.write(line)
+        self.journal_bytes += len(line)
+        self.stats['appends'] += 1
+
+    def maybe_compact(self, members):
+        """Compact when the journal outgrows max_journal_bytes or compact_interval has passed"""
+        if self.journal_bytes == 0:
+            return False
+        if self.journal_bytes < self.max_journal_bytes and self.clock() - self.last_compaction < self.compact_interval:
+            return False
+        self.compact(members)
+        return True
+
+    def compact(self, members):
+        tmp = self.snapshot_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.writelines(f"{member}\n" for member in sorted(members))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+        open(self.journal_path, 'w').close()
+        self.journal_bytes = 0
+        self.last_compaction = self.clock()
+        self.stats['compactions'] += 1
+
+    def retire(self, suffix):
+        """Rename both files out of the way (e.g. after migrating into the StateStore)"""
+        for path in (self.snapshot_path, self.journal_path):
+            if os.path.exists(path):
+                os.replace(path, path + suffix)
+
+
+class StateSnapshotFile:
+    """
+    Latest runtime-state handoff from a primary EA to its warm standby. The primary
+    rewrites the whole (small) snapshot via a temp file and an atomic replace, so the
+    standby always reads a complete snapshot, never a half-written one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.stats = {'written': 0, 'bytes': 0}
+
+    def write(self, state):
+        state = dict(state, written_at=time.time())
+        data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+        self.stats['written'] += 1
+        self.stats['bytes'] = len(data)
+
+    def read(self):
+        """The last snapshot written, or None if there is none (or it cannot be read)"""
+        try:
+            with open(self.path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
@@ -0,0 +1,55 @@
+"""
+Shared fixtures for the EA tests. They run against the simulated terminal, so no
+MetaTrader5 installation is needed:
+
+  python -m pytest -q tests
+"""
+
+import os
+import sys
+
+os.environ['PIP_SECURE_BACKEND'] = 'simulated'  # Before multi_account_ea is imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from simulated_mt5 import SimulatedMT5Backend
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Run every test in its own directory: logs/, heartbeats/ and state files land there"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def sim():
+    backend = SimulatedMT5Backend()
+    backend.add_symbol('EURUSD', 1.10000, 1.10002, digits=5)
+    return backend
+
+
+@pytest.fixture
+def make_ea(sim):
+    """Build PipSecureEA instances on the simulated terminal and release their logs/stores afterwards"""
+    from multi_account_ea import PipSecureEA
+    created = []
+
+    def make(config, backend=None):
+        ea = PipSecureEA(dict({'login': 1}, **config), backend=backend or sim)
+        created.append(ea)
+        return ea
+
+    yield make
+    for ea in created:
+        ea.stop_logging()
+        for handler in list(ea.logger.handlers):
+            handler.close()
+            ea.logger.removeHandler(handler)
+        if ea.key_events is not None:
+            ea.key_events.close()
+        if ea.state_store is not None:
+            ea.state_store.close()
+        if ea.heartbeat.slots is not None:
+            ea.heartbeat.slots.close()
@@ -0,0 +1,61 @@
+import os
+
+from multi_account_ea import HeartbeatSlots
+
+
+class WriterDuringRead:
+    """SEQ stand-in that lets a writer publish a beat after the reader copied the slot, before it re-checks"""
+
+    def __init__(self, seq, writer, on_read=2):
+        self.seq = seq
+        self.size = seq.size
+        self.writer = writer
+        self.on_read = on_read
+        self.reads = 0
+
+    def unpack_from(self, buffer, offset=0):
+        self.reads += 1
+        if self.reads == self.on_read:
+            self.writer()
+        return self.seq.unpack_from(buffer, offset)
+
+    def pack_into(self, buffer, offset, *values):
+        self.seq.pack_into(buffer, offset, *values)
+
+
+def test_read_retries_when_a_write_lands_mid_read(tmp_path):
+    slots = HeartbeatSlots(str(tmp_path))
+    index = slots.claim('SimSlots')
+    slots.write(index, os.getpid(), 1, 0.5, 0)
+    seq = slots.SEQ = WriterDuringRead(HeartbeatSlots.SEQ,
+                                       lambda: slots.write(index, os.getpid(), 2, 0.25, 3))
+
+    slot = slots.read(index)
+
+    # The first copy (old beat) was discarded when the sequence moved; the retry reads the new beat
+    assert seq.reads > 2
+    assert (slot.cycles, slot.last_cycle_duration, slot.errors) == (2, 0.25, 3)
+    slots.close()
+
+
+def test_read_gives_up_on_a_slot_left_mid_write(tmp_path):
+    slots = HeartbeatSlots(str(tmp_path))
+    index = slots.claim('SimSlots')
+    slots.write(index, os.getpid(), 1, 0.5, 0)
+    # A writer that died between its two sequence stores leaves the sequence odd
+    offset = slots._offset(index)
+    slots.SEQ.pack_into(slots.mm, offset, slots.SEQ.unpack_from(slots.mm, offset)[0] + 1)
+
+    assert slots.read(index, retries=5) is None
+    slots.close()
+
+
+def test_claim_reuses_the_account_slot(tmp_path):
+    slots = HeartbeatSlots(str(tmp_path))
+    first = slots.claim('SimA')
+    second = slots.claim('SimB')
+    assert first != second
+    reopened = HeartbeatSlots(str(tmp_path))
+    assert reopened.claim('SimA') == first
+    reopened.close()
+    slots.close()
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+
+from multi_account_ea import HeartbeatMonitor
+
+CONFIG = {'name': 'SimStandby', 'warm_standby': True, 'standby_takeover_after': 0.3,
+          'standby_poll_interval': 0.02, 'standby_startup_grace': 10.0}
+
+
+def make_standby(make_ea):
+    standby = make_ea(CONFIG)
+    # Same process in the tests: give the standby's beats a PID of its own
+    standby.heartbeat.pid = os.getpid() + 1
+    return standby
+
+
+def test_standby_takes_over_stale_primary(make_ea):
+    primary = make_ea(CONFIG)
+    assert primary.connect()
+    primary.secured_positions.add(100001)
+    primary.tp1_hit_groups.add('G1')
+    primary.persist_state()
+    primary.publish_standby_snapshot(force=True)
+
+    standby = make_standby(make_ea)
+    standby.role = 'standby'
+    assert standby.connect()
+    assert standby.heartbeat.beats == 0  # Waiting never touches the primary's slot
+    assert primary.heartbeat.holds_lease()
+
+    waiter = threading.Thread(target=standby.wait_as_standby, daemon=True)
+    waiter.start()
+    for _ in range(5):  # The primary beats a few cycles, then hangs
+        primary.beat(cycle_duration=0.01)
+        time.sleep(0.05)
+    assert standby.role == 'standby'
+    waiter.join(5)
+
+    assert not waiter.is_alive()
+    assert standby.role == 'primary'
+    assert standby.secured_positions == {100001}
+    assert standby.tp1_hit_groups == {'G1'}
+    assert standby.heartbeat.get_slot().pid == standby.heartbeat.pid
+
+
+def test_old_primary_steps_down_after_takeover(make_ea, monkeypatch):
+    primary = make_ea(CONFIG)
+    assert primary.connect()
+    primary.beat(cycle_duration=0.01)
+
+    standby = make_standby(make_ea)
+    standby.role = 'standby'
+    assert standby.connect()
+    standby.take_over("test")
+    assert not primary.heartbeat.holds_lease()
+
+    # The old primary resumes (e.g. after a stall): it must stop without acting
+    cycles = []
+    monkeypatch.setattr(primary, 'connect', lambda: True)
+    monkeypatch.setattr(primary, 'check_positions', lambda: cycles.append(1))
+    primary.run()
+
+    assert primary.role == 'stepped_down'
+    assert cycles == []
+    assert standby.heartbeat.holds_lease()
+
+
+def test_lease_follows_the_last_writer():
+    primary = HeartbeatMonitor('SimLease')
+    primary.update_heartbeat()
+    other = HeartbeatMonitor('SimLease')
+    other.pid = os.getpid() + 1
+    assert primary.holds_lease()
+    other.update_heartbeat()
+    assert not primary.holds_lease()
+    assert other.holds_lease()
+    primary.slots.close()
+    other.slots.close()
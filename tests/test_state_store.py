@@ -0,0 +1,93 @@
+import os
+import sqlite3
+
+import pytest
+
+import state_store
+from state_store import SnapshotJournal, StateStore
+
+
+class FailingConnection:
+    """Proxy for the store's connection that fails the first statement containing fail_on"""
+
+    def __init__(self, conn, fail_on):
+        self.conn = conn
+        self.fail_on = fail_on
+
+    def execute(self, *args):
+        return self.conn.execute(*args)
+
+    def executemany(self, sql, rows):
+        if self.fail_on is not None and self.fail_on in sql:
+            self.fail_on = None
+            raise sqlite3.OperationalError("disk I/O error")
+        return self.conn.executemany(sql, rows)
+
+    def close(self):
+        self.conn.close()
+
+
+def test_sync_after_failed_transaction_writes_everything(tmp_path):
+    store = StateStore(str(tmp_path / 'state.sqlite'))
+    store.load()
+    store.sync({1, 2}, {'G1'}, {'G1': {'tp_levels': [1.1]}})
+
+    secured, tp1, signals = {2, 3}, {'G1', 'G2'}, {'G2': {'tp_levels': [1.2]}}
+    store.conn = FailingConnection(store.conn, fail_on='signal_data')
+    with pytest.raises(sqlite3.OperationalError):
+        store.sync(secured, tp1, signals)
+
+    # Rolled back: neither the database nor the persisted view moved
+    assert store.persisted_secured == {1, 2}
+    assert StateStore(store.path).load() == ({1, 2}, {'G1'}, {'G1': {'tp_levels': [1.1]}})
+
+    # The next sync retries the whole difference
+    assert store.sync(secured, tp1, signals) == 5
+    assert StateStore(store.path).load() == (secured, tp1, signals)
+    assert store.sync(secured, tp1, signals) == 0
+    store.close()
+
+
+class Crash(Exception):
+    pass
+
+
+def test_journal_load_after_crash_between_replace_and_truncate(tmp_path, monkeypatch):
+    journal = SnapshotJournal(str(tmp_path / 'tp1_hit_groups.txt'))
+    for group_id in ('G1', 'G2', 'G3'):
+        journal.append(group_id)
+
+    replace = os.replace
+
+    def replace_then_crash(src, dst):
+        replace(src, dst)
+        raise Crash()
+
+    monkeypatch.setattr(state_store.os, 'replace', replace_then_crash)
+    with pytest.raises(Crash):
+        journal.compact({'G2', 'G3'})  # G1 no longer live
+    monkeypatch.setattr(state_store.os, 'replace', replace)
+
+    # The snapshot is in place, the journal still holds every addition
+    restarted = SnapshotJournal(journal.journal_path)
+    assert restarted.load() == {'G1', 'G2', 'G3'}
+    restarted.append('G4')
+    restarted.compact({'G2', 'G3', 'G4'})
+    assert SnapshotJournal(journal.journal_path).load() == {'G2', 'G3', 'G4'}
+
+
+def test_journal_load_after_crash_before_replace(tmp_path, monkeypatch):
+    journal = SnapshotJournal(str(tmp_path / 'tp1_hit_groups.txt'))
+    journal.append('G1')
+    journal.compact({'G1'})
+    journal.append('G2')
+
+    def crash(src, dst):
+        raise Crash()
+
+    monkeypatch.setattr(state_store.os, 'replace', crash)
+    with pytest.raises(Crash):
+        journal.compact({'G1', 'G2'})
+
+    # The half-done snapshot stays in its temp file; the old snapshot plus journal are intact
+    assert SnapshotJournal(journal.journal_path).load() == {'G1', 'G2'}
@@ -0,0 +1,56 @@
+import json
+import time
+
+import pytest
+
+from multi_account_ea import EXIT_STEPPED_DOWN, MultiAccountMonitor, SupervisedProcess
+
+ACCOUNT = {'name': 'SimSupervised', 'login': 1, 'warm_standby': True}
+
+
+class FakeProcess:
+    def __init__(self, pid, exitcode=None):
+        self.pid = pid
+        self.exitcode = exitcode
+
+    def join(self, timeout=None):
+        pass
+
+    def is_alive(self):
+        return self.exitcode is None
+
+
+@pytest.fixture
+def monitor(tmp_path):
+    config_file = tmp_path / 'accounts_config.json'
+    config_file.write_text(json.dumps([ACCOUNT]))
+    monitor = MultiAccountMonitor(str(config_file), central_logging=False)
+    now = time.monotonic()
+    primary = SupervisedProcess(ACCOUNT['name'], ACCOUNT)
+    standby = SupervisedProcess(ACCOUNT['name'], ACCOUNT, standby=True)
+    primary.started(FakeProcess(1001), False, now)
+    standby.started(FakeProcess(1002), True, now)
+    monitor.slots = {primary.name: primary, standby.name: standby}
+    return monitor, primary, standby
+
+
+@pytest.mark.parametrize('exitcode', [1, -9, EXIT_STEPPED_DOWN])
+def test_standby_becomes_primary_when_the_primary_exits(monitor, exitcode):
+    monitor, primary, standby = monitor
+    primary.process.exitcode = exitcode
+
+    monitor._handle_exit(primary, time.monotonic())
+
+    status = monitor.supervisor_status()
+    assert status[standby.name]['role'] == 'primary'
+    assert status[primary.name]['state'] == 'restarting'
+
+
+def test_primary_keeps_its_role_when_the_standby_crashes(monitor):
+    monitor, primary, standby = monitor
+    standby.process.exitcode = 1
+
+    monitor._handle_exit(standby, time.monotonic())
+
+    assert not primary.standby
+    assert standby.standby